@@ -0,0 +1,257 @@
+# backend/admission.py
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+
+# ── Control de admisión ────────────────────────────────────────────────────────
+# Cada clase de trabajo tiene N slots de ejecución y una cola acotada.
+# Además, por usuario (username ya saneado): máximo de peticiones en vuelo
+# y un token bucket de peticiones por minuto.
+# Si algo no cabe se rechaza al instante con 429 y un Retry-After calculado
+# a partir del tiempo medio de servicio medido (EWMA) de la clase.
+# Todo el estado se toca solo desde el event loop → sin locks.
+# Un bucket que ya se habría rellenado del todo es igual que no tenerlo, así
+# que se borra: el diccionario solo guarda a quien ha pedido algo hace poco.
+
+USER_MAX_INFLIGHT = int(os.getenv("PALABRIA_USER_MAX_INFLIGHT", "2"))
+USER_RATE_PER_MIN = float(os.getenv("PALABRIA_USER_RATE_PER_MIN", "12"))
+USER_BURST        = float(os.getenv("PALABRIA_USER_BURST", "6"))
+
+# Tope de espera de wait_idle(): pasado este tiempo la valoración global pasa
+# aunque sigan llegando correcciones, para que no se quede esperando siempre
+IDLE_MAX_WAIT_SECS = float(os.getenv("PALABRIA_IDLE_MAX_WAIT_SECS", "60"))
+
+EWMA_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail      = detail
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class WorkClass:
+    def __init__(self, name: str, workers: int, max_queue: int, initial_service_secs: float):
+        self.name         = name
+        self.workers      = workers
+        self.max_queue    = max_queue
+        self.running      = 0
+        self.waiters      = deque()
+        self.service_secs = initial_service_secs
+        self.admitted     = 0
+        self.rejected     = 0
+        self.idle_waiters = []      # futures de wait_idle()
+
+    def idle(self) -> bool:
+        return self.running == 0 and not self.waiters
+
+    def estimate_wait(self, ahead: int) -> float:
+        """Segundos estimados hasta que se libere un slot con `ahead` tickets delante."""
+        busy = self.running + ahead - self.workers + 1
+        return max(0, busy) * self.service_secs / self.workers
+
+    def observe(self, secs: float):
+        self.service_secs = (1 - EWMA_ALPHA) * self.service_secs + EWMA_ALPHA * secs
+
+    def _grant_next(self):
+        while self.waiters and self.running < self.workers:
+            ticket = self.waiters.popleft()
+            if ticket._granted.done():
+                continue
+            self.running += 1
+            ticket._granted.set_result(True)
+        if self.idle() and self.idle_waiters:
+            waiting, self.idle_waiters = self.idle_waiters, []
+            for fut in waiting:
+                if not fut.done():
+                    fut.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "workers":      self.workers,
+            "running":      self.running,
+            "queued":       len(self.waiters),
+            "max_queue":    self.max_queue,
+            "service_secs": round(self.service_secs, 2),
+            "admitted":     self.admitted,
+            "rejected":     self.rejected,
+        }
+
+
+CLASSES = {
+    "correction": WorkClass(
+        "correction",
+        workers=int(os.getenv("PALABRIA_CORRECTION_WORKERS", "1")),
+        max_queue=int(os.getenv("PALABRIA_CORRECTION_QUEUE", "16")),
+        initial_service_secs=20.0,
+    ),
+    "batch": WorkClass(
+        "batch",
+        workers=int(os.getenv("PALABRIA_BATCH_WORKERS", "1")),
+        max_queue=int(os.getenv("PALABRIA_BATCH_QUEUE", "4")),
+        initial_service_secs=300.0,
+    ),
+    # Valoraciones globales: baja prioridad, ver wait_idle()
+    "feedback": WorkClass(
+        "feedback",
+        workers=int(os.getenv("PALABRIA_FEEDBACK_WORKERS", "1")),
+        max_queue=int(os.getenv("PALABRIA_FEEDBACK_QUEUE", "32")),
+        initial_service_secs=30.0,
+    ),
+}
+
+_user_inflight: dict = {}   # username → tickets sin liberar (en cola o en ejecución)
+_user_buckets:  dict = {}   # username → (tokens, último refill)
+_last_prune = 0.0
+
+
+def _prune_buckets(now: float, rate: float):
+    """Borra los buckets que ya estarían llenos (como mucho una vez por horizonte de refill)."""
+    global _last_prune
+    horizon = USER_BURST / rate
+    if now - _last_prune < horizon:
+        return
+    _last_prune = now
+    full = [u for u, (tokens, last) in _user_buckets.items() if tokens + (now - last) * rate >= USER_BURST]
+    for u in full:
+        del _user_buckets[u]
+
+
+def _take_token(username: str) -> float:
+    """Consume un token del usuario. Devuelve 0 si hay, o los segundos hasta el siguiente."""
+    now = time.monotonic()
+    rate = USER_RATE_PER_MIN / 60.0
+    _prune_buckets(now, rate)
+    tokens, last = _user_buckets.get(username, (USER_BURST, now))
+    tokens = min(USER_BURST, tokens + (now - last) * rate)
+    if tokens < 1.0:
+        _user_buckets[username] = (tokens, now)
+        return (1.0 - tokens) / rate
+    _user_buckets[username] = (tokens - 1.0, now)
+    return 0.0
+
+
+class Ticket:
+    def __init__(self, wc: WorkClass, username: str):
+        self.wc       = wc
+        self.username = username
+        self._granted = asyncio.get_running_loop().create_future()
+        self._started = None
+        self._released = False
+
+    def position(self) -> int:
+        """Posición en la cola (1 = siguiente); 0 si ya se está ejecutando."""
+        if self._granted.done():
+            return 0
+        try:
+            return self.wc.waiters.index(self) + 1
+        except ValueError:
+            return 0
+
+    async def wait(self):
+        await self._granted
+        self._started = time.monotonic()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        wc = self.wc
+        if self._granted.done() and not self._granted.cancelled():
+            wc.running -= 1
+            if self._started is not None:
+                wc.observe(time.monotonic() - self._started)
+        else:
+            self._granted.cancel()
+            try:
+                wc.waiters.remove(self)
+            except ValueError:
+                pass
+        n = _user_inflight.get(self.username, 1) - 1
+        if n > 0:
+            _user_inflight[self.username] = n
+        else:
+            _user_inflight.pop(self.username, None)
+        wc._grant_next()
+
+    async def __aenter__(self):
+        try:
+            await self.wait()
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def reserve(work_class: str, username: str) -> Ticket:
+    """
+    Reserva sitio en la cola de `work_class` para `username` o lanza Rejected.
+    No espera: la espera ocurre en `await ticket.wait()` / `async with ticket`.
+    """
+    wc = CLASSES[work_class]
+
+    if _user_inflight.get(username, 0) >= USER_MAX_INFLIGHT:
+        wc.rejected += 1
+        raise Rejected(
+            "Ya tienes demasiados análisis en curso. Espera a que terminen.",
+            wc.service_secs,
+        )
+
+    if wc.running >= wc.workers and len(wc.waiters) >= wc.max_queue:
+        wc.rejected += 1
+        raise Rejected(
+            "El servidor está ocupado. Inténtalo de nuevo más tarde.",
+            wc.estimate_wait(len(wc.waiters)),
+        )
+
+    wait_token = _take_token(username)
+    if wait_token > 0:
+        wc.rejected += 1
+        raise Rejected("Demasiadas peticiones seguidas. Inténtalo en unos segundos.", wait_token)
+
+    ticket = Ticket(wc, username)
+    _user_inflight[username] = _user_inflight.get(username, 0) + 1
+    wc.admitted += 1
+    if wc.running < wc.workers and not wc.waiters:
+        wc.running += 1
+        ticket._granted.set_result(True)
+    else:
+        wc.waiters.append(ticket)
+    return ticket
+
+
+async def wait_idle(work_class: str, max_wait: float | None = IDLE_MAX_WAIT_SECS) -> bool:
+    """
+    Espera a que `work_class` no tenga nada en ejecución ni en cola.
+    Los trabajos de baja prioridad lo llaman antes de pedir la GPU para
+    no adelantarse a las correcciones que ya esperan. Con `max_wait` deja de
+    esperar pasados esos segundos y devuelve False (True si llegó a vaciarse).
+    """
+    wc = CLASSES[work_class]
+    loop = asyncio.get_running_loop()
+    deadline = None if max_wait is None else loop.time() + max_wait
+    while not wc.idle():
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            return False
+        fut = loop.create_future()
+        wc.idle_waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, remaining)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if fut in wc.idle_waiters:
+                wc.idle_waiters.remove(fut)
+    return True
+
+
+def get_stats() -> dict:
+    return {name: wc.stats() for name, wc in CLASSES.items()}
@@ -0,0 +1,163 @@
+# backend/cohorts.py
+import os
+import threading
+import time
+
+import backend.db as db
+import backend.shared as shared
+
+
+# ── Panel de cohortes ──────────────────────────────────────────────────────────
+# Indicadores de clase: por alumno se leen los rollups de todos los miembros
+# en una consulta por conjunto (db.get_users_rollups) y aquí se calculan las
+# distribuciones (percentiles). El resultado se cachea por cohorte junto con
+# su sello: los miembros y la versión de cada uno en backend/shared.py, que
+# sube con el hook de escritura de la DB en cualquier worker. Cada consulta
+# lee la lista de miembros (una consulta por índice) y las versiones; si el
+# sello coincide se sirve la caché, si no se recalcula. Así un alta, una baja
+# o un documento nuevo en otro worker invalidan también la caché de este.
+# CACHE_TTL acota además la vida de la entrada: las ventanas de "últimos 30
+# días" avanzan solas.
+
+CACHE_TTL   = float(os.getenv("PALABRIA_COHORT_CACHE_SECS", "300"))
+PERCENTILES = (10, 25, 50, 75, 90)
+
+_lock  = threading.Lock()
+_cache: dict = {}    # nombre → (creado, sello, set de user_id, resultado)
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    """Percentil con interpolación lineal (el de numpy por defecto)."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _distribution(values: list) -> dict:
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"n": 0}
+    out = {
+        "n":    len(values),
+        "min":  round(values[0], 2),
+        "max":  round(values[-1], 2),
+        "mean": round(sum(values) / len(values), 2),
+    }
+    for p in PERCENTILES:
+        out[f"p{p}"] = round(_percentile(values, p), 2)
+    return out
+
+
+def _student(row: dict, username: str) -> dict:
+    docs = int(row.get("docs") or 0)
+    n_changes = row.get("n_cambios_realizados_usuario") or 0
+    sessions = int(row.get("session_count") or 0)
+    return {
+        "username":             username,
+        "docs":                 docs,
+        "pct_tu":               round(row["docs_with_tu"] * 100.0 / docs, 1) if docs else None,
+        "pct_sin_cambios":      round(row["docs_no_changes"] * 100.0 / docs, 1) if docs else None,
+        "avg_cambios":          round(row["sum_cambios_realizados_usuario"] / n_changes, 2) if n_changes else None,
+        "login_days":           int(row.get("login_days") or 0),
+        "avg_session_minutes":  round(row["session_seconds"] / sessions / 60.0, 1) if sessions else None,
+        "active_days_30":       int(row.get("active_days_30") or 0),
+        "minutes_30":           round((row.get("seconds_30") or 0.0) / 60.0, 1),
+        "docs_30":              int(row.get("docs_30") or 0),
+        "last_active_day":      row.get("last_active_day"),
+    }
+
+
+def _compute(name: str, members: dict) -> dict:
+    rows = {r["user_id"]: r for r in db.get_users_rollups(members)}
+    students = sorted(
+        (_student(rows.get(uid, {}), username) for uid, username in members.items()),
+        key=lambda s: s["username"],
+    )
+    return {
+        "cohort":   name,
+        "students": len(students),
+        "active_students_30": sum(1 for s in students if s["active_days_30"]),
+        "total_docs": sum(s["docs"] for s in students),
+        "distributions": {
+            key: _distribution([s[key] for s in students])
+            for key in (
+                "docs", "pct_tu", "pct_sin_cambios", "avg_cambios", "login_days",
+                "avg_session_minutes", "active_days_30", "minutes_30", "docs_30",
+            )
+        },
+        "per_student": students,
+        "computed_at": time.time(),
+    }
+
+
+def _stamp(members: dict) -> tuple:
+    """Miembros y versión compartida de cada uno: cambia con cualquier escritura suya."""
+    return tuple((uid, username, shared.version(uid)) for uid, username in sorted(members.items()))
+
+
+def get_dashboard(name: str) -> dict | None:
+    """Panel del cohorte (cacheado). None si el cohorte no existe."""
+    name = (name or "").strip()
+    members = db.get_cohort_members(name)
+    if members is None:
+        return None
+    # El sello se toma antes de leer los rollups: si entra una escritura
+    # mientras se calcula, la versión sube y esta entrada ya no se sirve
+    stamp = _stamp(members)
+    now = time.time()
+    with _lock:
+        hit = _cache.get(name)
+        if hit is not None and hit[1] == stamp and now - hit[0] < CACHE_TTL:
+            _stats["hits"] += 1
+            return hit[3]
+        _stats["misses"] += 1
+    result = _compute(name, members)
+    with _lock:
+        _cache[name] = (now, stamp, set(members), result)
+    return result
+
+
+def invalidate(name: str | None = None):
+    with _lock:
+        if name is None:
+            n = len(_cache)
+            _cache.clear()
+        else:
+            n = 1 if _cache.pop(name.strip(), None) is not None else 0
+        _stats["invalidations"] += n
+
+
+def _on_write(user_ids: set | None):
+    # Las versiones ya las subió shared; aquí solo se libera memoria
+    if user_ids is None:
+        invalidate()
+        return
+    with _lock:
+        stale = [name for name, (_, _, members, _) in _cache.items() if not members.isdisjoint(user_ids)]
+        for name in stale:
+            del _cache[name]
+        _stats["invalidations"] += len(stale)
+
+
+db.add_write_hook(_on_write)
+
+
+def set_members(name: str, usernames: list, replace: bool = False) -> dict:
+    result = db.add_cohort_members(name, usernames, replace=replace)
+    invalidate(name)
+    return result
+
+
+def remove_member(name: str, username: str) -> bool:
+    ok = db.remove_cohort_member(name, username)
+    invalidate(name)
+    return ok
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {**_stats, "cached": len(_cache), "ttl": CACHE_TTL}
@@ -1,11 +1,26 @@
 # backend/db.py
 from pathlib import Path
+import atexit
+import hashlib
+import json
+from collections import OrderedDict
 import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
 import re
+import zlib
 from typing import Optional
 
+try:
+    import zstandard
+except ImportError:     # en requirements.txt; sin él los textos nuevos van con zlib
+    zstandard = None
+
 DEFAULT_DB = "data/palabria.db"
 
 def get_db_path():
@@ -57,24 +72,1030 @@ CREATE TABLE IF NOT EXISTS usage_stats(
 );
 """
 
-def init_db():
-    con = sqlite3.connect(DB_PATH)
+# ── Pool de conexiones ─────────────────────────────────────────────────────────
+# Conexiones largas reutilizadas entre peticiones: los PRAGMA se aplican una
+# sola vez al abrir y cada conexión conserva su caché de sentencias preparadas
+# (cached_statements), así que las consultas repetidas no se vuelven a compilar.
+
+POOL_SIZE         = int(os.getenv("PALABRIA_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT      = float(os.getenv("PALABRIA_DB_POOL_TIMEOUT", "30"))
+STATEMENT_CACHE   = 256
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA synchronous = NORMAL;",     # seguro en WAL; fsync solo en checkpoint
+    "PRAGMA cache_size = -16000;",      # ~16 MB de caché de páginas
+    "PRAGMA mmap_size = 134217728;",    # 128 MB mapeados en memoria
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA busy_timeout = 5000;",
+)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+    )
+    con.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        con.execute(pragma)
+    return con
+
+
+class ConnectionPool:
+    """Pool thread-safe de conexiones SQLite a un mismo fichero."""
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path    = path
+        self.size    = size
+        self._idle   = queue.LifoQueue()
+        self._lock   = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return _connect(self.path)
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("No hay conexiones libres a la base de datos.")
+
+    def release(self, con: sqlite3.Connection):
+        if self._closed:
+            self.discard(con)
+            return
+        self._idle.put(con)
+
+    def discard(self, con: sqlite3.Connection):
+        with self._lock:
+            self._opened -= 1
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def close(self):
+        """Cierra las libres; las que estén en uso se cierran al devolverse."""
+        self._closed = True
+        self.close_all()
+
+
+def get_pool() -> ConnectionPool:
+    return _default_shard().pool
+
+
+# ── Migraciones ────────────────────────────────────────────────────────────────
+# Versión del esquema en PRAGMA user_version. Cada migración se aplica una vez,
+# en orden y en su propia transacción, al arrancar (init_db). Un paso puede ser
+# un script SQL o una función que recibe la conexión.
+
+def _run_script(con: sqlite3.Connection, script: str):
+    """Ejecuta un script sentencia a sentencia dentro de la transacción actual."""
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            if buf.strip():
+                con.execute(buf)
+            buf = ""
+    if buf.strip():
+        con.execute(buf)
+
+
+MIGRATIONS = [
+    (1, "índices secundarios para las consultas calientes", """
+        CREATE INDEX IF NOT EXISTS idx_usage_user_event   ON usage_stats(user_id, event, id);
+        CREATE INDEX IF NOT EXISTS idx_usage_event        ON usage_stats(event, id);
+        CREATE INDEX IF NOT EXISTS idx_metrics_doc_name   ON metrics(document_id, metric_name, id);
+        CREATE INDEX IF NOT EXISTS idx_metrics_name_doc   ON metrics(metric_name, document_id, id);
+        CREATE INDEX IF NOT EXISTS idx_documents_user     ON documents(user_id, id);
+    """),
+]
+
+# Métricas por documento: una fila por documento con columnas tipadas.
+# La tabla `metrics` queda como log histórico append-only, solo para lo que
+# necesita historia (ediciones del usuario) y métricas sin columna propia.
+DOCUMENT_METRIC_COLUMNS = (
+    "total_frases",
+    "frases_con_tu_impersonal",
+    "cambios_propuestos_modelo",
+    "cambios_realizados_usuario",
+)
+LOGGED_METRICS = {"cambios_realizados_usuario"}
+
+
+def _migrate_document_metrics(con: sqlite3.Connection):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS document_metrics(
+          document_id INTEGER PRIMARY KEY,
+          total_frases REAL,
+          frases_con_tu_impersonal REAL,
+          cambios_propuestos_modelo REAL,
+          cambios_realizados_usuario REAL,
+          updated_at TEXT DEFAULT (datetime('now')),
+          FOREIGN KEY(document_id) REFERENCES documents(id)
+        )
+    """)
+    latest = ",\n".join(
+        f"""(SELECT m.metric_value FROM metrics m
+             WHERE m.document_id = d.id AND m.metric_name = '{c}'
+             ORDER BY m.id DESC LIMIT 1)"""
+        for c in DOCUMENT_METRIC_COLUMNS
+    )
+    con.execute(f"""
+        INSERT OR REPLACE INTO document_metrics(document_id, {", ".join(DOCUMENT_METRIC_COLUMNS)})
+        SELECT d.id, {latest}
+        FROM documents d
+    """)
+
+
+MIGRATIONS.append((2, "tabla ancha document_metrics (backfill desde metrics)", _migrate_document_metrics))
+
+
+# Rollup por usuario mantenido en la misma transacción que cada escritura:
+# el overview pasa a ser una lectura por clave primaria.
+USER_STATS_METRIC_COLUMNS = tuple(
+    col for c in DOCUMENT_METRIC_COLUMNS for col in (f"n_{c}", f"sum_{c}")
+)
+
+
+def _migrate_user_stats(con: sqlite3.Connection):
+    metric_cols = ",\n".join(f"{c} REAL NOT NULL DEFAULT 0" for c in USER_STATS_METRIC_COLUMNS)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_stats(
+          user_id INTEGER PRIMARY KEY,
+          docs INTEGER NOT NULL DEFAULT 0,
+          docs_with_tu INTEGER NOT NULL DEFAULT 0,
+          docs_no_changes INTEGER NOT NULL DEFAULT 0,
+          {metric_cols},
+          login_days INTEGER NOT NULL DEFAULT 0,
+          last_login_day TEXT,
+          session_count INTEGER NOT NULL DEFAULT 0,
+          session_seconds REAL NOT NULL DEFAULT 0,
+          updated_at TEXT DEFAULT (datetime('now')),
+          FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS user_event_stats(
+          user_id INTEGER NOT NULL,
+          event TEXT NOT NULL,
+          n INTEGER NOT NULL DEFAULT 0,
+          n_value INTEGER NOT NULL DEFAULT 0,
+          sum_value REAL NOT NULL DEFAULT 0,
+          PRIMARY KEY(user_id, event),
+          FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    """)
+
+
+MIGRATIONS.append((3, "rollup por usuario user_stats + user_event_stats", _migrate_user_stats))
+
+
+# Sesiones de primera clase: antes se deducían de las filas login_ts,
+# heartbeat, session_duration y logout de usage_stats.
+MAX_SESSION_SECS = 12 * 3600.0
+
+
+def _migrate_sessions(con: sqlite3.Connection):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS sessions(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id INTEGER NOT NULL,
+          started_at REAL NOT NULL,
+          last_seen REAL NOT NULL,
+          ended_at REAL,
+          duration REAL,
+          FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_sessions_open ON sessions(last_seen) WHERE ended_at IS NULL")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_open ON sessions(user_id) WHERE ended_at IS NULL")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_ended ON sessions(user_id, ended_at)")
+
+    # Backfill reproduciendo la lógica anterior: la sesión abierta es la del
+    # último login_ts; un session_duration posterior la cierra con esa duración.
+    # Un login_ts que queda sin cerrar porque llega otro se da por terminado
+    # en su último heartbeat, sin duración (antes tampoco contaba).
+    rows = con.execute("""
+        SELECT user_id, event, value, CAST(strftime('%s', created_at) AS REAL) AS ts
+        FROM usage_stats
+        WHERE event IN ('login_ts', 'heartbeat', 'session_duration')
+        ORDER BY user_id, id
+    """)
+    open_by_user = {}
+    batch = []
+
+    def _flush():
+        con.executemany(
+            "INSERT INTO sessions(user_id, started_at, last_seen, ended_at, duration) VALUES(?,?,?,?,?)",
+            batch,
+        )
+        batch.clear()
+
+    for uid, event, value, ts in rows:
+        cur = open_by_user.get(uid)
+        if event == "login_ts":
+            if cur is not None:
+                batch.append((uid, cur[0], cur[1], cur[1], None))
+            start = float(value if value is not None else ts)
+            open_by_user[uid] = [start, start]
+        elif event == "heartbeat":
+            if cur is not None and value is not None:
+                cur[1] = max(cur[1], float(value))
+        elif event == "session_duration":
+            dur = float(value or 0.0)
+            if cur is not None:
+                batch.append((uid, cur[0], cur[1], cur[0] + dur, dur))
+                open_by_user.pop(uid, None)
+            else:
+                batch.append((uid, ts - dur, ts, ts, dur))
+        if len(batch) >= 5000:
+            _flush()
+    for uid, (start, last_seen) in open_by_user.items():
+        batch.append((uid, start, last_seen, None, None))
+    _flush()
+
+
+MIGRATIONS.append((4, "tabla sessions (backfill desde usage_stats)", _migrate_sessions))
+
+
+# Retención: los eventos crudos de usage_stats más viejos que el horizonte se
+# compactan en agregados diarios por usuario y evento (ver compact_usage).
+MIGRATIONS.append((5, "agregados diarios usage_daily", """
+    CREATE TABLE IF NOT EXISTS usage_daily(
+      user_id INTEGER NOT NULL,
+      day TEXT NOT NULL,
+      event TEXT NOT NULL,
+      n INTEGER NOT NULL DEFAULT 0,
+      n_value INTEGER NOT NULL DEFAULT 0,
+      sum_value REAL NOT NULL DEFAULT 0,
+      PRIMARY KEY(user_id, day, event),
+      FOREIGN KEY(user_id) REFERENCES users(id)
+    ) WITHOUT ROWID;
+"""))
+
+
+# Actividad diaria precalculada (día UTC): segundos de sesión (por día de
+# cierre), inicios de sesión y documentos. Se mantiene en cada escritura y
+# las consultas por rango van por clave primaria (user_id, day).
+MIGRATIONS.append((6, "tabla daily_activity (backfill en el rebuild final)", """
+    CREATE TABLE IF NOT EXISTS daily_activity(
+      user_id INTEGER NOT NULL,
+      day TEXT NOT NULL,
+      seconds REAL NOT NULL DEFAULT 0,
+      logins INTEGER NOT NULL DEFAULT 0,
+      docs INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY(user_id, day),
+      FOREIGN KEY(user_id) REFERENCES users(id)
+    ) WITHOUT ROWID;
+"""))
+
+
+
+# Textos de cada documento (original, salida del modelo, versión final del
+# usuario) en una tabla de blobs direccionada por contenido: clave = sha256
+# del texto, comprimido con zstd (si está instalado) o zlib, y con contador
+# de referencias. Dos documentos con el mismo texto comparten el blob.
+MIGRATIONS.append((7, "blobs de texto comprimidos y deduplicados", """
+    CREATE TABLE IF NOT EXISTS blobs(
+      hash TEXT PRIMARY KEY,
+      codec TEXT NOT NULL,
+      raw_size INTEGER NOT NULL,
+      stored_size INTEGER NOT NULL,
+      data BLOB NOT NULL,
+      refs INTEGER NOT NULL DEFAULT 0,
+      created_at TEXT DEFAULT (datetime('now'))
+    );
+    ALTER TABLE documents ADD COLUMN original_blob TEXT;
+    ALTER TABLE documents ADD COLUMN corrected_blob TEXT;
+    ALTER TABLE documents ADD COLUMN final_blob TEXT;
+"""))
+
+# Directorio para el sharding opcional (ver "Shards"): bloques de ids de
+# documento asignados a cada shard, documentos anteriores al reparto
+# (doc_directory) y el reparto con el que se partió la base.
+MIGRATIONS.append((8, "doc_blocks, doc_directory y shard_meta para el sharding", """
+    CREATE TABLE IF NOT EXISTS doc_blocks(
+      block INTEGER PRIMARY KEY,
+      shard_key INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS doc_directory(
+      id INTEGER PRIMARY KEY,
+      user_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS shard_meta(
+      key TEXT PRIMARY KEY,
+      value TEXT
+    );
+"""))
+
+# Cohortes (grupos de clase) para el panel del profesor. Viven en DB_PATH,
+# también con sharding, como la tabla users.
+MIGRATIONS.append((9, "cohorts y cohort_members", """
+    CREATE TABLE IF NOT EXISTS cohorts(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT UNIQUE NOT NULL,
+      created_at TEXT DEFAULT (datetime('now'))
+    );
+    CREATE TABLE IF NOT EXISTS cohort_members(
+      cohort_id INTEGER NOT NULL,
+      user_id INTEGER NOT NULL,
+      PRIMARY KEY(cohort_id, user_id),
+      FOREIGN KEY(cohort_id) REFERENCES cohorts(id),
+      FOREIGN KEY(user_id) REFERENCES users(id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_cohort_members_user ON cohort_members(user_id);
+"""))
+
+# Valoraciones globales ya generadas, por la tupla exacta de entrada al modelo.
+MIGRATIONS.append((10, "caché de valoraciones globales", """
+    CREATE TABLE IF NOT EXISTS global_feedback_cache(
+      model TEXT NOT NULL,
+      total_docs INTEGER NOT NULL,
+      login_days INTEGER NOT NULL,
+      pct_tu REAL NOT NULL,
+      pct_sin_cambios REAL NOT NULL,
+      avg_session_seconds REAL NOT NULL,
+      feedback TEXT NOT NULL,
+      created_at TEXT DEFAULT (datetime('now')),
+      PRIMARY KEY(model, total_docs, login_days, pct_tu, pct_sin_cambios, avg_session_seconds)
+    ) WITHOUT ROWID;
+"""))
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(con: sqlite3.Connection):
+    """
+    Aplica las migraciones pendientes. `con` debe estar en modo autocommit.
+    Si se aplicó alguna, los rollups se reconstruyen al final con el esquema
+    ya completo (las migraciones no los rellenan por su cuenta).
+    """
+    applied = False
+    for version, _desc, step in MIGRATIONS:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # Releer dentro de la transacción: otro proceso puede haber migrado ya
+            current = con.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                con.execute("ROLLBACK")
+                continue
+            if callable(step):
+                step(con)
+            else:
+                _run_script(con, step)
+            con.execute(f"PRAGMA user_version = {int(version)}")
+            con.execute("COMMIT")
+            applied = True
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    if applied:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            rebuild_user_stats(con)
+            rebuild_daily_activity(con)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+
+def _ensure_incremental_vacuum(con: sqlite3.Connection):
+    """auto_vacuum=INCREMENTAL; en una base ya creada requiere un VACUUM (una vez)."""
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if con.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        con.execute("VACUUM")
+
+
+def _init_file(path: str):
+    con = sqlite3.connect(path, isolation_level=None)
     try:
+        con.execute("PRAGMA busy_timeout = 5000;")
+        _ensure_incremental_vacuum(con)
         con.executescript(DDL)
-        con.commit()
+        migrate(con)
+    finally:
+        con.close()
+
+
+def init_db():
+    _init_file(DB_PATH)
+    con = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        con.execute("PRAGMA busy_timeout = 5000;")
+        layout = con.execute("SELECT value FROM shard_meta WHERE key='layout'").fetchone()
+        if sharding_enabled():
+            _split_into_shards(con, layout[0] if layout else None)
+        elif layout is not None:
+            raise RuntimeError(
+                f"La base está repartida en shards ({layout[0]}): arranca con DB_SHARDING igual."
+            )
     finally:
         con.close()
 
 @contextmanager
-def db():
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
+def _using(pool: ConnectionPool):
+    con = pool.acquire()
     try:
-        con.execute("PRAGMA foreign_keys = ON;")
         yield con
         con.commit()
+    except BaseException:
+        try:
+            con.rollback()
+        except sqlite3.Error:
+            pool.discard(con)
+            raise
+        pool.release(con)
+        raise
+    else:
+        pool.release(con)
+
+@contextmanager
+def db():
+    """Conexión a DB_PATH: la base única o, con shards, el directorio de usuarios."""
+    with _using(get_pool()) as con:
+        yield con
+
+# ── Escritura diferida (write-behind) ──────────────────────────────────────────
+# Todas las escrituras pasan por una cola y un único hilo escritor que agrupa
+# en una sola transacción (hasta WRITE_BATCH_MAX tareas) todo lo que se haya
+# acumulado mientras confirmaba el lote anterior, más lo que llegue en
+# WRITE_WINDOW_MS: un commit por lote en vez de uno por INSERT. Con la ventana
+# a 0 una escritura suelta no espera nada; subirla solo compensa si el commit
+# es caro (synchronous=FULL, disco lento).
+# Cada tarea es fn(con, *args) y corre en su propio SAVEPOINT, así que si una
+# falla solo se deshace esa y el resto del lote se confirma igual.
+# submit() devuelve un Future: quien necesita el resultado (create_document →
+# id) espera con .result(); los eventos de uso se encolan y se olvidan.
+
+WRITE_BATCH_MAX = int(os.getenv("PALABRIA_WRITE_BATCH_MAX", "256"))
+WRITE_WINDOW_MS = float(os.getenv("PALABRIA_WRITE_WINDOW_MS", "0"))
+
+EWMA_ALPHA = 0.2
+
+
+# Hooks de escritura: las cachés de lectura (p. ej. el panel de cohortes) se
+# registran con add_write_hook(fn) y reciben, tras cada commit del escritor y
+# antes de despertar a quien esperaba la escritura, los user_id cuyos rollups
+# (user_stats, daily_activity, user_event_stats) cambiaron, o None si
+# cambiaron los de todos.
+# Los latidos de sesión no tocan rollups y no disparan nada.
+
+_write_hooks: list = []
+_dirty = threading.local()
+
+
+def add_write_hook(fn):
+    _write_hooks.append(fn)
+
+
+def _mark_dirty(user_id: int | None):
+    users = getattr(_dirty, "users", None)
+    if users is None:
+        return          # fuera del escritor (migraciones, init): no hay cachés que avisar
+    if user_id is None:
+        _dirty.all = True
+    else:
+        users.add(user_id)
+
+
+def _run_write_hooks(users: set, everyone: bool):
+    if not (users or everyone):
+        return
+    for fn in _write_hooks:
+        try:
+            fn(None if everyone else users)
+        except Exception:
+            pass
+
+
+class WriteBehind:
+    def __init__(self, pool: ConnectionPool, idle_secs: float | None = None):
+        self.pool     = pool
+        self.idle_secs = idle_secs      # None = el hilo no termina nunca
+        self._q       = queue.Queue()
+        self._lock    = threading.Lock()
+        self._thread  = None
+        self._stats   = {
+            "batches":      0,
+            "writes":       0,
+            "errors":       0,
+            "max_batch":    0,
+            "avg_lag_ms":   0.0,
+            "max_lag_ms":   0.0,
+            "last_error":   None,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, name="palabria-db-writer", daemon=True)
+                t.start()
+                self._thread = t
+
+    def submit(self, fn, *args) -> Future:
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise RuntimeError("submit() desde el hilo escritor: usa la conexión de la tarea")
+        fut = Future()
+        # Encolar antes de arrancar: un hilo que sale por inactividad
+        # comprueba la cola vacía bajo el mismo lock
+        self._q.put((fn, args, fut, time.monotonic()))
+        self._ensure_started()
+        return fut
+
+    def _collect(self) -> list | None:
+        try:
+            batch = [self._q.get(timeout=self.idle_secs)]
+        except queue.Empty:
+            return None
+        deadline = time.monotonic() + WRITE_WINDOW_MS / 1000.0
+        while len(batch) < WRITE_BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._q.get(timeout=timeout))
+                else:
+                    batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                with self._lock:
+                    if self._q.empty():
+                        self._thread = None
+                        return
+                continue
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        outcomes = []
+        _dirty.users, _dirty.all = set(), False
+        try:
+            with _using(self.pool) as con:
+                con.execute("BEGIN IMMEDIATE")
+                for fn, args, fut, _ in batch:
+                    con.execute("SAVEPOINT wb")
+                    try:
+                        outcomes.append((fut, fn(con, *args), None))
+                    except Exception as e:
+                        con.execute("ROLLBACK TO wb")
+                        outcomes.append((fut, None, e))
+                    con.execute("RELEASE wb")
+            committed = True
+        except Exception as e:
+            outcomes = [(fut, None, e) for _, _, fut, _ in batch]
+            committed = False
+        users, everyone = _dirty.users, _dirty.all
+        _dirty.users = None
+        if committed:
+            _run_write_hooks(users, everyone)
+
+        now = time.monotonic()
+        lag_ms = max((now - t0) * 1000.0 for *_, t0 in batch)
+        with self._lock:
+            st = self._stats
+            st["batches"]   += 1
+            st["writes"]    += len(batch)
+            st["max_batch"]  = max(st["max_batch"], len(batch))
+            st["avg_lag_ms"] = (1 - EWMA_ALPHA) * st["avg_lag_ms"] + EWMA_ALPHA * lag_ms
+            st["max_lag_ms"] = max(st["max_lag_ms"], lag_ms)
+            for _, _, err in outcomes:
+                if err is not None:
+                    st["errors"] += 1
+                    st["last_error"] = f"{type(err).__name__}: {err}"
+
+        for fut, result, err in outcomes:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
+
+    def flush(self, timeout: float | None = None):
+        """Espera a que se confirme todo lo encolado hasta ahora."""
+        if self._thread is None:
+            return
+        self.submit(lambda con: None).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["queued"]     = self._q.qsize()
+        out["avg_batch"]  = round(out["writes"] / out["batches"], 2) if out["batches"] else 0.0
+        out["avg_lag_ms"] = round(out["avg_lag_ms"], 2)
+        out["max_lag_ms"] = round(out["max_lag_ms"], 2)
+        return out
+
+
+# ── Shards ─────────────────────────────────────────────────────────────────────
+# Cada fichero SQLite es un Shard: su pool y su escritor. Sin sharding solo
+# existe el shard por defecto (DB_PATH) y todo funciona como siempre.
+# Con DB_SHARDING=bucket (user_id % DB_SHARDS) o DB_SHARDING=user (un fichero
+# por usuario), DB_PATH pasa a ser el directorio: usuarios, doc_blocks y
+# shard_meta. Los ids de documento siguen siendo globales: cada shard reserva
+# en el directorio bloques de DOC_ID_BLOCK ids y los reparte en memoria, así
+# que crear un documento no toca el directorio y doc_id // DOC_ID_BLOCK dice
+# en qué shard está (los de antes del reparto van por doc_directory). Los datos de cada
+# usuario viven en su shard, que lleva una copia de su fila de `users` para
+# que las consultas por username y las FK funcionen igual que en la base única.
+# Cada shard tiene su propio lock de escritura y su hilo escritor, así que
+# usuarios de shards distintos escriben en paralelo. Los shards abiertos se
+# guardan en un LRU de como mucho DB_SHARD_MAX_OPEN (acota descriptores) y el
+# hilo escritor de un shard termina tras WRITER_IDLE_SECS sin trabajo.
+
+DB_SHARDING      = os.getenv("DB_SHARDING", "off").strip().lower()     # off | bucket | user
+DB_SHARDS        = int(os.getenv("DB_SHARDS", "16"))
+DB_SHARD_DIR     = os.getenv("DB_SHARD_DIR") or str(Path(DB_PATH).parent / "shards")
+SHARD_MAX_OPEN   = int(os.getenv("DB_SHARD_MAX_OPEN", "64"))
+SHARD_POOL_SIZE  = int(os.getenv("DB_SHARD_POOL_SIZE", "2"))
+WRITER_IDLE_SECS = float(os.getenv("PALABRIA_WRITER_IDLE_SECS", "30"))
+DOC_ID_BLOCK     = 1024     # fijo: cambiarlo con datos rompe doc_id → shard
+
+if DB_SHARDING not in ("off", "bucket", "user"):
+    raise RuntimeError(f"DB_SHARDING inválido: {DB_SHARDING!r} (off | bucket | user)")
+
+
+class Shard:
+    def __init__(self, key, path: str, pool_size: int, idle_secs: float | None):
+        self.key      = key
+        self.path     = path
+        self.pool     = ConnectionPool(path, pool_size)
+        self.writer   = WriteBehind(self.pool, idle_secs=idle_secs)
+        self.mirrored = set()       # user_id con su fila de users ya copiada
+        self._ids_lock = threading.Lock()
+        self._next_id  = 0
+        self._end_id   = 0          # bloque agotado → se reserva otro
+
+    def next_document_id(self) -> int:
+        with self._ids_lock:
+            if self._next_id >= self._end_id:
+                block = write(_alloc_doc_block_tx, self.key)
+                _block_keys[block] = self.key
+                self._next_id, self._end_id = block * DOC_ID_BLOCK, (block + 1) * DOC_ID_BLOCK
+            doc_id = self._next_id
+            self._next_id += 1
+            return doc_id
+
+    def close(self):
+        try:
+            self.writer.flush(10.0)
+        except Exception:
+            pass
+        self.pool.close()
+
+
+_default: Shard | None = None
+_default_lock = threading.Lock()
+_shards: OrderedDict = OrderedDict()    # key → Shard, en orden de uso
+_shards_lock = threading.Lock()
+_init_lock   = threading.Lock()
+_initialized: set = set()               # rutas de shard con esquema ya aplicado
+_block_keys: dict = {}                  # bloque de ids → shard (no cambia nunca)
+_shard_stats = {"opened": 0, "evicted": 0}
+
+
+def _default_shard() -> Shard:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Shard(None, DB_PATH, POOL_SIZE, idle_secs=None)
+    return _default
+
+
+def sharding_enabled() -> bool:
+    return DB_SHARDING != "off"
+
+
+def shard_key(user_id: int) -> int:
+    return user_id % DB_SHARDS if DB_SHARDING == "bucket" else int(user_id)
+
+
+def _shard_path(key: int) -> str:
+    name = f"shard-{key:03d}.db" if DB_SHARDING == "bucket" else f"user-{key}.db"
+    return str(Path(DB_SHARD_DIR) / name)
+
+
+def _shard_keys() -> list:
+    if DB_SHARDING == "bucket":
+        return list(range(DB_SHARDS))
+    return sorted(
+        int(p.stem.split("-", 1)[1]) for p in Path(DB_SHARD_DIR).glob("user-*.db")
+    )
+
+
+def _open_shard(key: int) -> Shard:
+    with _shards_lock:
+        sh = _shards.get(key)
+        if sh is not None:
+            _shards.move_to_end(key)
+            return sh
+
+    path = _shard_path(key)
+    if path not in _initialized:
+        with _init_lock:
+            if path not in _initialized:
+                Path(DB_SHARD_DIR).mkdir(parents=True, exist_ok=True)
+                _init_file(path)
+                _initialized.add(path)
+
+    evicted = []
+    with _shards_lock:
+        sh = _shards.get(key)
+        if sh is None:
+            sh = Shard(key, path, SHARD_POOL_SIZE, idle_secs=WRITER_IDLE_SECS)
+            _shards[key] = sh
+            _shard_stats["opened"] += 1
+            while len(_shards) > SHARD_MAX_OPEN:
+                evicted.append(_shards.popitem(last=False)[1])
+                _shard_stats["evicted"] += 1
+        _shards.move_to_end(key)
+    for old in evicted:
+        old.close()
+    return sh
+
+
+def _mirror_user_tx(con: sqlite3.Connection, user_id: int, username: str):
+    con.execute("INSERT OR IGNORE INTO users(id, username) VALUES(?,?)", (user_id, username))
+
+
+def _shard_for_user(user_id: int) -> Shard:
+    if not sharding_enabled():
+        return _default_shard()
+    sh = _open_shard(shard_key(user_id))
+    if user_id not in sh.mirrored:
+        with db() as con:
+            row = con.execute("SELECT username FROM users WHERE id=?", (user_id,)).fetchone()
+        if row is not None:
+            sh.writer.submit(_mirror_user_tx, user_id, row["username"]).result()
+            sh.mirrored.add(user_id)
+    return sh
+
+
+def _alloc_doc_block_tx(con: sqlite3.Connection, key: int) -> int:
+    # Primer bloque por encima de los ids anteriores al reparto
+    return con.execute("""
+        INSERT INTO doc_blocks(block, shard_key)
+        SELECT COALESCE(
+            (SELECT MAX(block) + 1 FROM doc_blocks),
+            (SELECT COALESCE(MAX(id), 0) FROM doc_directory) / ? + 1
+        ), ?
+        RETURNING block
+    """, (DOC_ID_BLOCK, key)).fetchone()[0]
+
+
+def _shard_for_doc(doc_id: int) -> Shard | None:
+    if not sharding_enabled():
+        return _default_shard()
+    block = doc_id // DOC_ID_BLOCK
+    key = _block_keys.get(block)
+    if key is None:
+        with db() as con:
+            row = con.execute("SELECT shard_key FROM doc_blocks WHERE block=?", (block,)).fetchone()
+            if row is None:
+                legacy = con.execute("SELECT user_id FROM doc_directory WHERE id=?", (doc_id,)).fetchone()
+                return _shard_for_user(legacy["user_id"]) if legacy is not None else None
+        key = _block_keys[block] = row["shard_key"]
+    return _open_shard(key)
+
+
+@contextmanager
+def user_db(user_id: int):
+    """Conexión al shard del usuario."""
+    with _using(_shard_for_user(user_id).pool) as con:
+        yield con
+
+
+@contextmanager
+def doc_db(doc_id: int):
+    """Conexión al shard del documento (o al directorio si no existe)."""
+    sh = _shard_for_doc(doc_id) or _default_shard()
+    with _using(sh.pool) as con:
+        yield con
+
+
+def for_each_shard(fn) -> list:
+    """
+    Consultas entre usuarios: fn(con) en cada shard (uno tras otro, para no
+    abrir más ficheros que el LRU) y lista de resultados para combinar.
+    Sin sharding es una sola llamada sobre la base única.
+    """
+    if not sharding_enabled():
+        with db() as con:
+            return [fn(con)]
+    out = []
+    for key in _shard_keys():
+        with _using(_open_shard(key).pool) as con:
+            out.append(fn(con))
+    return out
+
+
+def _write_on_all(fn, *args) -> list:
+    """fn(con, *args) en el escritor de cada shard, en paralelo; espera todos."""
+    if not sharding_enabled():
+        return [write(fn, *args)]
+    futures = [_open_shard(key).writer.submit(fn, *args) for key in _shard_keys()]
+    return [f.result() for f in futures]
+
+
+def data_paths() -> list:
+    """Ficheros con datos de usuarios: DB_PATH o, con sharding, los shards que existen."""
+    if not sharding_enabled():
+        return [DB_PATH]
+    return [p for p in (_shard_path(k) for k in _shard_keys()) if Path(p).exists()]
+
+
+def _all_pools() -> list:
+    """Pools de todos los ficheros (directorio incluido) para mantenimiento."""
+    if not sharding_enabled():
+        return [get_pool()]
+    return [get_pool()] + [_open_shard(key).pool for key in _shard_keys()]
+
+
+def submit_write(fn, *args) -> Future:
+    """Encola fn(con, *args) en el escritor de DB_PATH; devuelve un Future con su resultado."""
+    return _default_shard().writer.submit(fn, *args)
+
+
+def write(fn, *args):
+    """Como submit_write pero espera a que el lote se confirme."""
+    return _default_shard().writer.submit(fn, *args).result()
+
+
+def write_for_user(user_id: int, fn, *args):
+    return _shard_for_user(user_id).writer.submit(fn, *args).result()
+
+
+def submit_for_user(user_id: int, fn, *args) -> Future:
+    return _shard_for_user(user_id).writer.submit(fn, *args)
+
+
+def flush_writes(timeout: float | None = 10.0):
+    with _shards_lock:
+        shards = list(_shards.values())
+    for sh in [_default_shard(), *shards]:
+        sh.writer.flush(timeout)
+
+
+def get_write_stats() -> dict:
+    with _shards_lock:
+        shards = list(_shards.values())
+    per = [sh.writer.stats() for sh in [_default_shard(), *shards]]
+    out = {
+        k: sum(x[k] for x in per) for k in ("batches", "writes", "errors", "queued")
+    }
+    out["max_batch"]  = max(x["max_batch"] for x in per)
+    out["max_lag_ms"] = max(x["max_lag_ms"] for x in per)
+    active = [x for x in per if x["batches"]]
+    out["avg_lag_ms"] = round(sum(x["avg_lag_ms"] for x in active) / len(active), 2) if active else 0.0
+    out["avg_batch"]  = round(out["writes"] / out["batches"], 2) if out["batches"] else 0.0
+    out["last_error"] = next((x["last_error"] for x in per if x["last_error"]), None)
+    if sharding_enabled():
+        out["sharding"] = {
+            "mode": DB_SHARDING, "open": len(shards), "max_open": SHARD_MAX_OPEN, **_shard_stats,
+        }
+    return out
+
+
+def _reset_shards_after_fork():
+    # Las conexiones SQLite y los hilos escritores no cruzan un fork
+    global _default, _default_lock, _shards, _shards_lock, _init_lock
+    _default = None
+    _default_lock = threading.Lock()
+    _shards = OrderedDict()     # con sus bloques de ids: el hijo reserva los suyos
+    _shards_lock = threading.Lock()
+    _init_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_shards_after_fork)
+atexit.register(flush_writes)
+
+
+# Reparto inicial: al activar el sharding sobre una base que ya tiene datos,
+# se copian los de cada usuario a su shard (idempotente: INSERT OR IGNORE) y
+# se comprueba que no falta ninguna fila antes de confirmar. Con todos los
+# shards copiados, en una sola transacción del directorio se rellena
+# doc_directory, se borran de él las filas movidas y se marca el reparto; si
+# el proceso se corta antes, el siguiente arranque repite la copia (sin
+# duplicar) y el borrado. Después incremental_vacuum devuelve el espacio.
+SHARD_TABLES_BY_USER = (
+    "documents", "usage_stats", "user_stats", "user_event_stats",
+    "sessions", "usage_daily", "daily_activity",
+)
+SHARD_TABLES_BY_DOC = ("metrics", "document_metrics")
+
+
+def _copy_users_to_shard(path: str, user_ids: list):
+    sc = sqlite3.connect(path, isolation_level=None)
+    try:
+        sc.execute("PRAGMA busy_timeout = 5000;")
+        sc.execute("ATTACH DATABASE ? AS src", (DB_PATH,))
+        sc.execute("CREATE TEMP TABLE moving(id INTEGER PRIMARY KEY)")
+        sc.executemany("INSERT INTO temp.moving(id) VALUES(?)", [(u,) for u in user_ids])
+
+        copied = []     # (tabla, columnas comparables, filtro)
+
+        def copy(table: str, where: str, skip: tuple = ()):
+            cols = ", ".join(r[1] for r in sc.execute(f"PRAGMA src.table_info({table})"))
+            sc.execute(f"INSERT OR IGNORE INTO main.{table}({cols}) SELECT {cols} FROM src.{table} WHERE {where}")
+            copied.append((table, ", ".join(c for c in cols.split(", ") if c not in skip), where))
+
+        sc.execute("BEGIN IMMEDIATE")
+        try:
+            copy("users", "id IN (SELECT id FROM temp.moving)")
+            for table in SHARD_TABLES_BY_USER:
+                copy(table, "user_id IN (SELECT id FROM temp.moving)")
+            for table in SHARD_TABLES_BY_DOC:
+                copy(table, "document_id IN (SELECT id FROM main.documents)")
+            copy("blobs", " OR ".join(
+                f"hash IN (SELECT {r}_blob FROM main.documents)" for r in BLOB_ROLES
+            ), skip=("refs",))
+            sc.execute("UPDATE main.blobs SET refs = " + " + ".join(
+                f"(SELECT COUNT(*) FROM main.documents d WHERE d.{r}_blob = blobs.hash)" for r in BLOB_ROLES
+            ))
+            # Antes de borrar los originales: cada fila de origen tiene su copia idéntica
+            for table, cols, where in copied:
+                missing = sc.execute(f"""
+                    SELECT COUNT(*) FROM (
+                        SELECT {cols} FROM src.{table} WHERE {where}
+                        EXCEPT SELECT {cols} FROM main.{table}
+                    )
+                """).fetchone()[0]
+                if missing:
+                    raise RuntimeError(f"Reparto en {path}: faltan {missing} filas de {table}.")
+            sc.execute("COMMIT")
+        except BaseException:
+            sc.execute("ROLLBACK")
+            raise
+        sc.execute("DETACH DATABASE src")
     finally:
-        con.close()
+        sc.close()
+
+
+def _split_into_shards(con: sqlite3.Connection, layout: str | None):
+    wanted = f"bucket:{DB_SHARDS}" if DB_SHARDING == "bucket" else "user"
+    if layout is not None:
+        if layout != wanted:
+            raise RuntimeError(
+                f"La base está repartida como {layout} y se pidió {wanted}: re-sharding no soportado."
+            )
+        return
+    Path(DB_SHARD_DIR).mkdir(parents=True, exist_ok=True)
+    by_key = {}
+    for (uid,) in con.execute("SELECT id FROM users").fetchall():
+        by_key.setdefault(shard_key(uid), []).append(uid)
+    for key, uids in by_key.items():
+        path = _shard_path(key)
+        _init_file(path)
+        _initialized.add(path)
+        _copy_users_to_shard(path, uids)
+    moved = "SELECT id FROM users"
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute("INSERT OR IGNORE INTO doc_directory(id, user_id) SELECT id, user_id FROM documents")
+        for table in SHARD_TABLES_BY_DOC:
+            con.execute(f"DELETE FROM {table} WHERE document_id IN "
+                        f"(SELECT id FROM documents WHERE user_id IN ({moved}))")
+        for table in SHARD_TABLES_BY_USER:
+            con.execute(f"DELETE FROM {table} WHERE user_id IN ({moved})")
+        con.execute("DELETE FROM blobs WHERE " + " AND ".join(
+            f"hash NOT IN (SELECT {r}_blob FROM documents WHERE {r}_blob IS NOT NULL)" for r in BLOB_ROLES
+        ))
+        con.execute("INSERT INTO shard_meta(key, value) VALUES('layout', ?)", (wanted,))
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.executescript("PRAGMA incremental_vacuum;")    # por executescript: una página por paso
 
 _ALLOWED = re.compile(r"^[A-Za-z0-9_\-\.]{1,32}$")
 
@@ -86,313 +1107,1229 @@ def sanitize_username(username: str) -> str:
         raise ValueError("username inválido: usa letras, números, _ - . (máx 32)")
     return username
 
+# Caché username → user_id del proceso. Casi todos los endpoints resuelven
+# el usuario antes de nada (el heartbeat, cada 20 s por pestaña): el id de un
+# nombre no cambia mientras el usuario exista, así que solo se guardan los
+# aciertos (alta, login, primera consulta) y se olvidan al borrar el usuario.
+# Los nombres que no existen no se cachean: otro proceso podría crearlos.
+
+_uid_cache: dict = {}
+_uid_lock  = threading.Lock()
+_uid_stats = {"hits": 0, "misses": 0}
+
+
+def _remember_user_id(username: str, user_id: int):
+    with _uid_lock:
+        _uid_cache[username] = user_id
+
+
+def _forget_user_id(username: str):
+    with _uid_lock:
+        _uid_cache.pop(username, None)
+
+
+def get_user_id_cache_stats() -> dict:
+    with _uid_lock:
+        return {**_uid_stats, "cached": len(_uid_cache)}
+
+
 def user_exists(username: str) -> bool:
-    username = sanitize_username(username)
-    with db() as con:
-        row = con.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone()
-        return bool(row)
+    return get_user_id(username) is not None
+
+def _create_user_tx(con: sqlite3.Connection, username: str) -> int:
+    cur = con.execute("INSERT INTO users(username) VALUES(?)", (username,))
+    return cur.lastrowid
 
 def create_user(username: str) -> int:
     username = sanitize_username(username)
-    with db() as con:
-        cur = con.execute("INSERT INTO users(username) VALUES(?)", (username,))
-        return cur.lastrowid
+    uid = write(_create_user_tx, username)
+    _remember_user_id(username, uid)
+    return uid
 
 def get_user_id(username: str) -> Optional[int]:
     username = sanitize_username(username)
+    with _uid_lock:
+        uid = _uid_cache.get(username)
+        _uid_stats["hits" if uid is not None else "misses"] += 1
+    if uid is not None:
+        return uid
     with db() as con:
         row = con.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
-        return row["id"] if row else None
+    if row is None:
+        return None
+    _remember_user_id(username, row["id"])
+    return row["id"]
+
+def _ensure_user_tx(con: sqlite3.Connection, username: str) -> int:
+    row = con.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
+    if row:
+        return row["id"]
+    return _create_user_tx(con, username)
 
 def ensure_user(username: str) -> int:
     username = sanitize_username(username)
-    with db() as con:
-        row = con.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
-        if row:
-            return row["id"]
-        cur = con.execute("INSERT INTO users(username) VALUES(?)", (username,))
-        return cur.lastrowid
+    uid = write(_ensure_user_tx, username)
+    _remember_user_id(username, uid)
+    return uid
 
-def record_usage(user_id: int, event: str, value: float | None = None):
-    with db() as con:
+def _delete_user_tx(con: sqlite3.Connection, user_id: int):
+    """Borra al usuario y todo lo suyo de esta base (en shards, de cada fichero que lo tenga)."""
+    for (doc_id,) in con.execute("SELECT id FROM documents WHERE user_id=?", (user_id,)).fetchall():
+        _delete_document_tx(con, doc_id)
+    for table in (
+        "usage_stats", "user_event_stats", "usage_daily", "user_stats",
+        "daily_activity", "sessions", "cohort_members", "doc_directory",
+    ):
+        con.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+    con.execute("DELETE FROM users WHERE id=?", (user_id,))
+    _mark_dirty(user_id)
+
+def delete_user(username: str) -> bool:
+    """
+    Borra la cuenta con sus documentos, métricas, sesiones y actividad, y la
+    saca de la caché de ids. False si no existía.
+    """
+    username = sanitize_username(username)
+    uid = get_user_id(username)
+    if uid is None:
+        return False
+    if sharding_enabled():
+        sh = _shard_for_user(uid)
+        sh.writer.submit(_delete_user_tx, uid).result()
+        sh.mirrored.discard(uid)
+    write(_delete_user_tx, uid)     # directorio: fila de users, cohortes
+    _forget_user_id(username)
+    return True
+
+# ── Rollup por usuario ─────────────────────────────────────────────────────────
+
+def _doc_contribution(values: dict) -> dict:
+    """Lo que aporta un documento con estas métricas a su fila de user_stats."""
+    tu = values.get("frases_con_tu_impersonal")
+    cu = values.get("cambios_realizados_usuario")
+    out = {
+        "docs_with_tu":    int((tu or 0) > 0),
+        "docs_no_changes": int((cu or 0) == 0),
+    }
+    for c in DOCUMENT_METRIC_COLUMNS:
+        v = values.get(c)
+        out[f"n_{c}"]   = int(v is not None)
+        out[f"sum_{c}"] = float(v or 0.0)
+    return out
+
+
+def _apply_user_stats(con: sqlite3.Connection, user_id: int, delta: dict):
+    delta = {k: v for k, v in delta.items() if v}
+    if not delta:
+        return
+    _mark_dirty(user_id)
+    con.execute("INSERT OR IGNORE INTO user_stats(user_id) VALUES(?)", (user_id,))
+    sets = ", ".join(f"{k} = {k} + ?" for k in delta)
+    con.execute(
+        f"UPDATE user_stats SET {sets}, updated_at=datetime('now') WHERE user_id=?",
+        (*delta.values(), user_id),
+    )
+
+
+def _bump_daily(
+    con: sqlite3.Connection,
+    user_id: int,
+    day: str | None,
+    seconds: float = 0.0,
+    logins: int = 0,
+    docs: int = 0,
+):
+    """Suma a la fila de daily_activity del día (YYYY-MM-DD; None = hoy UTC)."""
+    _mark_dirty(user_id)
+    con.execute("""
+        INSERT INTO daily_activity(user_id, day, seconds, logins, docs)
+        VALUES(?, COALESCE(?, date('now')), ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+          seconds = seconds + excluded.seconds,
+          logins = logins + excluded.logins,
+          docs = docs + excluded.docs
+    """, (user_id, day, float(seconds), int(logins), int(docs)))
+
+
+def _record_usage_tx(con: sqlite3.Connection, user_id: int, event: str, value: float | None = None):
+    con.execute(
+        "INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,?)",
+        (user_id, event, value)
+    )
+    con.execute("""
+        INSERT INTO user_event_stats(user_id, event, n, n_value, sum_value) VALUES(?,?,1,?,?)
+        ON CONFLICT(user_id, event) DO UPDATE SET
+          n = n + 1,
+          n_value = n_value + excluded.n_value,
+          sum_value = sum_value + excluded.sum_value
+    """, (user_id, event, int(value is not None), float(value or 0.0)))
+    _mark_dirty(user_id)
+
+    if event == "login":
+        _bump_daily(con, user_id, None, logins=1)
+        con.execute("INSERT OR IGNORE INTO user_stats(user_id) VALUES(?)", (user_id,))
+        con.execute("""
+            UPDATE user_stats
+            SET login_days = login_days + (last_login_day IS NOT date('now')),
+                last_login_day = date('now'),
+                updated_at = datetime('now')
+            WHERE user_id=?
+        """, (user_id,))
+
+
+_USER_STATS_SELECT = f"""
+    WITH doc AS (
+        SELECT d.user_id,
+               COUNT(*) AS docs,
+               SUM(COALESCE(dm.frases_con_tu_impersonal,0) > 0) AS docs_with_tu,
+               SUM(COALESCE(dm.cambios_realizados_usuario,0) = 0) AS docs_no_changes,
+               {", ".join(f"COUNT(dm.{c}) AS n_{c}, TOTAL(dm.{c}) AS sum_{c}" for c in DOCUMENT_METRIC_COLUMNS)}
+        FROM documents d
+        LEFT JOIN document_metrics dm ON dm.document_id = d.id
+        GROUP BY d.user_id
+    ),
+    lg AS (
+        SELECT user_id, COUNT(DISTINCT day) AS login_days, MAX(day) AS last_login_day
+        FROM (
+            SELECT user_id, date(created_at) AS day FROM usage_stats WHERE event='login'
+            UNION ALL
+            SELECT user_id, day FROM usage_daily WHERE event='login'
+        )
+        GROUP BY user_id
+    ),
+    ss AS (
+        SELECT user_id, COUNT(duration) AS session_count, TOTAL(duration) AS session_seconds
+        FROM sessions WHERE ended_at IS NOT NULL
+        GROUP BY user_id
+    )
+    SELECT u.id AS user_id,
+           COALESCE(doc.docs, 0) AS docs,
+           COALESCE(doc.docs_with_tu, 0) AS docs_with_tu,
+           COALESCE(doc.docs_no_changes, 0) AS docs_no_changes,
+           {", ".join(f"COALESCE(doc.{c}, 0) AS {c}" for c in USER_STATS_METRIC_COLUMNS)},
+           COALESCE(lg.login_days, 0) AS login_days,
+           lg.last_login_day AS last_login_day,
+           COALESCE(ss.session_count, 0) AS session_count,
+           COALESCE(ss.session_seconds, 0) AS session_seconds
+    FROM users u
+    LEFT JOIN doc ON doc.user_id = u.id
+    LEFT JOIN lg  ON lg.user_id  = u.id
+    LEFT JOIN ss  ON ss.user_id  = u.id
+"""
+
+# Totales por (usuario, evento): eventos crudos + los ya compactados
+_USAGE_EVENTS_SELECT = """
+    SELECT user_id, event, SUM(n) AS n, SUM(n_value) AS n_value, TOTAL(sum_value) AS sum_value
+    FROM (
+        SELECT user_id, event, COUNT(*) AS n, COUNT(value) AS n_value, TOTAL(value) AS sum_value
+        FROM usage_stats {where} GROUP BY user_id, event
+        UNION ALL
+        SELECT user_id, event, n, n_value, sum_value
+        FROM usage_daily {where}
+    )
+    GROUP BY user_id, event
+"""
+
+_USER_STATS_FIELDS = (
+    "docs", "docs_with_tu", "docs_no_changes", *USER_STATS_METRIC_COLUMNS,
+    "login_days", "last_login_day", "session_count", "session_seconds",
+)
+
+
+def rebuild_user_stats(con: sqlite3.Connection, user_id: int | None = None):
+    """Recalcula user_stats y user_event_stats desde las tablas crudas."""
+    _mark_dirty(user_id)
+    where = "" if user_id is None else "WHERE u.id = ?"
+    params = () if user_id is None else (user_id,)
+    con.execute(
+        f"""
+        INSERT OR REPLACE INTO user_stats(user_id, {", ".join(_USER_STATS_FIELDS)})
+        SELECT user_id, {", ".join(_USER_STATS_FIELDS)} FROM ({_USER_STATS_SELECT} {where})
+        """,
+        params,
+    )
+    if user_id is None:
+        con.execute("DELETE FROM user_event_stats")
+    else:
+        con.execute("DELETE FROM user_event_stats WHERE user_id=?", (user_id,))
+    con.execute(
+        "INSERT INTO user_event_stats(user_id, event, n, n_value, sum_value) "
+        + _USAGE_EVENTS_SELECT.format(where="" if user_id is None else "WHERE user_id = ?"),
+        params * 2,
+    )
+
+
+def _same_value(a, b):
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(float(a) - float(b)) <= 1e-6 * max(1.0, abs(float(b)))
+    return a == b
+
+
+def _check_user_stats_tx(con: sqlite3.Connection, repair: bool) -> dict:
+    expected = {r["user_id"]: r for r in con.execute(_USER_STATS_SELECT).fetchall()}
+    current  = {r["user_id"]: r for r in con.execute("SELECT * FROM user_stats").fetchall()}
+    events_expected = {
+        (r[0], r[1]): tuple(r[2:])
+        for r in con.execute(_USAGE_EVENTS_SELECT.format(where="")).fetchall()
+    }
+    events_current = {
+        (r[0], r[1]): tuple(r[2:]) for r in con.execute(
+            "SELECT user_id, event, n, n_value, sum_value FROM user_event_stats"
+        ).fetchall()
+    }
+
+    bad = set()
+    for uid, exp in expected.items():
+        cur = current.get(uid)
+        if cur is None and all(not exp[f] for f in _USER_STATS_FIELDS):
+            continue
+        if cur is None or not all(_same_value(cur[f], exp[f]) for f in _USER_STATS_FIELDS):
+            bad.add(uid)
+    for key in set(events_expected) | set(events_current):
+        a, b = events_current.get(key), events_expected.get(key)
+        if a is None or b is None or not all(_same_value(x, y) for x, y in zip(a, b)):
+            bad.add(key[0])
+
+    daily_expected = {
+        (r["user_id"], r["day"]): (r["seconds"], r["logins"], r["docs"])
+        for r in con.execute(_DAILY_ACTIVITY_SELECT.format(and_user="")).fetchall()
+    }
+    daily_current = {
+        (r["user_id"], r["day"]): (r["seconds"], r["logins"], r["docs"])
+        for r in con.execute("SELECT user_id, day, seconds, logins, docs FROM daily_activity").fetchall()
+    }
+    bad_daily = set()
+    for key in set(daily_expected) | set(daily_current):
+        a, b = daily_current.get(key), daily_expected.get(key)
+        if a is None or b is None or not all(_same_value(x, y) for x, y in zip(a, b)):
+            bad_daily.add(key[0])
+    bad |= bad_daily
+
+    if repair:
+        for uid in sorted(bad):
+            rebuild_user_stats(con, uid)
+        for uid in sorted(bad_daily):
+            rebuild_daily_activity(con, uid)
+
+    return {"users": len(expected), "mismatched": sorted(bad), "repaired": bool(repair and bad)}
+
+
+_DAILY_ACTIVITY_SELECT = """
+    SELECT user_id, day, TOTAL(seconds) AS seconds, SUM(logins) AS logins, SUM(docs) AS docs
+    FROM (
+        SELECT user_id, date(ended_at, 'unixepoch') AS day, duration AS seconds, 0 AS logins, 0 AS docs
+        FROM sessions WHERE duration IS NOT NULL {and_user}
+        UNION ALL
+        SELECT user_id, date(created_at), 0, 1, 0 FROM usage_stats WHERE event='login' {and_user}
+        UNION ALL
+        SELECT user_id, day, 0, n, 0 FROM usage_daily WHERE event='login' {and_user}
+        UNION ALL
+        SELECT user_id, date(uploaded_at), 0, 0, 1 FROM documents WHERE 1 {and_user}
+    )
+    GROUP BY user_id, day
+"""
+
+
+def rebuild_daily_activity(con: sqlite3.Connection, user_id: int | None = None):
+    """Recalcula daily_activity desde sessions, eventos de login y documents."""
+    _mark_dirty(user_id)
+    if user_id is None:
+        con.execute("DELETE FROM daily_activity")
         con.execute(
-            "INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,?)",
-            (user_id, event, value)
+            "INSERT INTO daily_activity(user_id, day, seconds, logins, docs) "
+            + _DAILY_ACTIVITY_SELECT.format(and_user="")
         )
+        return
+    con.execute("DELETE FROM daily_activity WHERE user_id=?", (user_id,))
+    con.execute(
+        "INSERT INTO daily_activity(user_id, day, seconds, logins, docs) "
+        + _DAILY_ACTIVITY_SELECT.format(and_user="AND user_id = ?"),
+        (user_id,) * 4,
+    )
 
-def record_login_ts(user_id: int, epoch_seconds: float):
-    record_usage(user_id, "login_ts", float(epoch_seconds))
-    record_usage(user_id, "heartbeat", float(epoch_seconds))
 
-def close_open_session(user_id: int, now_epoch: float, idle_grace: float = 1800.0):
+def check_user_stats(repair: bool = True) -> dict:
+    """
+    Comprobador de consistencia: compara el rollup con lo que se obtiene de
+    las tablas crudas. Con repair=True reconstruye las filas que no cuadran.
+    Con sharding se comprueba cada shard y se juntan los resultados.
+    """
+    parts = _write_on_all(_check_user_stats_tx, repair)
+    return {
+        "users":      sum(p["users"] for p in parts),
+        "mismatched": sorted(u for p in parts for u in p["mismatched"]),
+        "repaired":   any(p["repaired"] for p in parts),
+    }
+
+
+def record_usage(user_id: int, event: str, value: float | None = None):
+    """Encola el evento de uso; no espera al commit."""
+    submit_for_user(user_id, _record_usage_tx, user_id, event, value)
+
+# ── Retención y compactación ───────────────────────────────────────────────────
+# Los eventos crudos más viejos que RETENTION_DAYS se agregan en usage_daily
+# (n, n_value, sum_value por usuario, día y evento) y se borran por lotes de
+# COMPACT_BATCH filas, cada lote en su propia tarea del escritor para no
+# bloquear las escrituras normales. Los rollups (user_event_stats, login_days)
+# no cambian: rebuild_user_stats y check_user_stats leen ambas tablas.
+# Después, incremental_vacuum devuelve las páginas libres y un checkpoint
+# TRUNCATE deja el WAL a cero.
+
+RETENTION_DAYS = float(os.getenv("PALABRIA_RETENTION_DAYS", "90"))
+COMPACT_BATCH  = int(os.getenv("PALABRIA_COMPACT_BATCH", "5000"))
+VACUUM_PAGES   = int(os.getenv("PALABRIA_VACUUM_PAGES", "2000"))
+
+
+def _compact_usage_tx(con: sqlite3.Connection, cutoff: str, batch_size: int) -> int:
+    # Por rowid: created_at crece con el id, así que el lote es el prefijo
+    # de las filas más antiguas que quedan por debajo del corte.
+    rows = con.execute(
+        "SELECT id, created_at FROM usage_stats ORDER BY id LIMIT ?", (batch_size,)
+    ).fetchall()
+    last_id = None
+    for r in rows:
+        if r["created_at"] is None or r["created_at"] >= cutoff:
+            break
+        last_id = r["id"]
+    if last_id is None:
+        return 0
+    con.execute("""
+        INSERT INTO usage_daily(user_id, day, event, n, n_value, sum_value)
+        SELECT user_id, date(created_at), event, COUNT(*), COUNT(value), TOTAL(value)
+        FROM usage_stats WHERE id <= ?
+        GROUP BY user_id, date(created_at), event
+        ON CONFLICT(user_id, day, event) DO UPDATE SET
+          n = n + excluded.n,
+          n_value = n_value + excluded.n_value,
+          sum_value = sum_value + excluded.sum_value
+    """, (last_id,))
+    return con.execute("DELETE FROM usage_stats WHERE id <= ?", (last_id,)).rowcount
+
+
+def compact_usage(
+    retention_days: float | None = None,
+    batch_size: int | None = None,
+    max_batches: int | None = None,
+) -> int:
+    """Compacta los eventos anteriores al horizonte. Devuelve las filas crudas borradas."""
+    days = RETENTION_DAYS if retention_days is None else float(retention_days)
+    size = batch_size or COMPACT_BATCH
     with db() as con:
-        row_login = con.execute("""
-            SELECT id, value FROM usage_stats
-            WHERE user_id=? AND event='login_ts'
-            ORDER BY id DESC LIMIT 1
-        """, (user_id,)).fetchone()
-        if not row_login:
-            return
-        last_login_id = int(row_login["id"])
-        start_ts = float(row_login["value"] or 0.0)
-
-        # Si ya existe session_duration para esta sesión, no crear otra
-        row_sd = con.execute("""
-            SELECT id FROM usage_stats
-            WHERE user_id=? AND event='session_duration' AND id>?
-            ORDER BY id DESC LIMIT 1
-        """, (user_id, last_login_id)).fetchone()
-        if row_sd:
-            return
+        cutoff = con.execute("SELECT datetime('now', ?)", (f"-{days} days",)).fetchone()[0]
+    writers = (
+        [_open_shard(k).writer for k in _shard_keys()] if sharding_enabled()
+        else [_default_shard().writer]
+    )
+    total = 0
+    for writer in writers:
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            n = writer.submit(_compact_usage_tx, cutoff, size).result()
+            total += n
+            batches += 1
+            if n < size:
+                break
+    return total
 
-        row_hb = con.execute("""
-            SELECT value FROM usage_stats
-            WHERE user_id=? AND event='heartbeat' AND id>=?
-            ORDER BY id DESC LIMIT 1
-        """, (user_id, last_login_id)).fetchone()
-        hb_ts = float(row_hb["value"]) if row_hb and row_hb["value"] is not None else None
-
-        end_ts = now_epoch
-        if hb_ts is not None:
-            if (now_epoch - hb_ts) > idle_grace:
-                end_ts = hb_ts  
-            else:
-                end_ts = now_epoch
 
-        dur = max(0.0, end_ts - start_ts)
-        dur = min(dur, 12 * 3600.0)  
+def incremental_vacuum(pages: int | None = None) -> int:
+    """
+    Devuelve al sistema las páginas libres, VACUUM_PAGES por transacción.
+    Va por executescript: incremental_vacuum libera una página por paso y
+    execute() solo da uno. Devuelve cuántas páginas liberó.
+    """
+    step = int(pages or VACUUM_PAGES)
+    freed = 0
+    for pool in _all_pools():
+        with _using(pool) as con:
+            while True:
+                before = con.execute("PRAGMA freelist_count").fetchone()[0]
+                if before == 0:
+                    break
+                con.executescript(f"PRAGMA incremental_vacuum({step});")
+                after = con.execute("PRAGMA freelist_count").fetchone()[0]
+                freed += before - after
+                if after >= before:
+                    break
+    return freed
 
-        con.execute("INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,?)",
-                    (user_id, "session_duration", float(dur)))
-        con.execute("INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,NULL)",
-                    (user_id, "logout"))
 
-def close_idle_sessions(idle_secs: float = 1800.0):
+def wal_checkpoint() -> dict:
+    out = {"busy": False, "wal_frames": 0, "checkpointed": 0}
+    for pool in _all_pools():
+        with _using(pool) as con:
+            busy, log, done = con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        out["busy"] |= bool(busy)
+        out["wal_frames"] += max(log, 0)
+        out["checkpointed"] += max(done, 0)
+    return out
+
+
+def get_storage_stats() -> dict:
+    out = {"db_bytes": 0, "free_bytes": 0, "wal_bytes": 0, "usage_rows": 0, "usage_daily_rows": 0}
+    for pool in _all_pools():
+        with _using(pool) as con:
+            page_size = con.execute("PRAGMA page_size").fetchone()[0]
+            pages     = con.execute("PRAGMA page_count").fetchone()[0]
+            free      = con.execute("PRAGMA freelist_count").fetchone()[0]
+            raw       = con.execute("SELECT COUNT(*) FROM usage_stats").fetchone()[0]
+            daily     = con.execute("SELECT COUNT(*) FROM usage_daily").fetchone()[0]
+        wal = Path(pool.path + "-wal")
+        out["db_bytes"]         += page_size * pages
+        out["free_bytes"]       += page_size * free
+        out["wal_bytes"]        += wal.stat().st_size if wal.exists() else 0
+        out["usage_rows"]       += raw
+        out["usage_daily_rows"] += daily
+    if sharding_enabled():
+        out["shard_files"] = len(_all_pools()) - 1
+    return out
+
+# ── Blobs de texto ─────────────────────────────────────────────────────────────
+# La compresión se hace en el hilo que llama (pack_text); el escritor solo
+# inserta los bytes ya preparados o suma una referencia si el hash existe.
+
+BLOB_ZLIB_LEVEL = 6
+BLOB_ZSTD_LEVEL = 9
+BLOB_ROLES = ("original", "corrected", "final")
+
+
+def pack_text(text: str | None):
+    """Texto → (hash, codec, raw_size, datos comprimidos). None si no hay texto."""
+    if text is None:
+        return None
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+    if zstandard is not None:
+        return digest, "zstd", len(raw), zstandard.ZstdCompressor(level=BLOB_ZSTD_LEVEL).compress(raw)
+    return digest, "zlib", len(raw), zlib.compress(raw, BLOB_ZLIB_LEVEL)
+
+
+def _unpack(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("blob comprimido con zstd y zstandard no está instalado")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _put_blob_tx(con: sqlite3.Connection, packed) -> str | None:
+    if packed is None:
+        return None
+    digest, codec, raw_size, data = packed
+    con.execute("""
+        INSERT INTO blobs(hash, codec, raw_size, stored_size, data, refs) VALUES(?,?,?,?,?,1)
+        ON CONFLICT(hash) DO UPDATE SET refs = refs + 1
+    """, (digest, codec, raw_size, len(data), data))
+    return digest
+
+
+def _drop_blob_tx(con: sqlite3.Connection, digest: str | None):
+    if digest is None:
+        return
+    con.execute("UPDATE blobs SET refs = refs - 1 WHERE hash=?", (digest,))
+    con.execute("DELETE FROM blobs WHERE hash=? AND refs <= 0", (digest,))
+
+
+def _set_final_text_tx(con: sqlite3.Connection, doc_id: int, packed):
+    row = con.execute("SELECT final_blob FROM documents WHERE id=?", (doc_id,)).fetchone()
+    if row is None:
+        raise ValueError("Documento no encontrado.")
+    if packed is not None and row["final_blob"] == packed[0]:
+        return
+    digest = _put_blob_tx(con, packed)
+    con.execute("UPDATE documents SET final_blob=? WHERE id=?", (digest, doc_id))
+    _drop_blob_tx(con, row["final_blob"])
+
+
+def set_final_text(doc_id: int, text: str | None):
+    """Guarda (o reemplaza) la versión final editada por el usuario."""
+    sh = _shard_for_doc(doc_id)
+    if sh is None:
+        raise ValueError("Documento no encontrado.")
+    sh.writer.submit(_set_final_text_tx, doc_id, pack_text(text)).result()
+
+
+def get_document_texts(doc_id: int) -> dict | None:
+    """Textos guardados de un documento, descomprimidos. None si no existe."""
+    with doc_db(doc_id) as con:
+        doc = con.execute("""
+            SELECT id, filename, uploaded_at, original_blob, corrected_blob, final_blob
+            FROM documents WHERE id=?
+        """, (doc_id,)).fetchone()
+        if doc is None:
+            return None
+        hashes = [doc[f"{r}_blob"] for r in BLOB_ROLES]
+        wanted = [h for h in hashes if h]
+        blobs = {}
+        if wanted:
+            blobs = {
+                r["hash"]: r for r in con.execute(
+                    f"SELECT hash, codec, data FROM blobs WHERE hash IN ({','.join('?' * len(wanted))})",
+                    wanted,
+                ).fetchall()
+            }
+    out = {"doc_id": doc["id"], "filename": doc["filename"], "uploaded_at": doc["uploaded_at"]}
+    for role, h in zip(BLOB_ROLES, hashes):
+        b = blobs.get(h)
+        out[f"{role}_text"] = _unpack(b["codec"], b["data"]) if b is not None else None
+    return out
+
+
+def get_blob_stats() -> dict:
     """
-    Cierra todas las sesiones abiertas cuyo último heartbeat fue hace
-    más de idle_secs segundos. Llamar al inicio de cada login.
+    Espacio de los textos: bruto, almacenado, ahorro por deduplicación y por
+    documento. Con sharding la deduplicación es por shard.
     """
-    import time
-    now = time.time()
+    def one(con):
+        b = con.execute("""
+            SELECT COUNT(*) AS blobs,
+                   TOTAL(raw_size) AS raw_bytes,
+                   TOTAL(stored_size) AS stored_bytes,
+                   TOTAL(raw_size * refs) AS referenced_bytes
+            FROM blobs
+        """).fetchone()
+        docs = con.execute(
+            "SELECT COUNT(*) FROM documents WHERE original_blob IS NOT NULL"
+        ).fetchone()[0]
+        return dict(b), docs
+
+    parts = for_each_shard(one)
+    b = {k: sum(p[0][k] for p in parts) for k in ("blobs", "raw_bytes", "stored_bytes", "referenced_bytes")}
+    docs = sum(p[1] for p in parts)
+    stored = float(b["stored_bytes"])
+    return {
+        "codec":             "zstd" if zstandard is not None else "zlib",
+        "blobs":             b["blobs"],
+        "documents":         docs,
+        "raw_bytes":         int(b["raw_bytes"]),
+        "referenced_bytes":  int(b["referenced_bytes"]),
+        "stored_bytes":      int(stored),
+        "compression_ratio": round(b["raw_bytes"] / stored, 2) if stored else None,
+        "dedup_ratio":       round(b["referenced_bytes"] / b["raw_bytes"], 2) if b["raw_bytes"] else None,
+        "bytes_per_document": round(stored / docs, 1) if docs else None,
+    }
+
+# ── Cohortes ───────────────────────────────────────────────────────────────────
+# Un cohorte es una lista de usuarios. Sus indicadores salen de los rollups
+# con una consulta por conjunto (json_each con los ids) en vez de un
+# get_user_overview por alumno; con sharding, una consulta por shard.
+
+def _create_cohort_tx(con: sqlite3.Connection, name: str) -> int:
+    con.execute("INSERT OR IGNORE INTO cohorts(name) VALUES(?)", (name,))
+    return con.execute("SELECT id FROM cohorts WHERE name=?", (name,)).fetchone()[0]
+
+
+def create_cohort(name: str) -> int:
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("El nombre del cohorte no puede estar vacío.")
+    return write(_create_cohort_tx, name)
+
+
+def _add_cohort_members_tx(con: sqlite3.Connection, cohort_id: int, user_ids: list, replace: bool):
+    if replace:
+        con.execute("DELETE FROM cohort_members WHERE cohort_id=?", (cohort_id,))
+    con.executemany(
+        "INSERT OR IGNORE INTO cohort_members(cohort_id, user_id) VALUES(?,?)",
+        [(cohort_id, uid) for uid in user_ids],
+    )
+
+
+def add_cohort_members(name: str, usernames: list, replace: bool = False) -> dict:
+    """
+    Añade usuarios (por username) al cohorte, creándolo si no existe.
+    Con replace=True la lista pasa a ser exactamente `usernames`.
+    """
+    cohort_id = create_cohort(name)
+    wanted = sorted({sanitize_username(u) for u in usernames if u and u.strip()})
     with db() as con:
-        open_sessions = con.execute("""
-            SELECT us.user_id, us.id AS login_id, us.value AS start_ts
-            FROM usage_stats us
-            WHERE us.event = 'login_ts'
-              AND NOT EXISTS (
-                SELECT 1 FROM usage_stats sd
-                WHERE sd.user_id = us.user_id
-                  AND sd.event = 'session_duration'
-                  AND sd.id > us.id
-              )
+        found = {
+            r["username"]: r["id"] for r in con.execute(
+                "SELECT u.id, u.username FROM json_each(?) j JOIN users u ON u.username = j.value",
+                (json.dumps(wanted),),
+            ).fetchall()
+        }
+    write(_add_cohort_members_tx, cohort_id, list(found.values()), replace)
+    return {"cohort": name.strip(), "added": len(found), "unknown": [u for u in wanted if u not in found]}
+
+
+def _remove_cohort_member_tx(con: sqlite3.Connection, name: str, username: str) -> bool:
+    cur = con.execute("""
+        DELETE FROM cohort_members
+        WHERE cohort_id = (SELECT id FROM cohorts WHERE name=?)
+          AND user_id = (SELECT id FROM users WHERE username=?)
+    """, (name, username))
+    return cur.rowcount > 0
+
+
+def remove_cohort_member(name: str, username: str) -> bool:
+    return write(_remove_cohort_member_tx, name.strip(), sanitize_username(username))
+
+
+def list_cohorts() -> list:
+    with db() as con:
+        rows = con.execute("""
+            SELECT c.name, c.created_at, COUNT(m.user_id) AS members
+            FROM cohorts c LEFT JOIN cohort_members m ON m.cohort_id = c.id
+            GROUP BY c.id ORDER BY c.name
         """).fetchall()
+    return [dict(r) for r in rows]
+
 
-        for row in open_sessions:
-            uid = row["user_id"]
-            login_id = row["login_id"]
-            start_ts = float(row["start_ts"] or 0)
-
-            hb = con.execute("""
-                SELECT value FROM usage_stats
-                WHERE user_id=? AND event='heartbeat' AND id >= ?
-                ORDER BY id DESC LIMIT 1
-            """, (uid, login_id)).fetchone()
-
-            hb_ts = float(hb["value"]) if hb and hb["value"] else None
-
-            if hb_ts is None:
-                continue  
-
-            if (now - hb_ts) > idle_secs:
-                dur = max(0.0, min(hb_ts - start_ts, 12 * 3600.0))
-                con.execute(
-                    "INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,?)",
-                    (uid, "session_duration", dur)
-                )
-                con.execute(
-                    "INSERT INTO usage_stats(user_id, event, value) VALUES(?,?,NULL)",
-                    (uid, "logout")
-                )
-
-def create_document(user_id: int, filename: str | None, text_hash: str | None) -> int:
+def get_cohort_members(name: str) -> dict | None:
+    """user_id → username de los miembros; None si el cohorte no existe."""
     with db() as con:
-        cur = con.execute(
-            "INSERT INTO documents(user_id, filename, text_hash) VALUES(?,?,?)",
-            (user_id, filename, text_hash)
-        )
-        return cur.lastrowid
+        c = con.execute("SELECT id FROM cohorts WHERE name=?", (name.strip(),)).fetchone()
+        if c is None:
+            return None
+        rows = con.execute("""
+            SELECT u.id, u.username FROM cohort_members m JOIN users u ON u.id = m.user_id
+            WHERE m.cohort_id=?
+        """, (c["id"],)).fetchall()
+    return {r["id"]: r["username"] for r in rows}
 
-def insert_metric(document_id: int, name: str, value: float):
+
+_USERS_ROLLUP_SELECT = f"""
+    SELECT j.value AS user_id,
+           {", ".join(f"us.{f}" for f in _USER_STATS_FIELDS)},
+           a.active_days_30, a.seconds_30, a.docs_30, a.last_active_day
+    FROM json_each(?) j
+    LEFT JOIN user_stats us ON us.user_id = j.value
+    LEFT JOIN (
+        SELECT user_id,
+               COUNT(*) FILTER (WHERE day >= date('now', '-29 days')) AS active_days_30,
+               TOTAL(seconds) FILTER (WHERE day >= date('now', '-29 days')) AS seconds_30,
+               TOTAL(docs) FILTER (WHERE day >= date('now', '-29 days')) AS docs_30,
+               MAX(day) AS last_active_day
+        FROM daily_activity
+        WHERE user_id IN (SELECT value FROM json_each(?))
+          AND (seconds > 0 OR logins > 0 OR docs > 0)
+        GROUP BY user_id
+    ) a ON a.user_id = j.value
+"""
+
+
+def get_users_rollups(user_ids) -> list:
+    """Fila de rollups (user_stats + actividad de 30 días) de cada user_id pedido."""
+    ids = sorted({int(u) for u in user_ids})
+    if not ids:
+        return []
+    if not sharding_enabled():
+        groups = {None: ids}
+    else:
+        groups = {}
+        for uid in ids:
+            groups.setdefault(shard_key(uid), []).append(uid)
+    out = []
+    for key, part in groups.items():
+        pool = get_pool() if key is None else _open_shard(key).pool
+        with _using(pool) as con:
+            arg = json.dumps(part)
+            out.extend(dict(r) for r in con.execute(_USERS_ROLLUP_SELECT, (arg, arg)).fetchall())
+    return out
+
+# ── Valoraciones globales ──────────────────────────────────────────────────────
+# La valoración global depende solo de la tupla que recibe el modelo, así que
+# se guarda con esa tupla como clave (más el id del modelo). Está en DB_PATH:
+# dos alumnos con las mismas cifras comparten la valoración.
+
+GLOBAL_FEEDBACK_KEY = ("total_docs", "login_days", "pct_tu", "pct_sin_cambios", "avg_session_seconds")
+
+
+def get_cached_global_feedback(model: str, key: dict) -> str | None:
     with db() as con:
+        row = con.execute(f"""
+            SELECT feedback FROM global_feedback_cache
+            WHERE model=? AND {" AND ".join(f"{k}=?" for k in GLOBAL_FEEDBACK_KEY)}
+        """, (model, *(key[k] for k in GLOBAL_FEEDBACK_KEY))).fetchone()
+    return row["feedback"] if row is not None else None
+
+
+def _put_global_feedback_tx(con: sqlite3.Connection, model: str, key: dict, feedback: str):
+    con.execute(f"""
+        INSERT OR REPLACE INTO global_feedback_cache(model, {", ".join(GLOBAL_FEEDBACK_KEY)}, feedback)
+        VALUES(?{",?" * len(GLOBAL_FEEDBACK_KEY)}, ?)
+    """, (model, *(key[k] for k in GLOBAL_FEEDBACK_KEY), feedback))
+
+
+def put_cached_global_feedback(model: str, key: dict, feedback: str):
+    write(_put_global_feedback_tx, model, key, feedback)
+
+# ── Sesiones ───────────────────────────────────────────────────────────────────
+
+def _session_closed(con: sqlite3.Connection, closed: list):
+    """
+    Suma a los rollups las sesiones recién cerradas: lista de
+    (user_id, duration, ended_at). En daily_activity cuentan el día del cierre.
+    """
+    by_user = {}
+    for uid, dur, ended_at in closed:
+        if dur is None:
+            continue
+        n, total = by_user.get(uid, (0, 0.0))
+        by_user[uid] = (n + 1, total + float(dur))
+        _bump_daily(con, uid, time.strftime("%Y-%m-%d", time.gmtime(ended_at)), seconds=dur)
+    for uid, (n, total) in by_user.items():
+        _apply_user_stats(con, uid, {"session_count": n, "session_seconds": total})
+
+
+def _record_login_ts_tx(con: sqlite3.Connection, user_id: int, ts: float):
+    closed = con.execute("""
+        UPDATE sessions
+        SET ended_at = last_seen,
+            duration = MIN(MAX(last_seen - started_at, 0), ?)
+        WHERE user_id=? AND ended_at IS NULL
+        RETURNING user_id, duration, ended_at
+    """, (MAX_SESSION_SECS, user_id)).fetchall()
+    _session_closed(con, closed)
+    con.execute(
+        "INSERT INTO sessions(user_id, started_at, last_seen) VALUES(?,?,?)",
+        (user_id, ts, ts)
+    )
+
+def record_login_ts(user_id: int, epoch_seconds: float):
+    """Abre una sesión nueva; si el usuario tenía otra abierta la cierra en su último latido."""
+    write_for_user(user_id, _record_login_ts_tx, user_id, float(epoch_seconds))
+
+def _touch_sessions_tx(con: sqlite3.Connection, rows: list):
+    con.executemany("""
+        UPDATE sessions SET last_seen = MAX(last_seen, ?)
+        WHERE user_id=? AND ended_at IS NULL
+    """, rows)
+
+def touch_sessions(items):
+    """Latidos por lotes: (user_id, epoch) → last_seen de cada sesión abierta."""
+    rows = [(float(ts), uid) for uid, ts in items]
+    if not sharding_enabled():
+        write(_touch_sessions_tx, rows)
+        return
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(shard_key(row[1]), []).append(row)
+    futures = [
+        _shard_for_user(part[0][1]).writer.submit(_touch_sessions_tx, part)
+        for part in by_shard.values()
+    ]
+    for f in futures:
+        f.result()
+
+def touch_session(user_id: int, epoch_seconds: float):
+    """Latido: actualiza last_seen de la sesión abierta del usuario."""
+    touch_sessions([(user_id, epoch_seconds)])
+
+def close_open_session(user_id: int, now_epoch: float, idle_grace: float = 1800.0):
+    """
+    Cierra la sesión abierta del usuario. Si el último latido es de hace más
+    de idle_grace segundos, la sesión termina en ese latido y no en now_epoch.
+    """
+    write_for_user(user_id, _close_open_session_tx, user_id, float(now_epoch), float(idle_grace))
+
+def _close_open_session_tx(con: sqlite3.Connection, user_id: int, now_epoch: float, idle_grace: float):
+    closed = con.execute("""
+        UPDATE sessions
+        SET ended_at = CASE WHEN ? - last_seen > ? THEN last_seen ELSE ? END,
+            duration = MIN(MAX(
+                CASE WHEN ? - last_seen > ? THEN last_seen ELSE ? END - started_at, 0), ?)
+        WHERE user_id=? AND ended_at IS NULL
+        RETURNING user_id, duration, ended_at
+    """, (
+        now_epoch, idle_grace, now_epoch,
+        now_epoch, idle_grace, now_epoch, MAX_SESSION_SECS,
+        user_id,
+    )).fetchall()
+    _session_closed(con, closed)
+
+def close_idle_sessions(idle_secs: float = 1800.0):
+    """
+    Cierra todas las sesiones abiertas cuyo último heartbeat fue hace
+    más de idle_secs segundos. Llamar al inicio de cada login.
+    Un único UPDATE sobre el índice parcial de sesiones abiertas.
+    """
+    _write_on_all(_close_idle_sessions_tx, time.time() - idle_secs)
+
+def _close_idle_sessions_tx(con: sqlite3.Connection, cutoff: float):
+    closed = con.execute("""
+        UPDATE sessions
+        SET ended_at = last_seen,
+            duration = MIN(MAX(last_seen - started_at, 0), ?)
+        WHERE ended_at IS NULL AND last_seen < ?
+        RETURNING user_id, duration, ended_at
+    """, (MAX_SESSION_SECS, cutoff)).fetchall()
+    _session_closed(con, closed)
+
+def _create_document_tx(
+    con: sqlite3.Connection,
+    user_id: int,
+    filename: str | None,
+    text_hash: str | None,
+    metrics: dict | None = None,
+    event: str | None = None,
+    texts: dict | None = None,
+    doc_id: int | None = None,
+) -> int:
+    texts = texts or {}
+    blob_hashes = [_put_blob_tx(con, texts.get(r)) for r in BLOB_ROLES]
+    cur = con.execute(
+        """
+        INSERT INTO documents(id, user_id, filename, text_hash, original_blob, corrected_blob, final_blob)
+        VALUES(?,?,?,?,?,?,?)
+        """,
+        (doc_id, user_id, filename, text_hash, *blob_hashes)
+    )
+    doc_id = cur.lastrowid
+    _apply_user_stats(con, user_id, {"docs": 1, **_doc_contribution({})})
+    _bump_daily(con, user_id, None, docs=1)
+    if metrics:
+        _set_document_metrics_tx(con, doc_id, metrics)
+    if event:
+        _record_usage_tx(con, user_id, event, None)
+    return doc_id
+
+def create_document(
+    user_id: int,
+    filename: str | None,
+    text_hash: str | None,
+    metrics: dict | None = None,
+    event: str | None = None,
+    texts: dict | None = None,
+) -> int:
+    """
+    Crea el documento y espera su id. Con `metrics` y `event` guarda también
+    sus métricas y el evento de uso en la misma tarea del escritor.
+    `texts` (rol → texto, roles de BLOB_ROLES) se comprime aquí y se guarda
+    en blobs.
+    """
+    packed = {r: pack_text(t) for r, t in (texts or {}).items() if r in BLOB_ROLES}
+    if not sharding_enabled():
+        return write(_create_document_tx, user_id, filename, text_hash, metrics, event, packed)
+    # Id global sacado del bloque del shard; un id que falle se pierde sin más
+    sh = _shard_for_user(user_id)
+    return sh.writer.submit(
+        _create_document_tx, user_id, filename, text_hash, metrics, event, packed,
+        sh.next_document_id(),
+    ).result()
+
+def _set_document_metrics_tx(con: sqlite3.Connection, document_id: int, metrics: dict):
+    cols = [k for k in DOCUMENT_METRIC_COLUMNS if k in metrics]
+    extra = [k for k in metrics if k not in DOCUMENT_METRIC_COLUMNS]
+
+    if cols:
+        old = con.execute(f"""
+            SELECT d.user_id, {", ".join(f"dm.{c}" for c in DOCUMENT_METRIC_COLUMNS)}
+            FROM documents d
+            LEFT JOIN document_metrics dm ON dm.document_id = d.id
+            WHERE d.id=?
+        """, (document_id,)).fetchone()
         con.execute(
+            f"""
+            INSERT INTO document_metrics(document_id, {", ".join(cols)})
+            VALUES(?{",?" * len(cols)})
+            ON CONFLICT(document_id) DO UPDATE SET
+              {", ".join(f"{c}=excluded.{c}" for c in cols)},
+              updated_at=datetime('now')
+            """,
+            (document_id, *(float(metrics[c]) for c in cols)),
+        )
+        if old is not None:
+            before = {c: old[c] for c in DOCUMENT_METRIC_COLUMNS}
+            after  = {**before, **{c: float(metrics[c]) for c in cols}}
+            plus, minus = _doc_contribution(after), _doc_contribution(before)
+            _apply_user_stats(con, old["user_id"], {k: plus[k] - minus[k] for k in plus})
+    logged = [k for k in cols if k in LOGGED_METRICS] + extra
+    if logged:
+        con.executemany(
             "INSERT INTO metrics(document_id, metric_name, metric_value) VALUES(?,?,?)",
-            (document_id, name, float(value))
+            [(document_id, k, float(metrics[k])) for k in logged],
         )
 
-def get_user_overview(username: str):
-    username = sanitize_username(username)
-    with db() as con:
-        row_docs = con.execute("""
-            SELECT COUNT(*) AS docs
-            FROM documents d
-            JOIN users u ON u.id = d.user_id
-            WHERE u.username=?
-        """, (username,)).fetchone()
-        total_docs = int(row_docs["docs"] if row_docs else 0)
-
-        avg_rows = con.execute("""
-            WITH latest AS (
-                SELECT m.* FROM metrics m
-                JOIN (
-                    SELECT document_id, metric_name, MAX(id) AS max_id
-                    FROM metrics GROUP BY document_id, metric_name
-                ) mx ON mx.max_id = m.id
-            )
-            SELECT l.metric_name, AVG(l.metric_value) AS avg_value
-            FROM latest l
-            JOIN documents d ON d.id = l.document_id
-            JOIN users u ON u.id = d.user_id
-            WHERE u.username=?
-            GROUP BY l.metric_name
-        """, (username,)).fetchall()
-
-        row_docs_with_tu = con.execute("""
-            WITH latest_tu AS (
-                SELECT m.document_id, m.metric_value
-                FROM metrics m
-                JOIN (
-                    SELECT document_id, MAX(id) AS max_id
-                    FROM metrics
-                    WHERE metric_name='frases_con_tu_impersonal'
-                    GROUP BY document_id
-                ) mx ON mx.max_id = m.id
-            )
-            SELECT COUNT(DISTINCT d.id) AS docs_with_tu
-            FROM documents d
-            JOIN users u ON u.id = d.user_id
-            LEFT JOIN latest_tu lt ON lt.document_id = d.id
-            WHERE u.username=? AND COALESCE(lt.metric_value,0) > 0
-        """, (username,)).fetchone()
-        docs_with_tu = int(row_docs_with_tu["docs_with_tu"] if row_docs_with_tu else 0)
-        docs_with_tu_percent = round((docs_with_tu * 100.0 / total_docs), 1) if total_docs > 0 else 0.0
+def set_document_metrics(document_id: int, metrics: dict, con: sqlite3.Connection | None = None):
+    """
+    Upsert de varias métricas de un documento en su fila de document_metrics.
+    Las que lo necesitan (LOGGED_METRICS o sin columna propia) se añaden
+    además al log `metrics`. Sin `con` pasa por el escritor y espera el commit.
+    """
+    if con is not None:
+        _set_document_metrics_tx(con, document_id, metrics)
+        return
+    sh = _shard_for_doc(document_id)
+    if sh is None:
+        raise ValueError("Documento no encontrado.")
+    sh.writer.submit(_set_document_metrics_tx, document_id, metrics).result()
 
-        row_docs_no_changes = con.execute("""
-            WITH latest_user_changes AS (
-                SELECT m.document_id, m.metric_value
-                FROM metrics m
-                JOIN (
-                    SELECT document_id, MAX(id) AS max_id
-                    FROM metrics
-                    WHERE metric_name='cambios_realizados_usuario'
-                    GROUP BY document_id
-                ) mx ON mx.max_id = m.id
-            )
-            SELECT COUNT(DISTINCT d.id) AS docs_no_changes
-            FROM documents d
-            JOIN users u ON u.id = d.user_id
-            LEFT JOIN latest_user_changes luc ON luc.document_id = d.id
-            WHERE u.username=? AND COALESCE(luc.metric_value,0) = 0
-        """, (username,)).fetchone()
+def insert_metric(document_id: int, name: str, value: float):
+    set_document_metrics(document_id, {name: value})
+
+def get_user_overview(user_id: int):
+    with user_db(user_id) as con:
+        row = con.execute("SELECT * FROM user_stats WHERE user_id=?", (user_id,)).fetchone()
+        usage_rows = con.execute(
+            "SELECT event, n, n_value, sum_value FROM user_event_stats WHERE user_id=?", (user_id,)
+        ).fetchall()
+        # Métricas sin columna propia: solo están en el log; cuenta el último
+        # valor de cada documento, como en la consulta original
+        extra_rows = con.execute(f"""
+            SELECT m.metric_name, AVG(m.metric_value) AS avg_value
+            FROM metrics m
+            JOIN (
+                SELECT document_id, metric_name, MAX(id) AS max_id
+                FROM metrics
+                WHERE document_id IN (SELECT id FROM documents WHERE user_id=?)
+                  AND metric_name NOT IN ({",".join("?" * len(DOCUMENT_METRIC_COLUMNS))})
+                GROUP BY document_id, metric_name
+            ) mx ON mx.max_id = m.id
+            GROUP BY m.metric_name
+        """, (user_id, *DOCUMENT_METRIC_COLUMNS)).fetchall()
 
-        docs_no_changes = int(row_docs_no_changes["docs_no_changes"] if row_docs_no_changes else 0)
+        st = dict(row) if row else {}
+        total_docs = int(st.get("docs") or 0)
+        docs_with_tu = int(st.get("docs_with_tu") or 0)
+        docs_with_tu_percent = round((docs_with_tu * 100.0 / total_docs), 1) if total_docs > 0 else 0.0
+        docs_no_changes = int(st.get("docs_no_changes") or 0)
         docs_no_changes_percent = round((docs_no_changes * 100.0 / total_docs), 1) if total_docs > 0 else 0.0
+        avg_metrics = {
+            c: st[f"sum_{c}"] / st[f"n_{c}"]
+            for c in DOCUMENT_METRIC_COLUMNS if st.get(f"n_{c}")
+        }
+        avg_metrics.update((r["metric_name"], r["avg_value"]) for r in extra_rows)
+        avg_metrics = dict(sorted(avg_metrics.items()))
+        session_count = int(st.get("session_count") or 0)
+        avg_session = (float(st["session_seconds"]) / session_count) if session_count else 0.0
 
-        usage_rows = con.execute("""
-            SELECT event, COUNT(*) AS n, AVG(value) AS avg_val
-            FROM usage_stats us
-            JOIN users u ON u.id = us.user_id
-            WHERE u.username=?
-            GROUP BY event
-        """, (username,)).fetchall()
-
-        login_days_row = con.execute("""
-            SELECT COUNT(DISTINCT date(us.created_at)) AS days
-            FROM usage_stats us
-            JOIN users u ON u.id = us.user_id
-            WHERE u.username=? AND us.event='login'
-        """, (username,)).fetchone()
-
-        avg_session_row = con.execute("""
-            SELECT AVG(us.value) AS avg_sec
-            FROM usage_stats us
-            JOIN users u ON u.id = us.user_id
-            WHERE u.username=? AND us.event='session_duration'
-        """, (username,)).fetchone()
+        usage = {
+            r["event"]: {
+                "count": r["n"],
+                "avg": (r["sum_value"] / r["n_value"]) if r["n_value"] else None,
+            }
+            for r in usage_rows
+        }
+        # Las duraciones de sesión viven ahora en `sessions`
+        usage["session_duration"] = {"count": session_count, "avg": avg_session if session_count else None}
 
         return {
             "docs": total_docs,
-            "avg_metrics": {r["metric_name"]: r["avg_value"] for r in avg_rows},
-            "usage": {r["event"]: {"count": r["n"], "avg": r["avg_val"]} for r in usage_rows},
-            "login_days": int(login_days_row["days"] if login_days_row else 0),
+            "avg_metrics": avg_metrics,
+            "usage": usage,
+            "login_days": int(st.get("login_days") or 0),
             "docs_with_tu_percent": docs_with_tu_percent,
             "docs_no_changes_percent": docs_no_changes_percent,
-            "avg_session_seconds": float(avg_session_row["avg_sec"] or 0.0),
+            "avg_session_seconds": avg_session,
         }
 
-def get_user_weekly_activity(username: str):
+def _activity_category(secs: float) -> str:
+    if secs == 0:
+        return "No inició sesión"
+    if secs <= 300:
+        return "Hasta 5 min"
+    if secs <= 900:
+        return "Hasta 15 min"
+    if secs <= 1800:
+        return "Hasta 30 min"
+    return "Más de 30 min"
+
+def get_user_weekly_activity(user_id: int):
     """
     Devuelve los últimos 7 días con su tiempo total de conexión (sumado)
     y una categoría de actividad.
     """
-    username = sanitize_username(username)
-    with db() as con:
+    with user_db(user_id) as con:
         rows = con.execute("""
-            SELECT 
-                date(us.created_at) AS day,
-                SUM(CASE WHEN us.event='session_duration' THEN us.value ELSE 0 END) AS total_seconds
-            FROM usage_stats us
-            JOIN users u ON u.id = us.user_id
-            WHERE u.username=? 
-              AND date(us.created_at) >= date('now', '-6 days')
-            GROUP BY date(us.created_at)
-            ORDER BY day ASC
-        """, (username,)).fetchall()
-
-        from datetime import datetime, timedelta
-        today = datetime.utcnow().date()
-        days = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
-        data = []
-        seconds_by_day = {r["day"]: float(r["total_seconds"] or 0) for r in rows}
-
-        for d in days:
-            secs = seconds_by_day.get(d, 0)
-            if secs == 0:
-                cat = "No inició sesión"
-            elif secs <= 300:
-                cat = "Hasta 5 min"
-            elif secs <= 900:
-                cat = "Hasta 15 min"
-            elif secs <= 1800:
-                cat = "Hasta 30 min"
-            else:
-                cat = "Más de 30 min"
-            data.append({"day": d, "total_seconds": secs, "categoria": cat})
-        return data
+            SELECT day, seconds
+            FROM daily_activity
+            WHERE user_id=? AND day >= date('now', '-6 days')
+        """, (user_id,)).fetchall()
 
-def get_user_documents(username: str):
-    username = sanitize_username(username)
-    with db() as con:
-        rows = con.execute("""
-            SELECT d.id, d.filename, d.uploaded_at
+    today = datetime.now(timezone.utc).date()
+    days = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
+    seconds_by_day = {r["day"]: float(r["seconds"] or 0) for r in rows}
+    return [
+        {"day": d, "total_seconds": seconds_by_day.get(d, 0), "categoria": _activity_category(seconds_by_day.get(d, 0))}
+        for d in days
+    ]
+
+ACTIVITY_BUCKETS = {
+    "day":   "day",
+    "week":  "date(day, '-6 days', 'weekday 1')",   # lunes de esa semana
+    "month": "strftime('%Y-%m-01', day)",
+}
+MAX_ACTIVITY_DAYS = 1100
+
+def _bucket_start(d: date, bucket: str) -> date:
+    if bucket == "week":
+        return d - timedelta(days=d.weekday())
+    if bucket == "month":
+        return d.replace(day=1)
+    return d
+
+def _next_bucket(d: date, bucket: str) -> date:
+    if bucket == "week":
+        return d + timedelta(days=7)
+    if bucket == "month":
+        return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+    return d + timedelta(days=1)
+
+def get_user_activity(
+    user_id: int,
+    start: str | None = None,
+    end: str | None = None,
+    bucket: str = "day",
+):
+    """
+    Actividad de un rango de fechas (YYYY-MM-DD, inclusivo, UTC) agrupada por
+    día, semana (empieza en lunes) o mes. Los periodos sin actividad salen a 0.
+    Por defecto, los últimos 30 días.
+    """
+    if bucket not in ACTIVITY_BUCKETS:
+        raise ValueError(f"bucket inválido: usa {', '.join(ACTIVITY_BUCKETS)}")
+    end_d = date.fromisoformat(end) if end else datetime.now(timezone.utc).date()
+    start_d = date.fromisoformat(start) if start else end_d - timedelta(days=29)
+    if start_d > end_d:
+        raise ValueError("start debe ser anterior o igual a end")
+    if (end_d - start_d).days >= MAX_ACTIVITY_DAYS:
+        raise ValueError(f"rango demasiado largo (máx {MAX_ACTIVITY_DAYS} días)")
+
+    with user_db(user_id) as con:
+        rows = con.execute(f"""
+            SELECT {ACTIVITY_BUCKETS[bucket]} AS period,
+                   TOTAL(seconds) AS seconds,
+                   SUM(logins) AS logins,
+                   SUM(docs) AS docs,
+                   SUM(seconds > 0 OR logins > 0 OR docs > 0) AS active_days
+            FROM daily_activity
+            WHERE user_id=? AND day BETWEEN ? AND ?
+            GROUP BY period
+        """, (user_id, start_d.isoformat(), end_d.isoformat())).fetchall()
+
+    by_period = {r["period"]: r for r in rows}
+    series = []
+    p = _bucket_start(start_d, bucket)
+    while p <= end_d:
+        r = by_period.get(p.isoformat())
+        series.append({
+            "period":      p.isoformat(),
+            "seconds":     float(r["seconds"]) if r else 0.0,
+            "logins":      int(r["logins"]) if r else 0,
+            "docs":        int(r["docs"]) if r else 0,
+            "active_days": int(r["active_days"]) if r else 0,
+        })
+        p = _next_bucket(p, bucket)
+
+    return {
+        "start":  start_d.isoformat(),
+        "end":    end_d.isoformat(),
+        "bucket": bucket,
+        "series": series,
+        "totals": {
+            k: sum(x[k] for x in series) for k in ("seconds", "logins", "docs", "active_days")
+        },
+    }
+
+def get_user_tu_series(user_id: int, window: int) -> dict:
+    """
+    Secuencia de documentos del usuario con tasa móvil de documentos con
+    'tú' impersonal (ventana de `window` documentos, función de ventana) y
+    los mismos datos agrupados por semana. Un documento sin métricas cuenta
+    como sin 'tú', igual que en user_stats.
+    """
+    with user_db(user_id) as con:
+        docs = con.execute("""
+            SELECT ROW_NUMBER() OVER w AS seq,
+                   d.id AS doc_id,
+                   date(d.uploaded_at) AS day,
+                   COALESCE(dm.frases_con_tu_impersonal, 0) > 0 AS has_tu,
+                   AVG(COALESCE(dm.frases_con_tu_impersonal, 0) > 0)
+                       OVER (w ROWS BETWEEN ? PRECEDING AND CURRENT ROW) AS rolling_rate
             FROM documents d
-            JOIN users u ON u.id = d.user_id
-            WHERE u.username=?
-            ORDER BY d.id DESC
-        """, (username,)).fetchall()
+            LEFT JOIN document_metrics dm ON dm.document_id = d.id
+            WHERE d.user_id=?
+            WINDOW w AS (ORDER BY d.id)
+            ORDER BY d.id
+        """, (max(int(window), 1) - 1, user_id)).fetchall()
+        weekly = con.execute("""
+            SELECT week, COUNT(*) AS docs, SUM(has_tu) AS docs_with_tu,
+                   AVG(has_tu) AS rate
+            FROM (
+                SELECT date(d.uploaded_at, '-6 days', 'weekday 1') AS week,
+                       COALESCE(dm.frases_con_tu_impersonal, 0) > 0 AS has_tu
+                FROM documents d
+                LEFT JOIN document_metrics dm ON dm.document_id = d.id
+                WHERE d.user_id=?
+            )
+            GROUP BY week ORDER BY week
+        """, (user_id,)).fetchall()
+    return {"docs": [dict(r) for r in docs], "weekly": [dict(r) for r in weekly]}
+
+def get_user_documents(user_id: int):
+    with user_db(user_id) as con:
+        rows = con.execute("""
+            SELECT id, filename, uploaded_at, original_blob IS NOT NULL AS has_texts
+            FROM documents
+            WHERE user_id=?
+            ORDER BY id DESC
+        """, (user_id,)).fetchall()
         return [dict(r) for r in rows]
 
 def get_document_metrics(doc_id: int):
-    with db() as con:
-        rows = con.execute("""
+    with doc_db(doc_id) as con:
+        row = con.execute(f"""
+            SELECT {", ".join(DOCUMENT_METRIC_COLUMNS)}, updated_at
+            FROM document_metrics
+            WHERE document_id=?
+        """, (doc_id,)).fetchone()
+        extra = con.execute(f"""
             SELECT metric_name, metric_value, created_at
             FROM metrics
             WHERE document_id=?
+              AND metric_name NOT IN ({",".join("?" * len(DOCUMENT_METRIC_COLUMNS))})
             ORDER BY id
-        """, (doc_id,)).fetchall()
+        """, (doc_id, *DOCUMENT_METRIC_COLUMNS)).fetchall()
+
+        out = []
+        if row:
+            out = [
+                {"metric_name": c, "metric_value": row[c], "created_at": row["updated_at"]}
+                for c in DOCUMENT_METRIC_COLUMNS if row[c] is not None
+            ]
+        return out + [dict(r) for r in extra]
+
+def get_document_metric_history(doc_id: int, name: str | None = None):
+    """Log histórico (append-only) de métricas de un documento."""
+    with doc_db(doc_id) as con:
+        if name is None:
+            rows = con.execute("""
+                SELECT metric_name, metric_value, created_at
+                FROM metrics WHERE document_id=? ORDER BY id
+            """, (doc_id,)).fetchall()
+        else:
+            rows = con.execute("""
+                SELECT metric_name, metric_value, created_at
+                FROM metrics WHERE document_id=? AND metric_name=? ORDER BY id
+            """, (doc_id, name)).fetchall()
         return [dict(r) for r in rows]
 
+def _delete_document_tx(con: sqlite3.Connection, doc_id: int) -> bool:
+    old = con.execute(f"""
+        SELECT d.user_id, date(d.uploaded_at) AS day,
+               d.original_blob, d.corrected_blob, d.final_blob,
+               {", ".join(f"dm.{c}" for c in DOCUMENT_METRIC_COLUMNS)}
+        FROM documents d
+        LEFT JOIN document_metrics dm ON dm.document_id = d.id
+        WHERE d.id=?
+    """, (doc_id,)).fetchone()
+    if old is not None:
+        minus = _doc_contribution({c: old[c] for c in DOCUMENT_METRIC_COLUMNS})
+        _apply_user_stats(con, old["user_id"], {"docs": -1, **{k: -v for k, v in minus.items()}})
+        _bump_daily(con, old["user_id"], old["day"], docs=-1)
+        for role in BLOB_ROLES:
+            _drop_blob_tx(con, old[f"{role}_blob"])
+    con.execute("DELETE FROM metrics WHERE document_id=?", (doc_id,))
+    con.execute("DELETE FROM document_metrics WHERE document_id=?", (doc_id,))
+    cur = con.execute("DELETE FROM documents WHERE id=?", (doc_id,))
+    return cur.rowcount > 0
+
 def delete_document(doc_id: int) -> bool:
-    with db() as con:
-        con.execute("DELETE FROM metrics WHERE document_id=?", (doc_id,))
-        cur = con.execute("DELETE FROM documents WHERE id=?", (doc_id,))
-        return cur.rowcount > 0
\ No newline at end of file
+    if not sharding_enabled():
+        return write(_delete_document_tx, doc_id)
+    sh = _shard_for_doc(doc_id)
+    if sh is None:
+        return False
+    return sh.writer.submit(_delete_document_tx, doc_id).result()
\ No newline at end of file
@@ -0,0 +1,217 @@
+# backend/events.py
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+
+# ── Canal de eventos por WebSocket ─────────────────────────────────────────────
+# Cada pestaña abre un WebSocket (/ws) que hace de presencia (sustituye a los
+# heartbeats y al logout por sendBeacon) y por el que el backend empuja
+# eventos: feedback listo, progreso de jobs y progreso de carga del modelo.
+# Los eventos se publican desde cualquier hilo (los del modelo, el escritor,
+# el event loop) y se entregan en la cola asyncio de cada suscriptor con
+# call_soon_threadsafe. Las colas están acotadas: a un cliente lento se le
+# descartan los eventos más antiguos (son estados, el último manda).
+#
+# Rutas de entrega:
+# - por usuario:   jobs del usuario,
+# - por documento: feedback de los doc_id que el cliente pidió vigilar,
+# - a todos:       progreso de carga del modelo.
+#
+# Cuando se cierra la última conexión de presencia de un usuario, quien la
+# gestiona (main.py) espera LOGOUT_GRACE segundos y cierra la sesión si
+# entretanto no volvió a conectarse (recargas, reruns de Streamlit).
+#
+# Con el lanzador prefork (backend/prefork.py) hay varios workers detrás del
+# mismo socket: el WebSocket de un usuario puede estar en un worker y su job
+# o su feedback en otro. Cada worker tiene una tubería con el padre; lo que
+# se publica aquí sale también por ella y el padre lo reenvía al resto, que
+# lo entrega a sus suscriptores locales. Los estados que se consultan por
+# polling (/jobs/{id}, /feedback_status) viajan igual con publish_state() y
+# cada worker guarda el último de cada clave publicado por los demás.
+
+QUEUE_MAX      = int(os.getenv("PALABRIA_WS_QUEUE", "64"))
+PRESENCE_TICK  = float(os.getenv("PALABRIA_WS_PRESENCE_SECS", "20"))
+LOGOUT_GRACE   = float(os.getenv("PALABRIA_WS_LOGOUT_GRACE_SECS", "30"))
+STATE_MAX      = int(os.getenv("PALABRIA_RELAY_STATE_MAX", "1024"))
+
+_lock = threading.Lock()
+_subs: set = set()
+_by_user: dict = {}         # username → set de Subscriber
+_presence: dict = {}        # username → [conexiones de presencia abiertas, generación]
+_stats = {"connections": 0, "published": 0, "delivered": 0, "dropped": 0, "logouts": 0,
+          "relayed_out": 0, "relayed_in": 0}
+
+_relay = None               # tubería con el padre (solo en workers prefork)
+_relay_lock = threading.Lock()
+_remote: OrderedDict = OrderedDict()    # (tipo, clave) → último estado de otro worker
+
+
+class Subscriber:
+    def __init__(self, username: str, loop: asyncio.AbstractEventLoop, presence: bool):
+        self.username = username
+        self.presence = presence
+        self.docs: set = set()      # doc_id vigilados
+        self.queue = asyncio.Queue(QUEUE_MAX)
+        self._loop = loop
+
+    def _put(self, event: dict):
+        # En el event loop del suscriptor
+        if self.queue.full():
+            self.queue.get_nowait()
+            with _lock:
+                _stats["dropped"] += 1
+        self.queue.put_nowait(event)
+
+    def push(self, event: dict):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass    # el loop ya se cerró: la conexión está muriendo
+
+
+def connect(username: str, presence: bool = True) -> Subscriber:
+    """Registra una conexión. Debe llamarse desde el event loop que la atiende."""
+    sub = Subscriber(username, asyncio.get_running_loop(), presence)
+    with _lock:
+        _subs.add(sub)
+        _by_user.setdefault(username, set()).add(sub)
+        if presence:
+            entry = _presence.setdefault(username, [0, 0])
+            entry[0] += 1
+            entry[1] += 1
+        _stats["connections"] += 1
+    return sub
+
+
+def disconnect(sub: Subscriber) -> int | None:
+    """
+    Da de baja la conexión. Si era la última de presencia del usuario
+    devuelve su generación (para reconnected()); si no, None.
+    """
+    with _lock:
+        _subs.discard(sub)
+        subs = _by_user.get(sub.username)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del _by_user[sub.username]
+        if not sub.presence:
+            return None
+        entry = _presence.get(sub.username)
+        if entry is None:
+            return None
+        entry[0] -= 1
+        return entry[1] if entry[0] == 0 else None
+
+
+def reconnected(username: str, generation: int) -> bool:
+    """¿Se abrió otra conexión de presencia desde que se cerró la de `generation`?"""
+    with _lock:
+        entry = _presence.get(username)
+        if entry is None or entry[0] > 0 or entry[1] != generation:
+            return True
+        del _presence[username]
+        _stats["logouts"] += 1
+        return False
+
+
+def is_connected(username: str) -> bool:
+    with _lock:
+        entry = _presence.get(username)
+        return entry is not None and entry[0] > 0
+
+
+def _deliver(targets, event: dict):
+    for sub in targets:
+        sub.push(event)
+    with _lock:
+        _stats["published"] += 1
+        _stats["delivered"] += len(targets)
+
+
+def _local(route: str, key, event: dict):
+    with _lock:
+        if route == "user":
+            targets = list(_by_user.get(key, ()))
+        elif route == "doc":
+            targets = [s for s in _subs if key in s.docs]
+        else:
+            targets = list(_subs)
+    _deliver(targets, event)
+
+
+def _forward(msg: tuple):
+    if _relay is None:
+        return
+    try:
+        with _relay_lock:
+            _relay.send(msg)
+    except (OSError, EOFError, ValueError):
+        return      # el padre ya no está: se sigue sirviendo solo lo local
+    with _lock:
+        _stats["relayed_out"] += 1
+
+
+def publish_user(username: str, event: dict):
+    _local("user", username, event)
+    _forward(("user", username, event))
+
+
+def publish_doc(doc_id: int, event: dict):
+    _local("doc", doc_id, event)
+    _forward(("doc", doc_id, event))
+
+
+def broadcast(event: dict):
+    _local("all", None, event)
+    _forward(("all", None, event))
+
+
+def publish_state(kind: str, key, state: dict):
+    """Estado consultable por polling; solo llega a los demás workers."""
+    _forward(("state", (kind, key), state))
+
+
+def remote_state(kind: str, key) -> dict | None:
+    """Último estado de (kind, key) publicado por otro worker, o None."""
+    with _lock:
+        state = _remote.get((kind, key))
+        return dict(state) if state is not None else None
+
+
+def _relay_loop(conn):
+    while True:
+        try:
+            route, key, payload = conn.recv()
+        except (EOFError, OSError):
+            return
+        with _lock:
+            _stats["relayed_in"] += 1
+            if route == "state":
+                _remote[key] = payload
+                _remote.move_to_end(key)
+                while len(_remote) > STATE_MAX:
+                    _remote.popitem(last=False)
+                continue
+        _local(route, key, payload)
+
+
+def attach_relay(conn):
+    """Conecta este worker con el padre prefork (una sola vez, tras el fork)."""
+    global _relay
+    _relay = conn
+    threading.Thread(target=_relay_loop, args=(conn,), name="palabria-relay", daemon=True).start()
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "open":           len(_subs),
+            "users_present":  sum(1 for c, _ in _presence.values() if c > 0),
+            "logout_grace":   LOGOUT_GRACE,
+            "relay":          _relay is not None,
+            "remote_states":  len(_remote),
+        }
@@ -0,0 +1,275 @@
+# backend/export.py
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+import backend.db as db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:     # la exportación es opcional; el resto del backend no lo necesita
+    pa = None
+
+
+# ── Exportación columnar para análisis ─────────────────────────────────────────
+# Vuelca documents, metrics, usage_stats (+ usage_daily, los eventos ya
+# compactados) y una tabla derivada de features por documento a Parquet o
+# Arrow IPC, por trozos de CHUNK_ROWS filas (memoria acotada) y opcionalmente
+# particionado por mes al estilo Hive: <tabla>/month=YYYY-MM/part-NNN.parquet.
+# Lee de una conexión de solo lectura dentro de una única transacción: en WAL
+# es una foto consistente de la base que no bloquea a los escritores.
+# Con sharding hay un part-NNN por shard.
+
+CHUNK_ROWS = int(os.getenv("PALABRIA_EXPORT_CHUNK", "50000"))
+EXPORT_DIR = os.getenv("PALABRIA_EXPORT_DIR") or str(Path(db.DB_PATH).parent / "exports")
+FORMATS    = {"parquet": ".parquet", "arrow": ".arrow"}
+PARTITIONS = ("none", "month")
+
+_TS = "%Y-%m-%d %H:%M:%S"
+
+_DOC_METRICS = ", ".join(f"dm.{c}" for c in db.DOCUMENT_METRIC_COLUMNS)
+
+# tabla → (consulta, [(columna, tipo)], columna de fecha para particionar)
+# Tipos: int, float, str, ts (texto datetime de SQLite), date (YYYY-MM-DD)
+TABLES = {
+    "documents": ("""
+        SELECT d.id AS document_id, d.user_id, u.username, d.filename, d.text_hash, d.uploaded_at
+        FROM documents d JOIN users u ON u.id = d.user_id
+        ORDER BY d.id
+    """, [
+        ("document_id", "int"), ("user_id", "int"), ("username", "str"),
+        ("filename", "str"), ("text_hash", "str"), ("uploaded_at", "ts"),
+    ], "uploaded_at"),
+    "metrics": ("""
+        SELECT m.id, m.document_id, d.user_id, m.metric_name, m.metric_value, m.created_at
+        FROM metrics m LEFT JOIN documents d ON d.id = m.document_id
+        ORDER BY m.id
+    """, [
+        ("id", "int"), ("document_id", "int"), ("user_id", "int"),
+        ("metric_name", "str"), ("metric_value", "float"), ("created_at", "ts"),
+    ], "created_at"),
+    "usage_stats": ("""
+        SELECT id, user_id, event, value, created_at FROM usage_stats ORDER BY id
+    """, [
+        ("id", "int"), ("user_id", "int"), ("event", "str"), ("value", "float"), ("created_at", "ts"),
+    ], "created_at"),
+    "usage_daily": ("""
+        SELECT user_id, day, event, n, n_value, sum_value FROM usage_daily ORDER BY day, user_id, event
+    """, [
+        ("user_id", "int"), ("day", "date"), ("event", "str"),
+        ("n", "int"), ("n_value", "int"), ("sum_value", "float"),
+    ], "day"),
+    # Features por documento: métricas en columnas, tasas derivadas, tamaño
+    # de los textos y posición del documento en la historia del usuario.
+    "document_features": (f"""
+        SELECT d.id AS document_id, d.user_id, d.uploaded_at,
+               ROW_NUMBER() OVER (PARTITION BY d.user_id ORDER BY d.id) AS doc_seq,
+               {_DOC_METRICS},
+               dm.frases_con_tu_impersonal / NULLIF(dm.total_frases, 0) AS tasa_tu_impersonal,
+               dm.cambios_realizados_usuario / NULLIF(dm.cambios_propuestos_modelo, 0) AS tasa_aceptacion,
+               bo.raw_size AS original_chars,
+               bc.raw_size AS corrected_chars,
+               d.final_blob IS NOT NULL AS has_final
+        FROM documents d
+        LEFT JOIN document_metrics dm ON dm.document_id = d.id
+        LEFT JOIN blobs bo ON bo.hash = d.original_blob
+        LEFT JOIN blobs bc ON bc.hash = d.corrected_blob
+        ORDER BY d.id
+    """, [
+        ("document_id", "int"), ("user_id", "int"), ("uploaded_at", "ts"), ("doc_seq", "int"),
+        *[(c, "float") for c in db.DOCUMENT_METRIC_COLUMNS],
+        ("tasa_tu_impersonal", "float"), ("tasa_aceptacion", "float"),
+        ("original_chars", "int"), ("corrected_chars", "int"), ("has_final", "int"),
+    ], "uploaded_at"),
+}
+
+
+def _arrow_type(kind: str):
+    return {
+        "int":   pa.int64(),
+        "float": pa.float64(),
+        "str":   pa.string(),
+        "ts":    pa.timestamp("s"),
+        "date":  pa.date32(),
+    }[kind]
+
+
+def _schema(columns: list):
+    return pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+
+
+def _column(values: list, kind: str):
+    # Fechas: se parsean vectorizadas en Arrow, no fila a fila en Python
+    if kind == "ts":
+        return pc.strptime(pa.array(values, pa.string()), format=_TS, unit="s", error_is_null=True)
+    if kind == "date":
+        ts = pc.strptime(pa.array(values, pa.string()), format="%Y-%m-%d", unit="s", error_is_null=True)
+        return ts.cast(pa.date32())
+    return pa.array(values, _arrow_type(kind))
+
+
+def _batch(rows: list, columns: list, schema):
+    cols = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [_column(list(cols[i]), kind) for i, (_, kind) in enumerate(columns)], schema=schema
+    )
+
+
+class _Writer:
+    def __init__(self, path: Path, schema, fmt: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.rows = 0
+        if fmt == "parquet":
+            self._w = pq.ParquetWriter(str(path), schema, compression="zstd")
+            self._write = lambda b: self._w.write_batch(b)
+        else:
+            self._sink = pa.OSFile(str(path), "wb")
+            self._w = ipc.new_file(self._sink, schema)
+            self._write = self._w.write_batch
+
+    def write(self, batch):
+        self._write(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        self._w.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+
+
+def _snapshot(path: str) -> sqlite3.Connection:
+    """Conexión de solo lectura con una transacción abierta: foto consistente."""
+    con = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, isolation_level=None)
+    con.execute("PRAGMA busy_timeout = 5000;")
+    con.execute("BEGIN")
+    con.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+    return con
+
+
+def _export_table(
+    con: sqlite3.Connection, name: str, part: int, out: Path, fmt: str, partition: str, chunk_rows: int,
+) -> dict:
+    sql, columns, time_col = TABLES[name]
+    schema = _schema(columns)
+    ext = FORMATS[fmt]
+    time_idx = [c for c, _ in columns].index(time_col)
+    writers = {}    # mes (o None) → _Writer; un semestre son ~6 abiertos a la vez
+
+    def writer_for(month):
+        w = writers.get(month)
+        if w is None:
+            folder = out / name if partition == "none" else out / name / f"month={month or 'none'}"
+            w = writers[month] = _Writer(folder / f"part-{part:03d}{ext}", schema, fmt)
+        return w
+
+    cur = con.execute(sql)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if partition == "none":
+                writer_for(None).write(_batch(rows, columns, schema))
+                continue
+            by_month = {}
+            for r in rows:
+                by_month.setdefault(r[time_idx][:7] if r[time_idx] else None, []).append(r)
+            for month, month_rows in by_month.items():
+                writer_for(month).write(_batch(month_rows, columns, schema))
+        if partition == "none":
+            writer_for(None)    # tabla vacía: fichero sin filas, pero con su esquema
+    finally:
+        for w in writers.values():
+            w.close()
+    return {"rows": sum(w.rows for w in writers.values()), "files": len(writers)}
+
+
+def export(
+    out: str | None = None,
+    fmt: str = "parquet",
+    partition: str = "none",
+    tables: list | None = None,
+    chunk_rows: int | None = None,
+    on_table=None,
+) -> dict:
+    """
+    Exporta las tablas pedidas (todas por defecto) a `out`. Escribe primero en
+    `<out>.partial` y lo renombra al terminar: `out` nunca queda a medias.
+    Devuelve filas y ficheros por tabla.
+    """
+    if pa is None:
+        raise RuntimeError("La exportación necesita pyarrow: pip install pyarrow")
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt} (usa {' | '.join(FORMATS)})")
+    if partition not in PARTITIONS:
+        raise ValueError(f"Partición no soportada: {partition} (usa {' | '.join(PARTITIONS)})")
+    tables = list(tables or TABLES)
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        raise ValueError(f"Tablas desconocidas: {', '.join(unknown)}")
+
+    out_dir = Path(out or Path(EXPORT_DIR) / time.strftime("palabria-%Y%m%d-%H%M%S"))
+    if out_dir.exists():
+        raise ValueError(f"El destino ya existe: {out_dir}")
+    tmp = out_dir.with_name(out_dir.name + ".partial")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    t0 = time.monotonic()
+    summary = {t: {"rows": 0, "files": 0} for t in tables}
+    try:
+        for part, path in enumerate(db.data_paths()):
+            con = _snapshot(path)
+            try:
+                for name in tables:
+                    if on_table is not None:
+                        on_table(name)
+                    got = _export_table(con, name, part, tmp, fmt, partition, chunk_rows or CHUNK_ROWS)
+                    summary[name]["rows"]  += got["rows"]
+                    summary[name]["files"] += got["files"]
+            finally:
+                con.close()
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.replace(tmp, out_dir)
+    return {
+        "out":       str(out_dir),
+        "format":    fmt,
+        "partition": partition,
+        "tables":    summary,
+        "seconds":   round(time.monotonic() - t0, 3),
+    }
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────────
+# python -m backend.export --format parquet --partition month --out /tmp/palabria
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.export", description="Exporta la base de PALABRIA a Parquet/Arrow.")
+    ap.add_argument("--out", help=f"carpeta de destino (por defecto {EXPORT_DIR}/palabria-<fecha>)")
+    ap.add_argument("--format", choices=list(FORMATS), default="parquet")
+    ap.add_argument("--partition", choices=list(PARTITIONS), default="none")
+    ap.add_argument("--tables", help=f"lista separada por comas ({', '.join(TABLES)})")
+    ap.add_argument("--chunk-rows", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()] if args.tables else None
+    try:
+        result = export(args.out, args.format, args.partition, tables, args.chunk_rows)
+    except (ValueError, RuntimeError) as e:
+        ap.error(str(e))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
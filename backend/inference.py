@@ -0,0 +1,532 @@
+# backend/inference.py
+import argparse
+import itertools
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import backend.events as events
+
+
+# ── Servidor de inferencia ─────────────────────────────────────────────────────
+# backend/model.py guarda el modelo en globals del módulo: con N workers de
+# la API se cargaría N veces. Con INFERENCE_ADDRESS definido, los workers no
+# importan backend.model (ni torch): hablan con un proceso aparte que es el
+# único que tiene el modelo en la GPU.
+#
+#   python -m backend.inference --address 127.0.0.1:6001
+#   INFERENCE_ADDRESS=127.0.0.1:6001 python -m backend.prefork --workers 4
+#
+# Los workers se lanzan con backend/prefork.py, no con `uvicorn --workers N`:
+# los jobs (/jobs/{id}), el feedback por documento en curso, las versiones de
+# las cachés por usuario y la presencia solo se ven entre workers a través del
+# relay y la memoria compartida que monta el lanzador. Con procesos de uvicorn
+# sueltos, un /jobs/{id} que cae en otro worker daría 404; backend/main.py se
+# niega a arrancar así (shared.uvicorn_workers()). Con un solo proceso
+# (`uvicorn backend.main:app`) no hay nada que compartir.
+#
+# La dirección es host:puerto o la ruta de un socket Unix. El transporte es
+# multiprocessing.connection: pickle sobre el socket, así que quien conozca la
+# clave puede ejecutar código en el otro extremo. La clave es INFERENCE_AUTHKEY
+# o, si no está definida, la del fichero INFERENCE_AUTHKEY_FILE (0600), que el
+# servidor crea con una clave aleatoria la primera vez y los workers leen. Sin
+# ninguna de las dos no arranca ni el servidor ni el cliente.
+#
+# El servidor recibe peticiones de todos los workers y las planifica con un
+# único hilo de GPU:
+# - prioridad por operación: correcciones (el usuario espera la respuesta)
+#   antes que feedback por documento y este antes que la valoración global,
+# - lotes: las correcciones en cola se corrigen juntas en un solo generate
+#   (hasta BATCH_MAX, esperando BATCH_WINDOW_MS a que lleguen más),
+# - peticiones idénticas en cola se resuelven con una sola generación.
+# El estado de carga del modelo se empuja a los workers, que lo reenvían por
+# su WebSocket (backend/events.py).
+
+INFERENCE_ADDRESS = os.getenv("INFERENCE_ADDRESS", "")
+INFERENCE_AUTHKEY_FILE = os.getenv("INFERENCE_AUTHKEY_FILE", os.path.expanduser("~/.palabria/inference.key"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "600"))
+
+BATCH_MAX       = int(os.getenv("PALABRIA_INFERENCE_BATCH_MAX", "4"))
+BATCH_WINDOW_MS = float(os.getenv("PALABRIA_INFERENCE_BATCH_WINDOW_MS", "10"))
+
+# Operaciones en orden de prioridad
+OPS = ("correct", "feedback", "global_feedback")
+
+FEEDBACK_WORKERS = int(os.getenv("PALABRIA_FEEDBACK_THREADS", "4"))
+
+
+def parse_address(address: str):
+    """'host:puerto' → (host, puerto); cualquier otra cosa es un socket Unix."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _create_authkey_file(path: str):
+    """Escribe una clave aleatoria en `path` (0600) si aún no existe."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".inference-key-")     # ya 0600
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32) + "\n")
+        try:
+            os.link(tmp, path)      # atómico: nadie lee el fichero a medio escribir
+        except FileExistsError:
+            pass                    # otro proceso se adelantó: vale la suya
+    finally:
+        os.unlink(tmp)
+
+
+def load_authkey(create: bool = False) -> bytes:
+    """
+    Clave compartida entre el servidor y los workers: INFERENCE_AUTHKEY o el
+    contenido de INFERENCE_AUTHKEY_FILE. Con create=True (el servidor) el
+    fichero se genera si no existe. RuntimeError si no hay clave o si el
+    fichero lo pueden leer otros usuarios.
+    """
+    key = os.getenv("INFERENCE_AUTHKEY", "")
+    if key:
+        return key.encode()
+    path = INFERENCE_AUTHKEY_FILE
+    if create:
+        _create_authkey_file(path)
+    try:
+        mode = os.stat(path).st_mode
+        with open(path) as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"Sin clave para el servidor de inferencia: define INFERENCE_AUTHKEY o arranca antes "
+            f"`python -m backend.inference`, que crea {path}"
+        ) from None
+    if mode & 0o077:
+        raise RuntimeError(f"{path} tiene permisos demasiado abiertos: chmod 600 {path}")
+    if not key:
+        raise RuntimeError(f"{path} está vacío")
+    return key.encode()
+
+
+# ── Lado servidor ──────────────────────────────────────────────────────────────
+
+class _Peer:
+    """Conexión de un worker de la API; los envíos se serializan con un lock."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, msg) -> bool:
+        try:
+            with self._lock:
+                self.conn.send(msg)
+            return True
+        except (OSError, EOFError, ValueError):
+            return False
+
+
+class _Request:
+    def __init__(self, op: str, args: tuple, kwargs: dict):
+        self.op = op
+        self.args = args
+        self.kwargs = kwargs
+        self.waiters = []       # (peer, req_id)
+        self.enqueued = time.monotonic()
+
+
+class Server:
+    def __init__(self, address, authkey: bytes | None = None):
+        self.authkey = authkey or load_authkey(create=True)
+        import backend.model as model     # solo el servidor carga torch y el modelo
+        self.model = model
+        self.address = address
+        self._cond = threading.Condition()
+        self._queues = {op: deque() for op in OPS}
+        self._pending = {}      # (op, args, kwargs) → _Request aún en cola
+        self._peers = set()
+        self._stats = {
+            "requests": 0, "coalesced": 0, "batches": 0, "max_batch": 0,
+            "errors": 0, "avg_wait_ms": 0.0, "connections": 0,
+        }
+
+    # Entrada de peticiones
+
+    def _submit(self, peer: _Peer, req_id: int, op: str, args: tuple, kwargs: dict):
+        key = (op, args, tuple(sorted(kwargs.items())))
+        with self._cond:
+            self._stats["requests"] += 1
+            req = self._pending.get(key)
+            if req is not None:
+                self._stats["coalesced"] += 1
+            else:
+                req = self._pending[key] = _Request(op, args, kwargs)
+                self._queues[op].append(req)
+                self._cond.notify()
+            req.waiters.append((peer, req_id))
+
+    def _status(self) -> dict:
+        m = self.model
+        return {
+            "modelo_listo": m.MODEL_LOADED,
+            "progress":     m.LOAD_PROGRESS,
+            "message":      m.LOAD_MESSAGE,
+            "model_id":     m.MODEL_ID,
+        }
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "queued": {op: len(q) for op, q in self._queues.items()},
+                "batch_max": BATCH_MAX,
+            }
+
+    def _serve_peer(self, conn):
+        peer = _Peer(conn)
+        with self._cond:
+            self._peers.add(peer)
+            self._stats["connections"] += 1
+        peer.send(("status", self._status()))
+        try:
+            while True:
+                req_id, op, args, kwargs = conn.recv()
+                if op == "status":
+                    peer.send(("reply", req_id, True, self._status()))
+                elif op == "stats":
+                    peer.send(("reply", req_id, True, self.get_stats()))
+                elif op == "load":
+                    self.model.ensure_model_loaded(async_load=True)
+                    peer.send(("reply", req_id, True, None))
+                elif op in self._queues:
+                    self._submit(peer, req_id, op, tuple(args), dict(kwargs))
+                else:
+                    peer.send(("reply", req_id, False, f"Operación desconocida: {op}"))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._cond:
+                self._peers.discard(peer)
+            conn.close()
+
+    # Planificación
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not any(self._queues.values()):
+                self._cond.wait()
+            op = next(o for o in OPS if self._queues[o])
+            q = self._queues[op]
+            limit = BATCH_MAX if op == "correct" else 1
+            if limit > 1 and len(q) < limit and BATCH_WINDOW_MS > 0:
+                # Ventana corta para juntar correcciones que llegan casi a la vez
+                deadline = time.monotonic() + BATCH_WINDOW_MS / 1000.0
+                while len(q) < limit:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            batch = [q.popleft() for _ in range(min(limit, len(q)))]
+            for req in batch:
+                self._pending.pop((req.op, req.args, tuple(sorted(req.kwargs.items()))), None)
+            return batch
+
+    def _execute(self, batch: list) -> list:
+        m = self.model
+        op = batch[0].op
+        if op == "correct":
+            return m.correct_full_texts([req.args[0] for req in batch])
+        if op == "feedback":
+            return [m.generate_feedback(*batch[0].args, **batch[0].kwargs)]
+        return [m.generate_global_feedback(*batch[0].args, **batch[0].kwargs)]
+
+    def _gpu_loop(self):
+        while True:
+            batch = self._next_batch()
+            now = time.monotonic()
+            try:
+                results = [(True, r) for r in self._execute(batch)]
+            except Exception as e:
+                results = [(False, f"{type(e).__name__}: {e}")] * len(batch)
+            with self._cond:
+                st = self._stats
+                st["batches"] += 1
+                st["max_batch"] = max(st["max_batch"], len(batch))
+                if not results[0][0]:
+                    st["errors"] += len(batch)
+                wait_ms = max((now - req.enqueued) * 1000.0 for req in batch)
+                st["avg_wait_ms"] = 0.8 * st["avg_wait_ms"] + 0.2 * wait_ms
+            for req, (ok, payload) in zip(batch, results):
+                for peer, req_id in req.waiters:
+                    peer.send(("reply", req_id, ok, payload))
+
+    def _status_loop(self):
+        last = None
+        while True:
+            status = self._status()
+            if status != last:
+                with self._cond:
+                    peers = list(self._peers)
+                for peer in peers:
+                    peer.send(("status", status))
+                last = status
+            time.sleep(0.25)
+
+    def serve_forever(self, load: bool = True):
+        if load:
+            self.model.ensure_model_loaded(async_load=True)
+        threading.Thread(target=self._gpu_loop, name="palabria-inference-gpu", daemon=True).start()
+        threading.Thread(target=self._status_loop, name="palabria-inference-status", daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError):
+                    continue    # handshake fallido (authkey incorrecta, cliente que se fue)
+                threading.Thread(target=self._serve_peer, args=(conn,), daemon=True).start()
+
+
+# ── Lado cliente ───────────────────────────────────────────────────────────────
+
+class RemoteModel:
+    """
+    Sustituto de backend.model para los workers de la API: misma interfaz
+    (MODEL_LOADED, LOAD_PROGRESS, LOAD_MESSAGE, MODEL_ID, ensure_model_loaded,
+    correct_full_text, generate_feedback, generate_global_feedback,
+    schedule_feedback, get_feedback_status), con la generación en el servidor.
+    Una sola conexión por proceso, compartida por todos los hilos: un hilo
+    lector reparte las respuestas a los Future de cada llamada.
+
+    MODEL_LOADED, LOAD_PROGRESS, LOAD_MESSAGE y MODEL_ID no bloquean: leen el
+    último estado que empujó el servidor (lo actualiza el hilo lector) y, sin
+    conexión, la abren en un hilo aparte. Se consultan desde el event loop
+    (/ws, global_feedback) y un servidor lento o caído no debe pararlo.
+    """
+
+    def __init__(self, address: str, authkey: bytes | None = None):
+        self.address = address
+        self._authkey = authkey or load_authkey()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._conn = None
+        self._connecting = False
+        self._connecting_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._waiting = {}      # req_id → Future
+        self._status = {
+            "modelo_listo": False,
+            "progress":     0,
+            "message":      "Conectando con el servidor de inferencia…",
+            "model_id":     None,
+        }
+        self._stats = {"calls": 0, "errors": 0, "reconnects": 0}
+        # Feedback por documento: mismo contrato que model.schedule_feedback
+        self._feedback_jobs = {}
+        self._feedback_inflight = {}
+        self._feedback_lock = threading.Lock()
+        self._feedback_slots = threading.Semaphore(FEEDBACK_WORKERS)
+
+    # Conexión
+
+    def _connection(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+            conn = Client(parse_address(self.address), authkey=self._authkey)
+            self._conn = conn
+            self._stats["reconnects"] += 1
+        threading.Thread(target=self._read_loop, args=(conn,), name="palabria-inference-client", daemon=True).start()
+        return conn
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                msg = conn.recv()
+                if msg[0] == "status":
+                    self._set_status(msg[1])
+                    continue
+                _, req_id, ok, payload = msg
+                with self._lock:
+                    fut = self._waiting.pop(req_id, None)
+                if fut is None:
+                    continue
+                if ok:
+                    fut.set_result(payload)
+                else:
+                    fut.set_exception(RuntimeError(payload))
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            waiting, self._waiting = self._waiting, {}
+        for fut in waiting.values():
+            fut.set_exception(ConnectionError("Se perdió la conexión con el servidor de inferencia."))
+        self._set_status({**self._status, "modelo_listo": False, "progress": 0,
+                          "message": "❌ Servidor de inferencia no disponible"})
+        conn.close()
+
+    def _set_status(self, status: dict):
+        changed = status != self._status
+        self._status = status
+        if changed:
+            events.broadcast({
+                "type":         "model",
+                "modelo_listo": status["modelo_listo"],
+                "progress":     status["progress"],
+                "message":      status["message"],
+            })
+
+    def _call(self, op: str, *args, **kwargs):
+        fut = Future()
+        req_id = next(self._ids)
+        conn = self._connection()
+        with self._lock:
+            self._waiting[req_id] = fut
+            self._stats["calls"] += 1
+        try:
+            with self._send_lock:
+                conn.send((req_id, op, args, kwargs))
+            return fut.result(timeout=INFERENCE_TIMEOUT)
+        except Exception:
+            with self._lock:
+                self._waiting.pop(req_id, None)
+                self._stats["errors"] += 1
+            raise
+
+    def _refresh(self) -> dict:
+        """Último estado conocido; si no hay conexión se abre en segundo plano."""
+        if self._conn is None:
+            with self._connecting_lock:
+                start = not self._connecting
+                self._connecting = True
+            if start:
+                threading.Thread(target=self._connect_in_background, name="palabria-inference-connect",
+                                 daemon=True).start()
+        return self._status
+
+    def _connect_in_background(self):
+        try:
+            self._connection()
+        except Exception as e:     # OSError, o AuthenticationError con otra clave
+            self._status = {**self._status, "modelo_listo": False, "progress": 0,
+                            "message": f"❌ Servidor de inferencia no disponible: {e}"}
+        finally:
+            with self._connecting_lock:
+                self._connecting = False
+
+    # Interfaz de backend.model
+
+    @property
+    def MODEL_LOADED(self) -> bool:
+        return bool(self._refresh()["modelo_listo"])
+
+    @property
+    def LOAD_PROGRESS(self) -> int:
+        return int(self._refresh()["progress"])
+
+    @property
+    def LOAD_MESSAGE(self) -> str:
+        return self._refresh()["message"]
+
+    @property
+    def MODEL_ID(self) -> str | None:
+        return self._refresh().get("model_id")      # el servidor lo envía al conectar
+
+    def ensure_model_loaded(self, async_load: bool = True):
+        self._call("load")
+
+    def correct_full_text(self, text: str) -> str:
+        return self._call("correct", text)
+
+    def generate_feedback(self, original: str, corrected: str, n_errores: int = 0) -> str:
+        return self._call("feedback", original, corrected, n_errores)
+
+    def generate_global_feedback(self, **kwargs) -> str:
+        return self._call("global_feedback", **kwargs)
+
+    def schedule_feedback(self, doc_id: int, original: str, corrected: str, n_errores: int = 0):
+        key = (original, corrected)
+        events.publish_state("feedback", doc_id, {"status": "pending", "result": ""})
+        with self._feedback_lock:
+            self._feedback_jobs[doc_id] = {"status": "pending", "result": ""}
+            waiting = self._feedback_inflight.get(key)
+            if waiting is not None:
+                waiting.append(doc_id)
+                return
+            self._feedback_inflight[key] = [doc_id]
+
+        def _run():
+            with self._feedback_slots:
+                try:
+                    status, result = "done", self.generate_feedback(original, corrected, n_errores)
+                except Exception as e:
+                    status, result = "error", str(e)
+            with self._feedback_lock:
+                done = self._feedback_inflight.pop(key, [doc_id])
+                for d in done:
+                    self._feedback_jobs[d] = {"status": status, "result": result}
+            for d in done:
+                events.publish_state("feedback", d, {"status": status, "result": result})
+                events.publish_doc(d, {"type": "feedback", "doc_id": d, "status": status, "result": result})
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def get_feedback_status(self, doc_id: int) -> dict:
+        with self._feedback_lock:
+            fb = self._feedback_jobs.get(doc_id)
+            if fb is not None:
+                return dict(fb)
+        return events.remote_state("feedback", doc_id) or {"status": "not_found", "result": ""}
+
+    def get_stats(self) -> dict:
+        out = {"mode": "remote", "address": self.address, "connected": self._conn is not None, **self._stats}
+        if self._conn is not None:
+            try:
+                out["server"] = self._call("stats")
+            except Exception:
+                pass
+        return out
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """backend.model si no hay INFERENCE_ADDRESS; si no, el cliente remoto (uno por proceso)."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            if INFERENCE_ADDRESS:
+                _model = RemoteModel(INFERENCE_ADDRESS)
+            else:
+                import backend.model as model
+                _model = model
+        return _model
+
+
+def get_stats() -> dict:
+    m = get_model()
+    return m.get_stats() if isinstance(m, RemoteModel) else {"mode": "local"}
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────────
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.inference", description="Servidor de inferencia de PALABRIA.")
+    ap.add_argument("--address", default=INFERENCE_ADDRESS or "127.0.0.1:6001",
+                    help="host:puerto o ruta de socket Unix (por defecto INFERENCE_ADDRESS o 127.0.0.1:6001)")
+    ap.add_argument("--no-load", action="store_true", help="no cargar el modelo al arrancar (se carga con /load/)")
+    args = ap.parse_args(argv)
+    print(f"Servidor de inferencia en {args.address}", flush=True)
+    Server(parse_address(args.address)).serve_forever(load=not args.no_load)
+
+
+if __name__ == "__main__":
+    main()
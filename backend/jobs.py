@@ -0,0 +1,167 @@
+# backend/jobs.py
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import backend.events as events
+
+
+# ── Jobs asíncronos de procesamiento ───────────────────────────────────────────
+# job_id → {"status": "queued"|"running"|"done"|"error", "stage": str, ...}
+# POST /jobs devuelve el job_id al instante; GET /jobs/{id} consulta el progreso.
+# Los jobs viven en memoria del proceso y se purgan tras JOB_TTL_SECS.
+# Cada cambio de estado o etapa se empuja además al WebSocket del usuario.
+# Con varios workers prefork el job vive en el que lo creó; los demás
+# responden GET /jobs/{id} con la última copia que les llegó por el relay.
+
+JOB_WORKERS  = int(os.getenv("PALABRIA_JOB_WORKERS", "2"))
+JOB_TTL_SECS = float(os.getenv("PALABRIA_JOB_TTL", "3600"))
+
+STAGES = ("queued", "extracting", "detecting", "correcting", "metrics", "done")
+
+_jobs: dict = {}
+_jobs_lock  = threading.Lock()
+_tasks: set = set()          # referencias fuertes a las tasks en curso
+_tickets: dict = {}          # job_id → admission.Ticket mientras espera/ejecuta
+_slots: asyncio.Semaphore | None = None
+
+
+def _get_slots() -> asyncio.Semaphore:
+    # El semáforo se crea dentro del event loop que lo va a usar
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(JOB_WORKERS)
+    return _slots
+
+
+def _purge_expired(now: float):
+    expired = [
+        jid for jid, j in _jobs.items()
+        if j["finished_at"] is not None and now - j["finished_at"] > JOB_TTL_SECS
+    ]
+    for jid in expired:
+        _jobs.pop(jid, None)
+
+
+def _share(job: dict):
+    """Copia del job para los demás workers (con _jobs_lock)."""
+    events.publish_state("job", job["job_id"], {**job, "stages": list(job["stages"])})
+
+
+def _publish(job: dict):
+    """Evento de progreso para el WebSocket del usuario (con _jobs_lock)."""
+    event = {"type": "job", "job_id": job["job_id"], "kind": job["kind"], "status": job["status"], "stage": job["stage"]}
+    if job["status"] == "error":
+        event["error"] = job["error"]
+    events.publish_user(job["username"], event)
+    _share(job)
+
+
+def set_stage(job_id: str, stage: str):
+    now = time.time()
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job["stage"] = stage
+        job["stages"].append({"stage": stage, "at": now})
+        if job["status"] == "queued":
+            job["status"] = "running"   # jobs con ticket: arrancan en su primera etapa
+        _publish(job)
+
+
+def _finish(job_id: str, status: str, result=None, error: str | None = None):
+    now = time.time()
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job["status"]      = status
+        job["result"]      = result
+        job["error"]       = error
+        job["finished_at"] = now
+        if status == "done":
+            job["stage"] = "done"
+            job["stages"].append({"stage": "done", "at": now})
+        _publish(job)
+
+
+async def _execute(job_id: str, work, mark_running: bool = True):
+    if mark_running:
+        with _jobs_lock:
+            if job_id in _jobs:
+                _jobs[job_id]["status"] = "running"
+                _publish(_jobs[job_id])
+    try:
+        result = await work(lambda stage: set_stage(job_id, stage))
+        _finish(job_id, "done", result=result)
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        _finish(job_id, "error", error=str(detail))
+
+
+async def _run(job_id: str, work, ticket):
+    try:
+        if ticket is None:
+            async with _get_slots():
+                await _execute(job_id, work)
+        else:
+            # El turno lo espera el propio work (pipeline.analyze_once), que
+            # no ocupa slot si se suma a un análisis idéntico
+            try:
+                await _execute(job_id, work, mark_running=False)
+            finally:
+                ticket.release()
+    finally:
+        _tickets.pop(job_id, None)
+
+
+def submit(work, kind: str, username: str, ticket=None) -> str:
+    """
+    Encola un job. `work` es una corrutina `async def work(on_stage)` que
+    recibe un callback para informar la etapa actual y devuelve el resultado.
+    Con `ticket` (admission.Ticket ya reservado) el work debe esperar su turno
+    en esa cola (o liberarlo); aquí solo se libera al terminar. Sin ticket se
+    ejecutan como máximo JOB_WORKERS jobs a la vez.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _jobs_lock:
+        _purge_expired(now)
+        _jobs[job_id] = {
+            "job_id":      job_id,
+            "kind":        kind,
+            "username":    username,
+            "status":      "queued",
+            "stage":       "queued",
+            "stages":      [{"stage": "queued", "at": now}],
+            "created_at":  now,
+            "finished_at": None,
+            "result":      None,
+            "error":       None,
+        }
+        _share(_jobs[job_id])
+
+    if ticket is not None:
+        _tickets[job_id] = ticket
+    task = asyncio.get_running_loop().create_task(_run(job_id, work, ticket))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            out = events.remote_state("job", job_id)
+            if out is not None:
+                out["queue_position"] = 0    # la cola la conoce el worker dueño
+            return out
+        out = dict(job)
+        out["stages"] = list(job["stages"])
+    ticket = _tickets.get(job_id)
+    out["queue_position"] = ticket.position() if ticket is not None else 0
+    return out
@@ -1,21 +1,68 @@
 # backend/main.py
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import hashlib
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
+import io
+import json
+import os
 import time
-
-import backend.model as model
-from backend.metrics import _normalize_for_diff, word_levenshtein_count
-from backend.utils import extract_text_from_pdf, split_into_sentences, posible_tu_impersonal
+import zipfile
+
+import backend.inference as inference
+import backend.jobs as jobs
+import backend.admission as admission
+import backend.presence as presence
+import backend.events as events
+import backend.maintenance as maintenance
+import backend.export as export
+import backend.cohorts as cohorts
+import backend.trends as trends
+import backend.respcache as respcache
+import backend.shared as shared
+from backend.utils import extract_text_from_pdf
+from backend.pipeline import (
+    run_cpu, run_db, run_gpu, process_document, process_batch, BATCH_MAX_DOCS,
+    get_stats as pipeline_stats,
+)
 from backend.db import (
-    init_db, user_exists, create_user, get_user_id,
-    record_usage, create_document, insert_metric,
-    get_user_overview, get_user_documents, get_document_metrics,
+    init_db, user_exists, create_user, get_user_id, delete_user, get_user_id_cache_stats,
+    record_usage, insert_metric,
+    get_user_overview, get_user_documents, get_document_metrics, get_document_metric_history,
     sanitize_username, delete_document, record_login_ts,
-    close_open_session, close_idle_sessions, get_user_weekly_activity
+    close_open_session, close_idle_sessions, get_user_weekly_activity, get_user_activity,
+    flush_writes, get_write_stats, set_final_text, get_document_texts, get_blob_stats,
+    list_cohorts, get_cached_global_feedback, put_cached_global_feedback,
 )
 
-app = FastAPI(title="PALABRIA Backend")
+# Varios workers solo con backend/prefork.py (ver backend/inference.py)
+if shared.uvicorn_workers() > 1:
+    raise RuntimeError(
+        "uvicorn --workers no está soportado: los jobs, el feedback en curso y las cachés "
+        "quedarían aislados en cada proceso. Usa `python -m backend.prefork --workers N`."
+    )
+
+model = inference.get_model()
+
+
+# Importar la app (pruebas, scripts) no abre la DB ni arranca hilos: eso
+# pasa al arrancar el servidor, en cada worker si es prefork.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    presence.start()
+    maintenance.start()
+    try:
+        yield
+    finally:
+        maintenance.stop()
+        presence.stop()
+        flush_writes()
+
+
+app = FastAPI(title="PALABRIA Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,8 +72,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-init_db()
-
 
 # ── Estado ─────────────────────────────────────────────────────────────────────
 
@@ -38,6 +83,24 @@ def check_status():
         "message":      model.LOAD_MESSAGE,
     }
 
+@app.get("/stats/")
+def runtime_stats():
+    return {
+        "pipeline":  pipeline_stats(),
+        "admission": admission.get_stats(),
+        "presence":  presence.get_stats(),
+        "websocket": events.get_stats(),
+        "inference": inference.get_stats(),
+        "workers":   shared.get_stats(),
+        "db_writes": get_write_stats(),
+        "maintenance": maintenance.get_stats(),
+        "blobs":     get_blob_stats(),
+        "cohorts":   cohorts.get_stats(),
+        "trends":    trends.get_stats(),
+        "responses": respcache.get_stats(),
+        "user_ids":  get_user_id_cache_stats(),
+    }
+
 @app.post("/load/")
 def trigger_load():
     model.ensure_model_loaded(async_load=True)
@@ -54,6 +117,7 @@ def user_create(username: str = Form(...)):
             raise HTTPException(status_code=409, detail="El usuario ya existe. Elige otro nombre.")
         uid = create_user(username)
         record_usage(uid, "login", None)
+        presence.flush()
         close_idle_sessions(idle_secs=3600)
         record_login_ts(uid, time.time())
         return {"ok": True, "user_id": uid, "username": username}
@@ -70,6 +134,7 @@ def user_login(username: str = Form(...)):
         if uid is None:
             raise HTTPException(status_code=404, detail="La cuenta no existe. Crea una nueva.")
         record_usage(uid, "login", None)
+        presence.flush()
         close_idle_sessions(idle_secs=3600)
         record_login_ts(uid, time.time())
         return {"ok": True, "user_id": uid, "username": username}
@@ -85,6 +150,7 @@ def user_logout(username: str = Form(...)):
         uid = get_user_id(username)
         if uid is None:
             raise HTTPException(status_code=404, detail="Usuario no válido.")
+        presence.flush(uid)
         close_open_session(uid, time.time())
         return {"ok": True}
     except HTTPException:
@@ -99,7 +165,7 @@ def user_heartbeat(username: str = Form(...)):
         uid = get_user_id(username)
         if uid is None:
             raise HTTPException(status_code=404, detail="Usuario no válido.")
-        record_usage(uid, "heartbeat", time.time())
+        presence.touch(uid, time.time())
         return {"ok": True}
     except HTTPException:
         raise
@@ -107,68 +173,133 @@ def user_heartbeat(username: str = Form(...)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ── Canal WebSocket ────────────────────────────────────────────────────────────
+# /ws?username=... : una conexión por pestaña. Mientras está abierta cuenta
+# como presencia (latido cada PRESENCE_TICK s, sin tráfico del cliente) y al
+# cerrarse la última se cierra la sesión tras LOGOUT_GRACE s sin reconectar.
+# Con watch_only=1 la conexión solo recibe eventos (la usa el servidor de
+# Streamlit para esperar un feedback o un job) y no cuenta como presencia.
+#
+# Cliente → servidor: {"type": "watch", "doc_id": N} | {"type": "watch", "job_id": "..."}
+# Servidor → cliente: {"type": "model" | "feedback" | "job", ...}; al vigilar
+# algo se envía su estado actual por si ya había terminado.
+
+_ws_tasks: set = set()      # referencias fuertes a los cierres de sesión diferidos
+
+
+async def _ws_sender(websocket: WebSocket, sub):
+    while True:
+        await websocket.send_json(await sub.queue.get())
+
+
+async def _ws_presence(uid: int):
+    while True:
+        presence.touch(uid, time.time())
+        await asyncio.sleep(events.PRESENCE_TICK)
+
+
+async def _ws_watch(sub, msg: dict):
+    if msg.get("doc_id") is not None:
+        doc_id = int(msg["doc_id"])
+        sub.docs.add(doc_id)
+        fb = model.get_feedback_status(doc_id)
+        if fb["status"] in ("done", "error"):
+            sub.push({"type": "feedback", "doc_id": doc_id, **fb})
+    elif msg.get("job_id"):
+        job = jobs.get_job(str(msg["job_id"]))
+        if job is not None and job["username"] == sub.username:
+            sub.push({
+                "type": "job", "job_id": job["job_id"], "kind": job["kind"],
+                "status": job["status"], "stage": job["stage"],
+                "queue_position": job["queue_position"], "error": job["error"],
+            })
+
+
+async def _logout_after_grace(username: str, uid: int, generation: int, closed_at: float):
+    await asyncio.sleep(events.LOGOUT_GRACE)
+    # shared.present: se pudo reconectar a otro worker
+    if shared.present(uid) or events.reconnected(username, generation):
+        return
+    await run_db(presence.flush, uid)
+    await run_db(close_open_session, uid, closed_at)
+
+
+@app.websocket("/ws")
+async def session_ws(websocket: WebSocket, username: str, watch_only: bool = False):
+    try:
+        username = sanitize_username(username)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    uid = await run_db(get_user_id, username)
+    if uid is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    sub = events.connect(username, presence=not watch_only)
+    sub.push({
+        "type":         "model",
+        "modelo_listo": model.MODEL_LOADED,
+        "progress":     model.LOAD_PROGRESS,
+        "message":      model.LOAD_MESSAGE,
+    })
+    tasks = [asyncio.create_task(_ws_sender(websocket, sub))]
+    if sub.presence:
+        shared.presence_add(uid, 1)
+        tasks.append(asyncio.create_task(_ws_presence(uid)))
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            if isinstance(msg, dict) and msg.get("type") == "watch":
+                await _ws_watch(sub, msg)
+    except (WebSocketDisconnect, ValueError, TypeError):
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+        if sub.presence:
+            shared.presence_add(uid, -1)
+        generation = events.disconnect(sub)
+        if generation is not None:
+            task = asyncio.create_task(_logout_after_grace(username, uid, generation, time.time()))
+            _ws_tasks.add(task)
+            task.add_done_callback(_ws_tasks.discard)
+
+
 # ── Procesamiento de documentos ────────────────────────────────────────────────
 
+def _reserve(work_class: str, username: str):
+    """Reserva sitio en la cola de trabajo o responde 429 con Retry-After."""
+    try:
+        return admission.reserve(work_class, username)
+    except admission.Rejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
 @app.post("/process/")
 async def process_pdf(
     file: UploadFile = File(...),
     username: str = Form(...),
 ):
     username = sanitize_username(username)
-    uid = get_user_id(username)
+    uid = await run_db(get_user_id, username)
     if uid is None:
         raise HTTPException(status_code=403, detail="Usuario no válido. Inicia sesión con una cuenta existente.")
 
-    content       = await file.read()
-    original_text = extract_text_from_pdf(content)
-
-    # Corrección y detección spaCy en paralelo (spaCy es CPU, modelo es GPU)
-    from concurrent.futures import ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        fut_correct = ex.submit(model.correct_full_text, original_text)
-        fut_errores = ex.submit(posible_tu_impersonal, original_text)
-        corrected_text = fut_correct.result()
-        errores_result = fut_errores.result()
-
-    errores_posibles = errores_result[0] if isinstance(errores_result[0], list) else []
-
-    sentences      = split_into_sentences(original_text)
-    total_frases   = len(sentences)
-    total_errores  = len(errores_posibles)
-    cambios_modelo = word_levenshtein_count(original_text, corrected_text)
-
-    # Feedback y escritura en DB en paralelo
-    from concurrent.futures import ThreadPoolExecutor as TPE
-    text_hash = hashlib.sha256((original_text or "").encode("utf-8")).hexdigest()
-    doc_id    = create_document(uid, file.filename, text_hash)
-
-    insert_metric(doc_id, "total_frases",              float(total_frases))
-    insert_metric(doc_id, "frases_con_tu_impersonal",  float(total_errores))
-    insert_metric(doc_id, "cambios_propuestos_modelo", float(cambios_modelo))
-    insert_metric(doc_id, "cambios_realizados_usuario", float(cambios_modelo))
-    record_usage(uid, "pdf_uploaded", None)
-
-    # Lanzar feedback en background — la respuesta se devuelve sin esperar
-    model.schedule_feedback(doc_id, original_text, corrected_text, n_errores=total_errores)
-
-    return {
-        "doc_id":        doc_id,
-        "original_text": original_text,
-        "corrected":     corrected_text,
-        "feedback":      "",  # generándose en background — consultar /feedback_status/{doc_id}
-        "errores_posibles": errores_posibles,
-        "mensaje_errores": (
-            "No se detectaron errores de 'tú' impersonal."
-            if not errores_posibles
-            else f"Se detectaron {len(errores_posibles)} posibles usos del 'tú' impersonal."
-        ),
-        "metricas": {
-            "total_frases":               total_frases,
-            "frases_con_tu_impersonal":   total_errores,
-            "cambios_propuestos_modelo":  cambios_modelo,
-            "cambios_realizados_usuario": cambios_modelo,
-        },
-    }
+    # El turno se espera dentro del análisis (ver pipeline.analyze_once): un
+    # PDF idéntico a uno en cola o en curso se suma a él sin ocupar slot
+    ticket = _reserve("correction", username)
+    try:
+        content       = await file.read()
+        original_text = await run_cpu(extract_text_from_pdf, content)
+    except BaseException:
+        ticket.release()
+        raise
+    return await process_document(uid, file.filename, original_text, "pdf_uploaded", admit=ticket)
 
 @app.post("/process_text/")
 async def process_text(
@@ -177,57 +308,139 @@ async def process_text(
     filename: str = Form(None),
 ):
     username = sanitize_username(username)
-    uid = get_user_id(username)
+    uid = await run_db(get_user_id, username)
     if uid is None:
         raise HTTPException(status_code=403, detail="Usuario no válido. Inicia sesión con una cuenta existente.")
 
     original_text = text or ""
 
-    # Corrección y detección spaCy en paralelo
-    from concurrent.futures import ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        fut_correct = ex.submit(model.correct_full_text, original_text)
-        fut_errores = ex.submit(posible_tu_impersonal, original_text)
-        corrected_text = fut_correct.result()
-        errores_result = fut_errores.result()
+    ticket = _reserve("correction", username)
+    return await process_document(uid, filename or "entrada_texto.txt", original_text, "text_uploaded", admit=ticket)
 
-    errores_posibles = errores_result[0] if isinstance(errores_result[0], list) else []
 
-    sentences      = split_into_sentences(original_text)
-    total_frases   = len(sentences)
-    total_errores  = len(errores_posibles)
-    cambios_modelo = word_levenshtein_count(original_text, corrected_text)
+# ── Jobs asíncronos ────────────────────────────────────────────────────────────
 
-    text_hash = hashlib.sha256((original_text or "").encode("utf-8")).hexdigest()
-    doc_id    = create_document(uid, filename or "entrada_texto.txt", text_hash)
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    username: str        = Form(...),
+    text:     str        = Form(None),
+    filename: str        = Form(None),
+    file:     UploadFile = File(None),
+):
+    """
+    Acepta un PDF o un texto y devuelve un job_id al instante.
+    El procesamiento es el mismo que /process/ y /process_text/.
+    """
+    username = sanitize_username(username)
+    uid = await run_db(get_user_id, username)
+    if uid is None:
+        raise HTTPException(status_code=403, detail="Usuario no válido. Inicia sesión con una cuenta existente.")
 
-    insert_metric(doc_id, "total_frases",              float(total_frases))
-    insert_metric(doc_id, "frases_con_tu_impersonal",  float(total_errores))
-    insert_metric(doc_id, "cambios_propuestos_modelo", float(cambios_modelo))
-    insert_metric(doc_id, "cambios_realizados_usuario", float(cambios_modelo))
-    record_usage(uid, "text_uploaded", None)
+    if file is not None:
+        content = await file.read()
+        name    = filename or file.filename
+
+        async def work(on_stage):
+            on_stage("extracting")
+            original_text = await run_cpu(extract_text_from_pdf, content)
+            return await process_document(uid, name, original_text, "pdf_uploaded", on_stage=on_stage, admit=ticket)
+
+        kind = "pdf"
+    elif text is not None:
+        original_text = text or ""
+        name          = filename or "entrada_texto.txt"
+
+        async def work(on_stage):
+            return await process_document(uid, name, original_text, "text_uploaded", on_stage=on_stage, admit=ticket)
+
+        kind = "text"
+    else:
+        raise HTTPException(status_code=400, detail="Envía un PDF (file) o un texto (text).")
+
+    ticket = _reserve("correction", username)
+    job_id = jobs.submit(work, kind=kind, username=username, ticket=ticket)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado.")
+    return job
+
+
+# ── Lotes ──────────────────────────────────────────────────────────────────────
+
+def _zip_items(content: bytes) -> list:
+    zf = zipfile.ZipFile(io.BytesIO(content))
+    names = [
+        n for n in zf.namelist()
+        if n.lower().endswith(".pdf") and not n.startswith("__MACOSX/")
+    ]
+    return [(os.path.basename(n), None, (lambda n=n: zf.read(n))) for n in names]
+
+def _text_items(texts: str) -> list:
+    data = json.loads(texts)
+    if not isinstance(data, list):
+        raise ValueError("texts debe ser un array JSON")
+    items = []
+    for i, entry in enumerate(data):
+        if isinstance(entry, str):
+            items.append((f"entrada_texto_{i + 1}.txt", entry, None))
+        elif isinstance(entry, dict) and isinstance(entry.get("text"), str):
+            items.append((entry.get("filename") or f"entrada_texto_{i + 1}.txt", entry["text"], None))
+        else:
+            raise ValueError(f"elemento {i} no válido: usa un texto o {{\"text\", \"filename\"}}")
+    return items
+
+@app.post("/batch")
+async def submit_batch(
+    username: str        = Form(...),
+    texts:    str        = Form(None),
+    file:     UploadFile = File(None),
+):
+    """
+    Procesa un ZIP de PDFs o un array JSON de textos en nombre de un usuario.
+    Cada resultado se devuelve como una línea NDJSON en cuanto termina.
+    """
+    username = sanitize_username(username)
+    uid = await run_db(get_user_id, username)
+    if uid is None:
+        raise HTTPException(status_code=403, detail="Usuario no válido. Inicia sesión con una cuenta existente.")
+
+    try:
+        if file is not None:
+            items = await run_cpu(_zip_items, await file.read())
+        elif texts is not None:
+            items = _text_items(texts)
+        else:
+            raise HTTPException(status_code=400, detail="Envía un ZIP de PDFs (file) o un array JSON de textos (texts).")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Lanzar feedback en background — la respuesta se devuelve sin esperar
-    model.schedule_feedback(doc_id, original_text, corrected_text, n_errores=total_errores)
+    if not items:
+        raise HTTPException(status_code=400, detail="El lote no contiene documentos.")
+    if len(items) > BATCH_MAX_DOCS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_DOCS} documentos por lote.")
 
-    return {
-        "doc_id":        doc_id,
-        "original_text": original_text,
-        "corrected":     corrected_text,
-        "feedback":      "",  # generándose en background — consultar /feedback_status/{doc_id}
-        "errores_posibles": errores_posibles,
-        "mensaje_errores": (
-            "No se detectaron errores de 'tú' impersonal."
-            if not errores_posibles
-            else f"Se detectaron {len(errores_posibles)} posibles usos del 'tú' impersonal."
-        ),
-        "metricas": {
-            "total_frases":               total_frases,
-            "frases_con_tu_impersonal":   total_errores,
-            "cambios_propuestos_modelo":  cambios_modelo,
-            "cambios_realizados_usuario": cambios_modelo,
-        },
-    }
+    ticket = _reserve("batch", username)
+
+    async def ndjson():
+        async with ticket:
+            async for line in process_batch(uid, items):
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    async def release():
+        # Por si el cliente corta antes de empezar a leer el stream
+        ticket.release()
+
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(release),
+    )
 
 
 # ── Métricas de documentos ─────────────────────────────────────────────────────
@@ -248,9 +461,13 @@ def add_document_metric(
 def update_user_changes(
     doc_id:  int,
     changes: int = Form(...),
+    text:    str = Form(None),
 ):
+    """`text` (opcional) es la versión final del usuario; se guarda para poder reabrirla."""
     try:
         insert_metric(doc_id, "cambios_realizados_usuario", float(changes))
+        if text is not None:
+            set_final_text(doc_id, text)
         return {"ok": True, "document_id": doc_id, "metric_name": "cambios_realizados_usuario", "metric_value": float(changes)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -258,21 +475,91 @@ def update_user_changes(
 
 # ── Overview y actividad ───────────────────────────────────────────────────────
 
+def _revalidated(endpoint: str, uid: int | None, params: tuple, if_none_match: str | None, compute):
+    """
+    Respuesta con ETag: 304 si el cliente ya tiene la versión actual de los
+    datos del usuario, o el JSON (cacheado mientras no cambie).
+    """
+    if uid is None:
+        raise HTTPException(status_code=404, detail="Usuario no válido.")
+    etag, body = respcache.lookup(endpoint, uid, params, if_none_match, compute)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def _lookup_user(username: str) -> int | None:
+    """user_id del nombre recibido en la ruta; 400 si el nombre no es válido."""
+    try:
+        return get_user_id(sanitize_username(username))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/users/{username}/overview")
-def user_overview(username: str):
-    return get_user_overview(username)
+def user_overview(username: str, if_none_match: str = Header(None)):
+    uid = _lookup_user(username)
+    return _revalidated("overview", uid, (), if_none_match, lambda: get_user_overview(uid))
 
 @app.get("/users/{username}/documents")
-def user_documents(username: str):
-    return {"documents": get_user_documents(username)}
+def user_documents(username: str, if_none_match: str = Header(None)):
+    uid = _lookup_user(username)
+    return _revalidated(
+        "documents", uid, (), if_none_match,
+        lambda: {"documents": get_user_documents(uid)},
+    )
 
 @app.get("/documents/{doc_id}/metrics")
 def document_metrics(doc_id: int):
     return {"doc_id": doc_id, "metrics": get_document_metrics(doc_id)}
 
+@app.get("/documents/{doc_id}/texts")
+def document_texts(doc_id: int):
+    """Original, salida del modelo y versión final guardados, sin volver a pasar por el modelo."""
+    texts = get_document_texts(doc_id)
+    if texts is None:
+        raise HTTPException(status_code=404, detail="Documento no encontrado.")
+    return texts
+
+@app.get("/documents/{doc_id}/metrics/history")
+def document_metric_history(doc_id: int, name: str = None):
+    return {"doc_id": doc_id, "history": get_document_metric_history(doc_id, name)}
+
 @app.get("/users/{username}/weekly_activity")
-def user_weekly_activity(username: str):
-    return {"username": username, "activity": get_user_weekly_activity(username)}
+def user_weekly_activity(username: str, if_none_match: str = Header(None)):
+    uid = _lookup_user(username)
+    return _revalidated(
+        "weekly_activity", uid, (username,), if_none_match,
+        lambda: {"username": username, "activity": get_user_weekly_activity(uid)},
+    )
+
+@app.get("/users/{username}/activity")
+def user_activity(
+    username: str, start: str = None, end: str = None, bucket: str = "day",
+    if_none_match: str = Header(None),
+):
+    """
+    Actividad de un rango arbitrario (start/end en YYYY-MM-DD, inclusivos)
+    agrupada por bucket = day | week | month.
+    """
+    try:
+        uid = get_user_id(sanitize_username(username))
+        return _revalidated(
+            "activity", uid, (username, start, end, bucket), if_none_match,
+            lambda: {"username": username, **get_user_activity(uid, start, end, bucket)},
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/users/{username}/trend")
+def user_trend(username: str, if_none_match: str = Header(None)):
+    """Tasa móvil de documentos con 'tú' impersonal, pendiente, semanas y evolución."""
+    uid = _lookup_user(username)
+    if uid is None:
+        raise HTTPException(status_code=404, detail="Usuario no válido.")
+    return _revalidated(
+        "trend", uid, (username,), if_none_match,
+        lambda: {"username": username, **trends.get_trend(uid)},
+    )
 
 @app.delete("/documents/{doc_id}")
 def delete_doc(doc_id: int):
@@ -291,73 +578,196 @@ def feedback_status(doc_id: int):
     return model.get_feedback_status(doc_id)
 
 
+# ── Cohortes ───────────────────────────────────────────────────────────────────
+
+def _usernames(text: str) -> list:
+    return [u.strip() for u in (text or "").replace(",", "\n").splitlines() if u.strip()]
+
+@app.get("/cohorts")
+def cohorts_list():
+    return {"cohorts": list_cohorts()}
+
+@app.post("/cohorts/{name}/members")
+def cohort_add_members(
+    name:      str,
+    usernames: str  = Form(...),
+    replace:   bool = Form(False),
+    x_admin_token: str = Header(None),
+):
+    """`usernames` separados por comas o saltos de línea. Crea el cohorte si no existe."""
+    _check_admin(x_admin_token)
+    try:
+        return cohorts.set_members(name, _usernames(usernames), replace=replace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/cohorts/{name}/members/{username}")
+def cohort_remove_member(name: str, username: str, x_admin_token: str = Header(None)):
+    _check_admin(x_admin_token)
+    if not cohorts.remove_member(name, username):
+        raise HTTPException(status_code=404, detail="El usuario no pertenece al cohorte.")
+    return {"ok": True}
+
+@app.get("/cohorts/{name}/dashboard")
+def cohort_dashboard(name: str, x_admin_token: str = Header(None)):
+    """Distribuciones de la clase: documentos, % con 'tú', cambios y actividad (percentiles)."""
+    _check_admin(x_admin_token)
+    dash = cohorts.get_dashboard(name)
+    if dash is None:
+        raise HTTPException(status_code=404, detail="Cohorte no encontrado.")
+    return dash
+
+
 # ── Valoración global ──────────────────────────────────────────────────────────
 
+# La valoración se cachea en la DB por la tupla exacta que recibe el modelo
+# (la media de sesión se redondea a GLOBAL_FEEDBACK_SESSION_BUCKET segundos
+# para que la clave no cambie con cada latido). Si no está, se genera como
+# job de baja prioridad (clase "feedback" de admission, espera a que no haya
+# correcciones pendientes) y el cliente consulta /jobs/{job_id}.
+# Peticiones con la misma clave mientras se genera reciben el mismo job.
+
+GLOBAL_FEEDBACK_SESSION_BUCKET = float(os.getenv("PALABRIA_GLOBAL_FEEDBACK_SESSION_BUCKET", "60"))
+
+_global_feedback_jobs: dict = {}    # clave → job_id en curso
+
+
+def _global_feedback_key(ov: dict) -> dict:
+    bucket = GLOBAL_FEEDBACK_SESSION_BUCKET
+    avg_session = float(ov.get("avg_session_seconds", 0.0))
+    return {
+        "total_docs":          int(ov.get("docs", 0)),
+        "login_days":          int(ov.get("login_days", 0)),
+        "pct_tu":              round(float(ov.get("docs_with_tu_percent", 0.0)), 1),
+        "pct_sin_cambios":     round(float(ov.get("docs_no_changes_percent", 0.0)), 1),
+        "avg_session_seconds": round(avg_session / bucket) * bucket if bucket > 0 else avg_session,
+    }
+
+
 @app.get("/users/{username}/global_feedback")
-def global_feedback(username: str):
+async def global_feedback(username: str):
     """
-    Genera una valoración global del progreso del estudiante bajo demanda.
-    Solo se llama cuando el usuario pulsa el botón en el frontend.
-    Usa las métricas ya calculadas (sin procesar documentos nuevos).
+    Valoración global del progreso del estudiante, bajo demanda (botón del
+    frontend). Con la valoración ya en caché responde al momento con
+    status "done"; si no, devuelve status "queued" y un job_id para consultar
+    en /jobs/{job_id} (el resultado del job tiene la misma forma).
     """
     try:
         username = sanitize_username(username)
-        uid = get_user_id(username)
-        if uid is None:
-            raise HTTPException(status_code=404, detail="Usuario no válido.")
-
-        if not model.MODEL_LOADED:
-            raise HTTPException(status_code=503, detail="El modelo aún no está cargado.")
-
-        ov = get_user_overview(username)
-
-        total_docs          = int(ov.get("docs", 0))
-        login_days          = int(ov.get("login_days", 0))
-        pct_tu              = float(ov.get("docs_with_tu_percent", 0.0))
-        pct_sin_cambios     = float(ov.get("docs_no_changes_percent", 0.0))
-        avg_session_seconds = float(ov.get("avg_session_seconds", 0.0))
-
-        if total_docs == 0:
-            return {
-                "feedback": "Aún no has procesado ningún documento. ¡Sube tu primer texto para recibir una valoración!",
-                "stats": {
-                    "total_docs": 0,
-                    "login_days": login_days,
-                    "pct_con_error": 0.0,
-                    "evolucion": "insuficiente",
-                },
-            }
-
-        feedback_text = model.generate_global_feedback(
-            total_docs=total_docs,
-            login_days=login_days,
-            pct_tu=pct_tu,
-            pct_sin_cambios=pct_sin_cambios,
-            avg_session_seconds=avg_session_seconds,
-        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    uid = await run_db(get_user_id, username)
+    if uid is None:
+        raise HTTPException(status_code=404, detail="Usuario no válido.")
 
-        # Tendencia simple: si % documentos con 'tú' > 50% → empeora/estable,
-        # si < 30% → mejora, si hay pocos datos → insuficiente
-        if total_docs < 3:
-            evolucion = "insuficiente"
-        elif pct_tu < 30.0:
-            evolucion = "mejora"
-        elif pct_tu > 60.0:
-            evolucion = "empeora"
-        else:
-            evolucion = "estable"
+    ov = await run_db(get_user_overview, uid)
+    key = _global_feedback_key(ov)
 
+    if key["total_docs"] == 0:
         return {
-            "feedback": feedback_text,
+            "status": "done",
+            "feedback": "Aún no has procesado ningún documento. ¡Sube tu primer texto para recibir una valoración!",
             "stats": {
-                "total_docs":   total_docs,
-                "login_days":   login_days,
-                "pct_con_error": pct_tu,
-                "evolucion":    evolucion,
+                "total_docs": 0,
+                "login_days": key["login_days"],
+                "pct_con_error": 0.0,
+                "evolucion": "insuficiente",
             },
         }
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    # Tendencia sobre la secuencia de documentos: tasa móvil y pendiente
+    trend = await run_db(trends.get_trend, uid)
+    stats = {
+        "total_docs":    key["total_docs"],
+        "login_days":    key["login_days"],
+        "pct_con_error": key["pct_tu"],
+        "evolucion":     trend["evolucion"],
+        "pct_reciente":  trend["recent_rate"],
+        "cambio_pp":     trend["change_pp"],
+    }
+
+    cached = await run_db(get_cached_global_feedback, model.MODEL_ID, key)
+    if cached is not None:
+        return {"status": "done", "feedback": cached, "stats": stats}
+
+    if not model.MODEL_LOADED:
+        raise HTTPException(status_code=503, detail="El modelo aún no está cargado.")
+
+    job_key = tuple(key.values())
+    job_id = _global_feedback_jobs.get(job_key)
+    job = jobs.get_job(job_id) if job_id else None
+    if job is not None and job["status"] in ("queued", "running"):
+        return {"status": job["status"], "job_id": job_id, "stats": stats}
+
+    ticket = _reserve("feedback", username)
+
+    async def work(on_stage):
+        try:
+            async with ticket:
+                on_stage("waiting_gpu")
+                await admission.wait_idle("correction")
+                on_stage("generating")
+                text = await run_gpu(model.generate_global_feedback, **key)
+            if text:
+                await run_db(put_cached_global_feedback, model.MODEL_ID, key, text)
+            return {"status": "done", "feedback": text, "stats": stats}
+        finally:
+            _global_feedback_jobs.pop(job_key, None)
+
+    job_id = jobs.submit(work, kind="global_feedback", username=username, ticket=ticket)
+    _global_feedback_jobs[job_key] = job_id
+    return {"status": "queued", "job_id": job_id, "stats": stats}
+
+
+# ── Administración ─────────────────────────────────────────────────────────────
+# Con PALABRIA_ADMIN_TOKEN definido, las rutas /admin/* exigen la cabecera
+# X-Admin-Token con ese valor; sin él quedan abiertas como el resto de la API.
+
+ADMIN_TOKEN = os.getenv("PALABRIA_ADMIN_TOKEN", "")
+
+
+def _check_admin(token: str | None):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de administración no válido.")
+
+
+@app.post("/admin/export", status_code=202)
+async def admin_export(
+    format:    str = Form("parquet"),
+    partition: str = Form("none"),
+    tables:    str = Form(None),
+    x_admin_token: str = Header(None),
+):
+    """
+    Lanza la exportación columnar (Parquet o Arrow IPC) como job en background.
+    El resultado (carpeta, filas y ficheros por tabla) se consulta en /jobs/{id}.
+    """
+    _check_admin(x_admin_token)
+    if export.pa is None:
+        raise HTTPException(status_code=501, detail="La exportación necesita pyarrow en el servidor.")
+    if format not in export.FORMATS or partition not in export.PARTITIONS:
+        raise HTTPException(status_code=400, detail="format = parquet | arrow, partition = none | month.")
+    names = [t.strip() for t in tables.split(",") if t.strip()] if tables else None
+
+    async def work(on_stage):
+        on_stage("exporting")
+        return await run_cpu(export.export, None, format, partition, names)
+
+    job_id = jobs.submit(work, kind="export", username="admin")
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.delete("/admin/users/{username}")
+def admin_delete_user(username: str, x_admin_token: str = Header(None)):
+    """Borra la cuenta con todos sus documentos, métricas y actividad."""
+    _check_admin(x_admin_token)
+    try:
+        username = sanitize_username(username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    uid = get_user_id(username)
+    if uid is None:
+        raise HTTPException(status_code=404, detail="Usuario no válido.")
+    presence.flush(uid)
+    delete_user(username)
+    return {"ok": True, "deleted_user": username}
\ No newline at end of file
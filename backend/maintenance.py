@@ -0,0 +1,79 @@
+# backend/maintenance.py
+import os
+import threading
+import time
+
+import backend.db as db
+import backend.shared as shared
+
+
+# ── Mantenimiento periódico de la base de datos ────────────────────────────────
+# Cada INTERVAL segundos: compacta usage_stats (eventos más viejos que
+# db.RETENTION_DAYS → usage_daily), libera páginas con incremental_vacuum y
+# hace un checkpoint TRUNCATE del WAL. Así el fichero y las consultas del
+# overview se mantienen acotados aunque el servidor corra todo un semestre.
+# Con varios workers prefork solo lo ejecuta el worker 0.
+
+INTERVAL     = float(os.getenv("PALABRIA_MAINTENANCE_SECS", "3600"))
+FIRST_DELAY  = float(os.getenv("PALABRIA_MAINTENANCE_DELAY", "60"))
+
+_lock   = threading.Lock()
+_thread = None
+_stop   = threading.Event()
+_stats  = {
+    "runs":          0,
+    "rows_compacted": 0,
+    "pages_freed":   0,
+    "last_run":      None,
+    "last_secs":     None,
+    "last_error":    None,
+    "storage":       None,
+}
+
+
+def run_once() -> dict:
+    """Una pasada completa. Devuelve lo que hizo."""
+    t0 = time.monotonic()
+    compacted = db.compact_usage()
+    freed     = db.incremental_vacuum()
+    ckpt      = db.wal_checkpoint()
+    storage   = db.get_storage_stats()
+    secs = time.monotonic() - t0
+    with _lock:
+        _stats["runs"]           += 1
+        _stats["rows_compacted"] += compacted
+        _stats["pages_freed"]    += freed
+        _stats["last_run"]        = time.time()
+        _stats["last_secs"]       = round(secs, 3)
+        _stats["last_error"]      = None
+        _stats["storage"]         = storage
+    return {"rows_compacted": compacted, "pages_freed": freed, "checkpoint": ckpt, "storage": storage}
+
+
+def _loop():
+    delay = FIRST_DELAY
+    while not _stop.wait(delay):
+        delay = INTERVAL
+        try:
+            run_once()
+        except Exception as e:
+            with _lock:
+                _stats["last_error"] = f"{type(e).__name__}: {e}"
+
+
+def start():
+    global _thread
+    if INTERVAL <= 0 or shared.WORKER_INDEX > 0 or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="palabria-maintenance", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {**_stats, "interval": INTERVAL, "retention_days": db.RETENTION_DAYS}
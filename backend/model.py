@@ -1,5 +1,6 @@
 # backend/model.py
 import gc
+import os
 import re
 import time
 import threading
@@ -8,6 +9,8 @@ from typing import List, Optional
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 
+import backend.events as events
+
 
 # ── Estado global ──────────────────────────────────────────────────────────────
 MODEL_LOADED: bool = False
@@ -24,10 +27,18 @@ _model:     Optional[AutoModelForCausalLM]  = None
 # doc_id → {"status": "pending"|"done"|"error", "result": str}
 _feedback_jobs: dict = {}
 _feedback_lock  = threading.Lock()
+# (original, corregido) en curso → doc_ids que esperan ese mismo feedback
+_feedback_inflight: dict = {}
 
 # ── Modelo ─────────────────────────────────────────────────────────────────────
 MODEL_ID = "meta-llama/Llama-3.2-3B-Instruct"
 
+# "auto": se reparte en la(s) GPU(s) disponibles. "cpu": los pesos se leen de
+# los safetensors mapeados en memoria, sin copia intermedia en float32
+# (low_cpu_mem_usage); es lo que usa backend/prefork.py para cargarlos una vez
+# en el padre y compartirlos copy-on-write entre los workers.
+MODEL_DEVICE = os.getenv("PALABRIA_MODEL_DEVICE", "auto").strip().lower()
+
 # ── Parámetros de generación ───────────────────────────────────────────────────
 MAX_NEW_TOKENS_CORRECTION = 1024  # texto completo — escala dinámicamente
 MAX_NEW_TOKENS_FEEDBACK   = 300   # feedback por documento
@@ -114,6 +125,12 @@ def _set(progress: int, message: str):
     with _lock:
         LOAD_PROGRESS = max(0, min(100, int(progress)))
         LOAD_MESSAGE  = message
+    events.broadcast({
+        "type":         "model",
+        "modelo_listo": MODEL_LOADED,
+        "progress":     LOAD_PROGRESS,
+        "message":      message,
+    })
 
 
 def _clear_cache():
@@ -165,10 +182,14 @@ def _load_impl():
             _tokenizer.pad_token = _tokenizer.eos_token
 
         _set(75, "Cargando modelo (esto puede tardar)…")
+        if MODEL_DEVICE == "cpu":
+            placement = {"device_map": "cpu", "use_safetensors": True, "low_cpu_mem_usage": True}
+        else:
+            placement = {"device_map": "auto"}
         _model = AutoModelForCausalLM.from_pretrained(
             MODEL_ID,
-            device_map="auto",
             torch_dtype=torch.bfloat16,   # bfloat16 completo — más rápido que NF4 en A100
+            **placement,
         )
         _model.eval()
 
@@ -239,6 +260,60 @@ def _chat_generate(messages: list, max_new_tokens: int) -> str:
     ).strip()
 
 
+@torch.inference_mode()
+def _chat_generate_batch(messages_list: list, max_new_tokens: int) -> list:
+    """
+    Como _chat_generate pero para varias conversaciones en una sola llamada a
+    generate: prompts con padding a la izquierda para que todas las
+    secuencias terminen alineadas y la generación continúe desde ahí.
+    """
+    global _tokenizer, _model
+    if not MODEL_LOADED or _tokenizer is None or _model is None:
+        return [""] * len(messages_list)
+    if len(messages_list) == 1:
+        return [_chat_generate(messages_list[0], max_new_tokens)]
+
+    prompts = [
+        _tokenizer.apply_chat_template(m, add_generation_prompt=True, tokenize=False)
+        for m in messages_list
+    ]
+    side = _tokenizer.padding_side
+    _tokenizer.padding_side = "left"
+    try:
+        enc = _tokenizer(
+            prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=2048,
+            add_special_tokens=False,   # la plantilla ya pone <|begin_of_text|>
+        )
+    finally:
+        _tokenizer.padding_side = side
+    input_ids      = enc["input_ids"].to(_model.device)
+    attention_mask = enc["attention_mask"].to(_model.device)
+    input_length   = input_ids.shape[1]
+
+    output_ids = _model.generate(
+        input_ids,
+        attention_mask=attention_mask,
+        max_new_tokens=max_new_tokens,
+        do_sample=DO_SAMPLE,
+        num_beams=NUM_BEAMS,
+        pad_token_id=_tokenizer.eos_token_id,
+        eos_token_id=_tokenizer.eos_token_id,
+        use_cache=True,
+    )
+    return [
+        _tokenizer.decode(
+            out[input_length:],
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=True,
+        ).strip()
+        for out in output_ids
+    ]
+
+
 # ── Corrección — texto completo en una sola llamada ───────────────────────────
 
 def correct_full_text(text: str) -> str:
@@ -252,16 +327,44 @@ def correct_full_text(text: str) -> str:
     if not MODEL_LOADED:
         raise RuntimeError("El modelo aún no está cargado.")
 
-    messages = [
+    raw = _chat_generate(_correction_messages(text), max_new_tokens=_correction_max_tokens(text))
+    return clean_pred(raw) if raw else text
+
+
+def _correction_messages(text: str) -> list:
+    return [
         {"role": "system", "content": SYSTEM_PROMPT_CORRECTION},
         {"role": "user",   "content": USER_PROMPT_CORRECTION.format(text=text.strip())},
     ]
+
+
+def _correction_max_tokens(text: str) -> int:
     # max_new_tokens proporcional al texto: ~1.2 tokens por palabra estimado
     n_words = len(text.split())
-    max_tok = min(max(n_words * 2, 256), 1024)
+    return min(max(n_words * 2, 256), 1024)
 
-    raw = _chat_generate(messages, max_new_tokens=max_tok)
-    return clean_pred(raw) if raw else text
+
+def correct_full_texts(texts: List[str]) -> List[str]:
+    """
+    Corrige varios textos en un único generate (lo usa el servidor de
+    inferencia para agrupar peticiones). Equivale a correct_full_text por
+    texto, pero no es idéntico bit a bit: el padding y la precisión del
+    batch pueden cambiar algún token, y el límite de tokens es el del texto
+    más largo.
+    """
+    if not MODEL_LOADED:
+        raise RuntimeError("El modelo aún no está cargado.")
+    out = [""] * len(texts)
+    todo = [i for i, t in enumerate(texts) if t and t.strip()]
+    if not todo:
+        return out
+    raws = _chat_generate_batch(
+        [_correction_messages(texts[i]) for i in todo],
+        max_new_tokens=max(_correction_max_tokens(texts[i]) for i in todo),
+    )
+    for i, raw in zip(todo, raws):
+        out[i] = clean_pred(raw) if raw else texts[i]
+    return out
 
 
 # Alias para compatibilidad con main.py existente
@@ -312,27 +415,46 @@ def schedule_feedback(doc_id: int, original: str, corrected: str, n_errores: int
     Lanza la generación de feedback en un hilo background.
     La corrección ya se devolvió al usuario; este hilo genera el feedback
     sin bloquear la respuesta HTTP.
-    El resultado queda en _feedback_jobs[doc_id] para consultarlo por polling.
+    El resultado queda en _feedback_jobs[doc_id] para consultarlo por polling
+    y se empuja por WebSocket a quien vigile ese doc_id.
+    Si ya se está generando el feedback de ese mismo par original/corregido,
+    el doc_id se suma a ese job en lugar de lanzar otra generación.
     """
+    key = (original, corrected)
+    events.publish_state("feedback", doc_id, {"status": "pending", "result": ""})
     with _feedback_lock:
         _feedback_jobs[doc_id] = {"status": "pending", "result": ""}
+        waiting = _feedback_inflight.get(key)
+        if waiting is not None:
+            waiting.append(doc_id)
+            return
+        _feedback_inflight[key] = [doc_id]
+
+    def _finish(status: str, result: str):
+        with _feedback_lock:
+            done = _feedback_inflight.pop(key, [doc_id])
+            for d in done:
+                _feedback_jobs[d] = {"status": status, "result": result}
+        for d in done:
+            events.publish_state("feedback", d, {"status": status, "result": result})
+            events.publish_doc(d, {"type": "feedback", "doc_id": d, "status": status, "result": result})
 
     def _run():
         try:
-            result = generate_feedback(original, corrected, n_errores)
-            with _feedback_lock:
-                _feedback_jobs[doc_id] = {"status": "done", "result": result}
+            _finish("done", generate_feedback(original, corrected, n_errores))
         except Exception as e:
-            with _feedback_lock:
-                _feedback_jobs[doc_id] = {"status": "error", "result": str(e)}
+            _finish("error", str(e))
 
     threading.Thread(target=_run, daemon=True).start()
 
 
 def get_feedback_status(doc_id: int) -> dict:
-    """Devuelve el estado del job de feedback para un doc_id."""
+    """Devuelve el estado del job de feedback para un doc_id (de este worker o de otro)."""
     with _feedback_lock:
-        return dict(_feedback_jobs.get(doc_id, {"status": "not_found", "result": ""}))
+        fb = _feedback_jobs.get(doc_id)
+        if fb is not None:
+            return dict(fb)
+    return events.remote_state("feedback", doc_id) or {"status": "not_found", "result": ""}
 
 
 # ── Valoración global ──────────────────────────────────────────────────────────
@@ -0,0 +1,258 @@
+# backend/pipeline.py
+import asyncio
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.inference as inference
+from backend.metrics import word_levenshtein_count
+from backend.utils import extract_text_from_pdf, split_into_sentences, posible_tu_impersonal
+from backend.db import create_document
+
+# backend.model en este proceso, o el cliente del servidor de inferencia
+model = inference.get_model()
+
+
+# ── Executors ──────────────────────────────────────────────────────────────────
+# Todo el trabajo síncrono del pipeline sale del event loop:
+# - GPU: un único hilo → las generaciones del modelo no compiten entre sí.
+# - CPU: pdfplumber, spaCy y Levenshtein.
+# - DB:  lecturas/escrituras SQLite.
+# Así /status/ y /users/heartbeat siguen respondiendo durante una corrección.
+# Con servidor de inferencia el orden lo decide él: aquí varios hilos solo
+# esperan respuestas, y así le llegan peticiones que puede agrupar en lotes.
+
+GPU_WORKERS = int(os.getenv("PALABRIA_GPU_WORKERS", "4" if inference.INFERENCE_ADDRESS else "1"))
+CPU_WORKERS = int(os.getenv("PALABRIA_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+DB_WORKERS  = int(os.getenv("PALABRIA_DB_WORKERS", "2"))
+
+_gpu_pool = ThreadPoolExecutor(max_workers=GPU_WORKERS, thread_name_prefix="palabria-gpu")
+_cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="palabria-cpu")
+_db_pool  = ThreadPoolExecutor(max_workers=DB_WORKERS,  thread_name_prefix="palabria-db")
+
+
+async def run_gpu(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_gpu_pool, functools.partial(fn, *args, **kwargs))
+
+async def run_cpu(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, fn, *args)
+
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_db_pool, fn, *args)
+
+
+# ── Etapas ─────────────────────────────────────────────────────────────────────
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def _detect(text: str):
+    """Detección spaCy: frases con posible 'tú' impersonal y total de frases."""
+    errores_result = posible_tu_impersonal(text)
+    errores_posibles = errores_result[0] if isinstance(errores_result[0], list) else []
+    total_frases = len(split_into_sentences(text))
+    return errores_posibles, total_frases
+
+
+def _persist(uid: int, filename: str, digest: str, metricas: dict, event: str, texts: dict) -> int:
+    """Documento, textos, métricas y evento de uso en una sola tarea del escritor de la DB."""
+    return create_document(uid, filename, digest, metrics=metricas, event=event, texts=texts)
+
+
+def _stage(on_stage, name: str):
+    if on_stage is not None:
+        on_stage(name)
+
+
+def _analysis(corrected_text: str, errores_posibles: list, total_frases: int, cambios_modelo: int) -> dict:
+    return {
+        "corrected":        corrected_text,
+        "errores_posibles": errores_posibles,
+        "metricas": {
+            "total_frases":               total_frases,
+            "frases_con_tu_impersonal":   len(errores_posibles),
+            "cambios_propuestos_modelo":  cambios_modelo,
+            "cambios_realizados_usuario": cambios_modelo,
+        },
+    }
+
+
+async def analyze_text(original_text: str, on_stage=None) -> dict:
+    """
+    Corrección (GPU) y detección spaCy (CPU) en paralelo, después métricas.
+    No toca la base de datos.
+    """
+    _stage(on_stage, "detecting")
+    fut_errores = asyncio.ensure_future(run_cpu(_detect, original_text))
+    fut_correct = asyncio.ensure_future(run_gpu(model.correct_full_text, original_text))
+
+    try:
+        errores_posibles, total_frases = await fut_errores
+        _stage(on_stage, "correcting")
+        corrected_text = await fut_correct
+    except BaseException:
+        fut_correct.cancel()
+        raise
+
+    _stage(on_stage, "metrics")
+    cambios_modelo = await run_cpu(word_levenshtein_count, original_text, corrected_text)
+    return _analysis(corrected_text, errores_posibles, total_frases, cambios_modelo)
+
+
+# ── Single-flight ──────────────────────────────────────────────────────────────
+# text_hash → Future del análisis en curso. Peticiones idénticas concurrentes
+# (reruns de Streamlit, doble clic en "Analizar texto") esperan el mismo
+# análisis en vez de lanzar otra generación; cada una guarda su propio doc_id.
+# El turno de admisión (`admit`, un admission.Ticket) se espera DENTRO del
+# análisis: la entrada de _inflight existe desde que la primera petición
+# entra en la cola, y una idéntica que llega mientras tanto se suma y
+# libera su ticket sin ocupar slot.
+
+_inflight: dict = {}
+_stats = {"analyses": 0, "coalesced": 0}
+
+
+async def _admitted(admit, original_text: str, on_stage=None) -> dict:
+    if admit is None:
+        return await analyze_text(original_text, on_stage=on_stage)
+    async with admit:
+        return await analyze_text(original_text, on_stage=on_stage)
+
+
+async def analyze_once(digest: str, original_text: str, on_stage=None, admit=None) -> dict:
+    fut = _inflight.get(digest)
+    if fut is not None:
+        if admit is not None:
+            admit.release()
+        _stats["coalesced"] += 1
+        _stage(on_stage, "correcting")
+        return await asyncio.shield(fut)
+
+    _stats["analyses"] += 1
+    fut = asyncio.ensure_future(_admitted(admit, original_text, on_stage=on_stage))
+    _inflight[digest] = fut
+    fut.add_done_callback(lambda _f: _inflight.pop(digest, None))
+    return await asyncio.shield(fut)
+
+
+def get_stats() -> dict:
+    return {**_stats, "inflight": len(_inflight)}
+
+
+async def _finish_document(uid: int, filename: str, original_text: str, analysis: dict, event: str) -> dict:
+    """Persiste el documento analizado, lanza el feedback y arma la respuesta."""
+    metricas = analysis["metricas"]
+    errores_posibles = analysis["errores_posibles"]
+
+    texts = {"original": original_text, "corrected": analysis["corrected"]}
+    doc_id = await run_db(_persist, uid, filename, text_hash(original_text), metricas, event, texts)
+
+    # Lanzar feedback en background — la respuesta se devuelve sin esperar
+    model.schedule_feedback(
+        doc_id, original_text, analysis["corrected"],
+        n_errores=metricas["frases_con_tu_impersonal"],
+    )
+
+    return {
+        "doc_id":        doc_id,
+        "original_text": original_text,
+        "corrected":     analysis["corrected"],
+        "feedback":      "",  # generándose en background — consultar /feedback_status/{doc_id}
+        "errores_posibles": errores_posibles,
+        "mensaje_errores": (
+            "No se detectaron errores de 'tú' impersonal."
+            if not errores_posibles
+            else f"Se detectaron {len(errores_posibles)} posibles usos del 'tú' impersonal."
+        ),
+        "metricas": dict(metricas),
+    }
+
+
+async def process_document(uid: int, filename: str, original_text: str, event: str, on_stage=None, admit=None) -> dict:
+    """
+    Pipeline completo de un documento ya extraído: análisis, persistencia
+    y lanzamiento del feedback en background. Devuelve la respuesta de /process/.
+    `admit` pasa a ser de analyze_once, que lo espera o lo libera.
+    """
+    analysis = await analyze_once(text_hash(original_text), original_text, on_stage=on_stage, admit=admit)
+    return await _finish_document(uid, filename, original_text, analysis, event)
+
+
+# ── Lotes ──────────────────────────────────────────────────────────────────────
+# Tres etapas unidas por colas acotadas:
+#   preparar (CPU: pdfplumber + spaCy) → corregir (GPU) → cerrar (Levenshtein + DB)
+# Mientras la GPU corrige el documento i, la CPU ya extrae y analiza el i+1.
+
+BATCH_MAX_DOCS    = int(os.getenv("PALABRIA_BATCH_MAX_DOCS", "200"))
+BATCH_QUEUE_DEPTH = int(os.getenv("PALABRIA_BATCH_QUEUE_DEPTH", "2"))
+
+_DONE = object()
+
+
+def _error_line(index: int, filename: str, err: Exception) -> dict:
+    detail = getattr(err, "detail", None) or str(err)
+    return {"index": index, "filename": filename, "ok": False, "error": str(detail)}
+
+
+async def process_batch(uid: int, items: list):
+    """
+    Procesa una lista de documentos de un mismo usuario y va devolviendo
+    cada resultado en cuanto termina (generador asíncrono, orden de llegada).
+
+    items: lista de (filename, text, read_pdf). Si `read_pdf` no es None se
+    llama en el executor CPU para obtener los bytes del PDF; si no, se usa `text`.
+    """
+    to_gpu    = asyncio.Queue(maxsize=BATCH_QUEUE_DEPTH)
+    to_finish = asyncio.Queue(maxsize=BATCH_QUEUE_DEPTH)
+    out       = asyncio.Queue()
+
+    async def prepare():
+        for i, (filename, text, read_pdf) in enumerate(items):
+            try:
+                if read_pdf is not None:
+                    content = await run_cpu(read_pdf)
+                    text  = await run_cpu(extract_text_from_pdf, content)
+                    event = "pdf_uploaded"
+                else:
+                    text  = text or ""
+                    event = "text_uploaded"
+                errores_posibles, total_frases = await run_cpu(_detect, text)
+            except Exception as e:
+                await out.put(_error_line(i, filename, e))
+                continue
+            await to_gpu.put((i, filename, text, event, errores_posibles, total_frases))
+        await to_gpu.put(_DONE)
+
+    async def correct():
+        while (item := await to_gpu.get()) is not _DONE:
+            i, filename, text = item[:3]
+            try:
+                corrected_text = await run_gpu(model.correct_full_text, text)
+            except Exception as e:
+                await out.put(_error_line(i, filename, e))
+                continue
+            await to_finish.put(item + (corrected_text,))
+        await to_finish.put(_DONE)
+
+    async def finish():
+        while (item := await to_finish.get()) is not _DONE:
+            i, filename, text, event, errores_posibles, total_frases, corrected_text = item
+            try:
+                cambios_modelo = await run_cpu(word_levenshtein_count, text, corrected_text)
+                analysis = _analysis(corrected_text, errores_posibles, total_frases, cambios_modelo)
+                result = await _finish_document(uid, filename, text, analysis, event)
+            except Exception as e:
+                await out.put(_error_line(i, filename, e))
+                continue
+            await out.put({"index": i, "filename": filename, "ok": True, **result})
+        await out.put(_DONE)
+
+    tasks = [asyncio.ensure_future(c) for c in (prepare(), correct(), finish())]
+    try:
+        while (line := await out.get()) is not _DONE:
+            yield line
+    finally:
+        for t in tasks:
+            t.cancel()
@@ -0,0 +1,301 @@
+# backend/prefork.py
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+
+
+# ── Lanzador prefork para servir en CPU ────────────────────────────────────────
+# `uvicorn --workers N` arranca N intérpretes que importan todo por separado:
+# el pipeline de spaCy (es_core_news_lg, cientos de MB) y, en CPU, los pesos
+# del modelo acaban N veces en RAM. Este lanzador los carga una sola vez en el
+# proceso padre y después hace fork de los workers, que comparten esas páginas
+# copy-on-write:
+#
+#   python -m backend.prefork --workers 8 --port 8000 --load-model
+#
+# - Antes del fork: spaCy (backend/utils.py), opcionalmente el modelo en CPU
+#   (PALABRIA_MODEL_DEVICE=cpu: safetensors mapeados en memoria, ver
+#   backend/model.py), el estado compartido (backend/shared.py) y el socket
+#   de escucha. Después gc.freeze(): el recolector no vuelve a recorrer (ni a
+#   escribir) las cabeceras de esos objetos, que si no se irían copiando
+#   página a página en cada worker.
+# - torch se limita a un hilo en el padre antes de cargar el modelo: los
+#   pools de OpenMP e inter-op no sobreviven a fork() y un worker que herede
+#   uno ya arrancado puede colgarse en su primera inferencia. Cada worker
+#   arranca los suyos con --threads hilos.
+# - Cada worker importa backend.main DESPUÉS del fork y sirve con uvicorn
+#   sobre el socket heredado (el kernel reparte las conexiones entre ellos);
+#   los hilos y las conexiones a la DB los abre el lifespan de la app.
+# - El padre no sirve peticiones: reenvía los eventos entre workers (relay de
+#   backend/events.py), relanza los que mueren y cada REPORT_SECS escribe la
+#   memoria de cada proceso según /proc/<pid>/smaps_rollup. La columna que
+#   importa es PSS (cada página compartida se reparte entre quienes la usan):
+#   la suma de PSS es lo que ocupa todo el conjunto, la de RSS no.
+#
+# Sin --load-model (y sin INFERENCE_ADDRESS) cada worker cargaría su propia
+# copia del modelo al pedirlo; con INFERENCE_ADDRESS el modelo está en el
+# servidor de inferencia y aquí solo se comparte spaCy.
+#
+# Lo que sigue siendo por worker: la admisión (cada uno tiene sus colas), la
+# caché de user_id (un usuario borrado puede seguir en la de otro worker
+# hasta reiniciar) y la caché de cohortes (caduca por TTL).
+
+WORKERS      = int(os.getenv("PALABRIA_WORKERS", str(os.cpu_count() or 1)))
+REPORT_SECS  = float(os.getenv("PALABRIA_PREFORK_REPORT_SECS", "300"))
+MIN_UPTIME   = 5.0      # un worker que muere antes se relanza con retraso
+STOP_TIMEOUT = 30.0
+
+_SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+_stopping = False
+_workers: dict = {}     # pid → [índice, conexión con el worker, arranque]
+
+
+# ── Memoria ────────────────────────────────────────────────────────────────────
+
+def memory_stats(pid: int) -> dict | None:
+    """Rss/Pss/compartida/privada de un proceso en MB (None si ya no existe)."""
+    kb = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in _SMAPS_FIELDS:
+                    kb[name] = int(rest.split()[0])
+    except (OSError, ValueError):
+        return None
+    def mb(*names):
+        return round(sum(kb.get(n, 0) for n in names) / 1024, 1)
+    return {
+        "rss_mb":     mb("Rss"),
+        "pss_mb":     mb("Pss"),
+        "shared_mb":  mb("Shared_Clean", "Shared_Dirty"),
+        "private_mb": mb("Private_Clean", "Private_Dirty"),
+        "swap_mb":    mb("Swap"),
+    }
+
+
+def memory_report() -> list:
+    rows = [{"worker": "padre", "pid": os.getpid(), **(memory_stats(os.getpid()) or {})}]
+    for pid, (index, _conn, _started) in sorted(_workers.items(), key=lambda kv: kv[1][0]):
+        stats = memory_stats(pid)
+        if stats is not None:
+            rows.append({"worker": index, "pid": pid, **stats})
+    return rows
+
+
+def _print_report():
+    rows = memory_report()
+    cols = ("rss_mb", "pss_mb", "shared_mb", "private_mb", "swap_mb")
+    lines = [f"{'worker':>7} {'pid':>8} " + " ".join(f"{c:>11}" for c in cols)]
+    for r in rows:
+        lines.append(f"{r['worker']!s:>7} {r['pid']:>8} " + " ".join(f"{r.get(c, 0):>11.1f}" for c in cols))
+    total = {c: sum(r.get(c, 0) for r in rows) for c in cols}
+    lines.append(f"{'total':>7} {'':>8} " + " ".join(f"{total[c]:>11.1f}" for c in cols))
+    lines.append(f"Memoria real del conjunto (suma de PSS): {total['pss_mb']:.1f} MB "
+                 f"— la suma de RSS ({total['rss_mb']:.1f} MB) cuenta N veces lo compartido")
+    print("\n".join(lines), flush=True)
+
+
+# ── Padre ──────────────────────────────────────────────────────────────────────
+
+def _pin_torch_threads():
+    """Un hilo intra-op y uno inter-op en el padre: ningún pool llega al fork."""
+    os.environ.setdefault("OMP_NUM_THREADS", "1")       # solo vale si torch no está importado aún
+    import torch
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
+
+
+def preload(load_model: bool):
+    """Lo que se comparte con los workers: se importa y carga antes del fork."""
+    gc.disable()
+    try:
+        import uvicorn                          # noqa: F401
+        import backend.utils                    # noqa: F401 — spaCy es_core_news_lg
+        import backend.shared                   # noqa: F401 — contadores en memoria compartida
+        import backend.events                   # noqa: F401
+        if load_model:
+            os.environ.setdefault("PALABRIA_MODEL_DEVICE", "cpu")
+            _pin_torch_threads()
+            import backend.model as model
+            model.ensure_model_loaded(async_load=False)
+            if not model.MODEL_LOADED:
+                raise SystemExit(model.LOAD_MESSAGE)
+    finally:
+        gc.collect()
+        gc.freeze()
+        gc.enable()
+
+
+def _spawn(index: int, sock: socket.socket, args):
+    parent_end, child_end = Pipe()
+    pid = os.fork()
+    if pid == 0:
+        parent_end.close()
+        for _i, conn, _t in _workers.values():
+            conn.close()
+        code = 1
+        try:
+            _worker(index, sock, child_end, args)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    child_end.close()
+    _workers[pid] = [index, parent_end, time.monotonic()]
+    print(f"worker {index} arrancado (pid {pid})", flush=True)
+
+
+def _forward(ready: list):
+    """Reenvía lo que publica cada worker al resto (sin deserializarlo)."""
+    conns = [conn for _i, conn, _t in _workers.values()]
+    for conn in ready:
+        try:
+            msg = conn.recv_bytes()
+        except (EOFError, OSError):
+            continue        # el worker murió: lo recoge _reap()
+        for other in conns:
+            if other is conn:
+                continue
+            try:
+                other.send_bytes(msg)
+            except (OSError, ValueError):
+                pass
+
+
+def _reap(sock: socket.socket, args):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        entry = _workers.pop(pid, None)
+        if entry is None:
+            continue
+        index, conn, started = entry
+        conn.close()
+        if _stopping:
+            continue
+        print(f"worker {index} (pid {pid}) terminó con estado {os.waitstatus_to_exitcode(status)}; se relanza", flush=True)
+        if time.monotonic() - started < MIN_UPTIME:
+            time.sleep(1.0)
+        _spawn(index, sock, args)
+
+
+def _on_signal(signum, _frame):
+    global _stopping
+    _stopping = True
+
+
+def _stop_workers():
+    for pid in list(_workers):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while _workers and time.monotonic() < deadline:
+        try:
+            pid, _status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        _workers.pop(pid, None)
+    for pid in list(_workers):
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        _workers.pop(pid, None)
+
+
+def run(args):
+    os.environ["PALABRIA_WORKERS"] = str(args.workers)
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    print(f"Escuchando en {args.host}:{args.port}; precargando…", flush=True)
+    preload(args.load_model)
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    for index in range(args.workers):
+        _spawn(index, sock, args)
+
+    next_report = time.monotonic() + min(REPORT_SECS, 15.0)
+    while not _stopping:
+        conns = [conn for _i, conn, _t in _workers.values()]
+        _forward(wait(conns, timeout=0.5) if conns else [])
+        _reap(sock, args)
+        if REPORT_SECS > 0 and time.monotonic() >= next_report:
+            _print_report()
+            next_report = time.monotonic() + REPORT_SECS
+
+    print("Parando workers…", flush=True)
+    _stop_workers()
+    sock.close()
+
+
+# ── Worker ─────────────────────────────────────────────────────────────────────
+
+def _worker(index: int, sock: socket.socket, conn, args):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)    # uvicorn pone los suyos
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    import backend.events as events
+    import backend.shared as shared
+    shared.WORKER_INDEX = index
+    os.environ["PALABRIA_WORKER_INDEX"] = str(index)
+    events.attach_relay(conn)
+
+    # Los hilos de torch se reparten entre workers en vez de que cada uno
+    # intente usar todos los núcleos
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(args.threads)
+
+    import uvicorn
+    from backend.main import app
+    uvicorn.Server(uvicorn.Config(app, log_level=args.log_level)).run(sockets=[sock])
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────────
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.prefork", description="Lanzador prefork de la API de PALABRIA.")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="nº de workers (por defecto PALABRIA_WORKERS o nº de CPUs)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--load-model", action="store_true",
+                    help="cargar el modelo en CPU en el padre y compartirlo con los workers")
+    ap.add_argument("--threads", type=int, default=None,
+                    help="hilos de torch por worker (por defecto nº de CPUs / workers)")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args(argv)
+
+    if args.workers < 1:
+        ap.error("--workers debe ser al menos 1")
+    inference_address = os.getenv("INFERENCE_ADDRESS", "")
+    if args.load_model and inference_address:
+        ap.error("--load-model no tiene sentido con INFERENCE_ADDRESS: el modelo está en el servidor de inferencia")
+    if not args.load_model and not inference_address:
+        print("Aviso: sin --load-model ni INFERENCE_ADDRESS cada worker cargará su propia copia del modelo", flush=True)
+    if args.threads is None:
+        args.threads = max(1, len(os.sched_getaffinity(0)) // args.workers)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# backend/presence.py
+import atexit
+import os
+import threading
+import time
+
+from backend.db import touch_sessions
+
+
+# ── Presencia en memoria ───────────────────────────────────────────────────────
+# Cada heartbeat solo actualiza un dict user_id → último latido. Un hilo
+# vuelca el dict cada FLUSH_INTERVAL segundos con un único UPDATE por lotes
+# sobre las sesiones abiertas. Si el proceso cae se pierde como mucho un
+# intervalo de latidos (la sesión termina en el último latido volcado).
+
+FLUSH_INTERVAL = float(os.getenv("PALABRIA_PRESENCE_FLUSH_SECS", "30"))
+
+_last_seen: dict = {}
+_lock   = threading.Lock()
+_thread = None
+_stop   = threading.Event()
+_stats  = {"heartbeats": 0, "flushes": 0, "rows_flushed": 0, "last_flush": None}
+
+
+def touch(user_id: int, epoch_seconds: float | None = None):
+    ts = float(epoch_seconds if epoch_seconds is not None else time.time())
+    with _lock:
+        if ts > _last_seen.get(user_id, 0.0):
+            _last_seen[user_id] = ts
+        _stats["heartbeats"] += 1
+
+
+def flush(user_id: int | None = None) -> int:
+    """Vuelca los latidos pendientes (de todos o de un usuario). Devuelve cuántos."""
+    with _lock:
+        if user_id is None:
+            pending = dict(_last_seen)
+            _last_seen.clear()
+        elif user_id in _last_seen:
+            pending = {user_id: _last_seen.pop(user_id)}
+        else:
+            pending = {}
+    if not pending:
+        return 0
+    try:
+        touch_sessions(pending.items())
+    except Exception:
+        # Devolver los latidos al dict para el siguiente intento
+        with _lock:
+            for uid, ts in pending.items():
+                if ts > _last_seen.get(uid, 0.0):
+                    _last_seen[uid] = ts
+        raise
+    with _lock:
+        _stats["flushes"] += 1
+        _stats["rows_flushed"] += len(pending)
+        _stats["last_flush"] = time.time()
+    return len(pending)
+
+
+def _loop():
+    while not _stop.wait(FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+def start():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="palabria-presence", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(stop)
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {**_stats, "pending": len(_last_seen), "flush_interval": FLUSH_INTERVAL}
@@ -0,0 +1,102 @@
+# backend/respcache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import backend.db as db
+import backend.shared as shared
+
+
+# ── Caché de respuestas con ETag ───────────────────────────────────────────────
+# Cada usuario tiene un contador de versión (backend/shared.py, compartido
+# entre workers) que sube con el hook de escritura de la DB cada vez que
+# cambia algo suyo (documentos, métricas, sesiones,
+# eventos de uso). El ETag de una respuesta sale de (arranque del proceso,
+# versión del usuario, día UTC, endpoint, parámetros): si el cliente manda el
+# mismo en If-None-Match se responde 304 sin tocar la DB, y si no, se sirve el
+# cuerpo ya serializado de la caché mientras la versión no haya cambiado.
+# El día entra en la etiqueta porque las ventanas tipo "últimos 7 días" se
+# mueven solas a medianoche, y el id de arranque porque los contadores viven
+# en memoria y vuelven a 0 al reiniciar.
+
+MAX_ENTRIES = int(os.getenv("PALABRIA_RESPONSE_CACHE_MAX", "4096"))
+
+_lock  = threading.Lock()
+_cache: OrderedDict = OrderedDict()     # (endpoint, user_id, params) → (etag, cuerpo JSON)
+_stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+
+def _etag(endpoint: str, user_id: int, params: tuple) -> str:
+    """ETag fuerte de la versión actual (con _lock)."""
+    day = datetime.now(timezone.utc).date().isoformat()
+    epoch, version = shared.version(user_id)
+    raw = f"{shared.BOOT}|{epoch}|{version}|{day}|{endpoint}|{params!r}"
+    return '"' + hashlib.blake2b(raw.encode(), digest_size=12).hexdigest() + '"'
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    tags = (t.strip() for t in if_none_match.split(","))
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def render(body) -> bytes:
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def lookup(endpoint: str, user_id: int, params: tuple, if_none_match: str | None, compute) -> tuple:
+    """
+    Devuelve (etag, cuerpo): cuerpo es None si el cliente ya tiene esa
+    versión (→ 304) o los bytes JSON, de la caché o de compute().
+    """
+    key = (endpoint, user_id, params)
+    with _lock:
+        etag = _etag(endpoint, user_id, params)
+        if _matches(if_none_match, etag):
+            _stats["not_modified"] += 1
+            return etag, None
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == etag:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return etag, hit[1]
+        _stats["misses"] += 1
+    # La etiqueta se fija antes de leer: si entra una escritura mientras se
+    # calcula, la versión sube y esta entrada ya no vuelve a servirse
+    body = render(compute())
+    with _lock:
+        _cache[key] = (etag, body)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return etag, body
+
+
+def _on_write(user_ids: set | None):
+    # Las versiones ya las subió shared; aquí solo se libera memoria
+    with _lock:
+        if user_ids is None:
+            _stats["invalidations"] += len(_cache)
+            _cache.clear()
+            return
+        _stats["invalidations"] += len(user_ids)
+
+
+db.add_write_hook(_on_write)
+
+
+def get_stats() -> dict:
+    with _lock:
+        served = _stats["hits"] + _stats["misses"] + _stats["not_modified"]
+        return {
+            **_stats,
+            "cached":   len(_cache),
+            "hit_rate": round((_stats["hits"] + _stats["not_modified"]) / served, 3) if served else None,
+        }
@@ -0,0 +1,87 @@
+# backend/shared.py
+import os
+import secrets
+import sys
+from multiprocessing import get_context
+
+import backend.db as db
+
+
+# ── Estado compartido entre workers ────────────────────────────────────────────
+# Las cachés por usuario (respcache, trends) se invalidan con contadores de
+# versión que sube el hook de escritura de la DB. Con varios procesos detrás
+# del mismo socket (backend/prefork.py) cada escritura la ve un solo worker,
+# así que los contadores viven aquí, en memoria compartida: el lanzador
+# importa este módulo antes del fork y todos los workers heredan el mismo
+# array. Un user_id cae en la ranura user_id % SLOTS; si dos comparten
+# ranura, una escritura de uno invalida también al otro (nunca al revés).
+# El id de arranque que entra en las ETags también se fija aquí, para que un
+# 304 valga en cualquier worker.
+#
+# Igual con las conexiones de presencia por WebSocket: el logout diferido de
+# un worker comprueba que el usuario no se haya reconectado a otro.
+#
+# Con un solo proceso funciona igual (el array simplemente no se comparte).
+
+WORKERS      = int(os.getenv("PALABRIA_WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("PALABRIA_WORKER_INDEX", "0"))    # lo fija prefork tras el fork
+SLOTS        = int(os.getenv("PALABRIA_SHARED_SLOTS", "65536"))
+
+BOOT = secrets.token_hex(4)
+
+_ctx      = get_context("fork")
+_lock     = _ctx.Lock()
+_versions = _ctx.RawArray("Q", SLOTS + 1)      # [SLOTS] = época (escrituras de "todos")
+_present  = _ctx.RawArray("i", SLOTS)          # conexiones de presencia abiertas
+
+
+def version(user_id: int) -> tuple:
+    """(época, versión del usuario): cambia con cada escritura que le afecta."""
+    return _versions[SLOTS], _versions[user_id % SLOTS]
+
+
+def _on_write(user_ids: set | None):
+    with _lock:
+        if user_ids is None:
+            _versions[SLOTS] += 1
+            return
+        for slot in {uid % SLOTS for uid in user_ids}:
+            _versions[slot] += 1
+
+
+db.add_write_hook(_on_write)
+
+
+def presence_add(user_id: int, delta: int):
+    with _lock:
+        _present[user_id % SLOTS] += delta
+
+
+def present(user_id: int) -> bool:
+    """¿Tiene el usuario alguna conexión de presencia abierta en algún worker?"""
+    return _present[user_id % SLOTS] > 0
+
+
+def uvicorn_workers() -> int:
+    """
+    Workers pedidos a `uvicorn --workers N` (o WEB_CONCURRENCY); 1 si no se
+    arrancó con uvicorn. Esos procesos no heredan este módulo ni el relay de
+    eventos del lanzador prefork, así que no comparten nada de lo anterior.
+    """
+    if "uvicorn" not in sys.argv[0]:
+        return 1
+    value = os.getenv("WEB_CONCURRENCY", "1")
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg == "--workers" and i + 1 < len(args):
+            value = args[i + 1]
+        elif arg.startswith("--workers="):
+            value = arg.partition("=")[2]
+    try:
+        return int(value)
+    except ValueError:
+        return 1
+
+
+def get_stats() -> dict:
+    return {"workers": WORKERS, "worker": WORKER_INDEX, "pid": os.getpid(), "slots": SLOTS}
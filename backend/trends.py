@@ -0,0 +1,122 @@
+# backend/trends.py
+import os
+import threading
+
+import backend.db as db
+import backend.shared as shared
+
+
+# ── Tendencia del 'tú' impersonal ──────────────────────────────────────────────
+# Sobre la secuencia de documentos del usuario (en orden de subida):
+# - tasa móvil de documentos con 'tú' en una ventana de WINDOW documentos,
+# - pendiente de la recta de mínimos cuadrados de has_tu frente al nº de
+#   documento (cambio de la tasa por documento),
+# - buckets semanales.
+# `evolucion` sale del cambio que predice la recta a lo largo de toda la
+# historia: bajar CHANGE_PP puntos o más es "mejora", subirlos "empeora".
+# El resultado se memoiza por usuario con su versión de backend/shared.py,
+# que sube con el hook de escritura de la DB cuando cambian sus rollups
+# (documento nuevo, métricas, borrado) en cualquier worker.
+
+WINDOW    = int(os.getenv("PALABRIA_TREND_WINDOW", "5"))
+MIN_DOCS  = int(os.getenv("PALABRIA_TREND_MIN_DOCS", "3"))
+CHANGE_PP = float(os.getenv("PALABRIA_TREND_CHANGE_PP", "15"))
+
+_lock  = threading.Lock()
+_cache: dict = {}       # user_id → (versión, resultado)
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _slope(ys: list) -> float:
+    """Pendiente de mínimos cuadrados de ys frente a 1..n."""
+    n = len(ys)
+    if n < 2:
+        return 0.0
+    mx = (n + 1) / 2.0
+    my = sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in range(1, n + 1))
+    sxy = sum((x - mx) * (y - my) for x, y in zip(range(1, n + 1), ys))
+    return sxy / sxx
+
+
+def _evolucion(n: int, change_pp: float) -> str:
+    if n < MIN_DOCS:
+        return "insuficiente"
+    if change_pp <= -CHANGE_PP:
+        return "mejora"
+    if change_pp >= CHANGE_PP:
+        return "empeora"
+    return "estable"
+
+
+def compute(user_id: int) -> dict:
+    data = db.get_user_tu_series(user_id, WINDOW)
+    docs = data["docs"]
+    ys = [int(d["has_tu"]) for d in docs]
+    n = len(ys)
+    slope = _slope(ys)
+    change_pp = slope * (n - 1) * 100.0 if n > 1 else 0.0
+    return {
+        "docs":          n,
+        "window":        WINDOW,
+        "rate":          round(sum(ys) * 100.0 / n, 1) if n else 0.0,
+        "recent_rate":   round(docs[-1]["rolling_rate"] * 100.0, 1) if n else 0.0,
+        "slope_per_doc": round(slope * 100.0, 3),
+        "change_pp":     round(change_pp, 1),
+        "evolucion":     _evolucion(n, change_pp),
+        "series": [
+            {
+                "seq":          d["seq"],
+                "doc_id":       d["doc_id"],
+                "day":          d["day"],
+                "has_tu":       bool(d["has_tu"]),
+                "rolling_rate": round(d["rolling_rate"] * 100.0, 1),
+            }
+            for d in docs
+        ],
+        "weekly": [
+            {
+                "week":         w["week"],
+                "docs":         w["docs"],
+                "docs_with_tu": w["docs_with_tu"],
+                "rate":         round(w["rate"] * 100.0, 1),
+            }
+            for w in data["weekly"]
+        ],
+    }
+
+
+def get_trend(user_id: int) -> dict:
+    version = shared.version(user_id)
+    with _lock:
+        hit = _cache.get(user_id)
+        if hit is not None and hit[0] == version:
+            _stats["hits"] += 1
+            return hit[1]
+        _stats["misses"] += 1
+    result = compute(user_id)
+    with _lock:
+        # Si entró una escritura mientras se calculaba, no se guarda
+        if shared.version(user_id) == version:
+            _cache[user_id] = (version, result)
+    return result
+
+
+def _on_write(user_ids: set | None):
+    # Las versiones ya las subió shared; aquí solo se libera memoria
+    with _lock:
+        if user_ids is None:
+            _stats["invalidations"] += len(_cache)
+            _cache.clear()
+            return
+        for uid in user_ids:
+            if _cache.pop(uid, None) is not None:
+                _stats["invalidations"] += 1
+
+
+db.add_write_hook(_on_write)
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {**_stats, "cached": len(_cache), "window": WINDOW}
@@ -0,0 +1,101 @@
+# bench/db_pool.py
+"""
+Micro-benchmark del pool de conexiones de backend/db.py.
+
+Compara, sobre la misma base sintética, abrir una conexión por llamada (lo
+que hacía db() antes del pool: connect + PRAGMA foreign_keys + commit +
+close) con tomar una conexión larga del pool (db.db()). Mide operaciones
+por segundo de dos lecturas calientes: usuario por nombre y últimos
+documentos de un usuario, con 1 y con 4 hilos.
+
+    python bench/db_pool.py [--users 2000] [--secs 2]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+QUERIES = {
+    "user_id": ("SELECT id FROM users WHERE username=?", lambda i: (f"user{i}",)),
+    "documents": (
+        "SELECT id, filename, uploaded_at FROM documents WHERE user_id=? ORDER BY id DESC LIMIT 20",
+        lambda i: (i + 1,),
+    ),
+}
+
+
+def seed(db, users: int, docs_per_user: int):
+    with db.db() as con:
+        con.executemany("INSERT INTO users(username) VALUES(?)", [(f"user{i}",) for i in range(users)])
+        con.executemany(
+            "INSERT INTO documents(user_id, filename, text_hash) VALUES(?,?,?)",
+            [(u + 1, f"doc{d}.pdf", f"{u}-{d}") for u in range(users) for d in range(docs_per_user)],
+        )
+
+
+def per_call(path: str):
+    @contextmanager
+    def conn():
+        con = sqlite3.connect(path)
+        con.row_factory = sqlite3.Row
+        try:
+            con.execute("PRAGMA foreign_keys = ON;")
+            yield con
+            con.commit()
+        finally:
+            con.close()
+    return conn
+
+
+def run(conn, sql: str, args, users: int, threads: int, secs: float) -> float:
+    done = [0] * threads
+    stop = time.perf_counter() + secs
+
+    def worker(k: int):
+        rnd = random.Random(k)
+        n = 0
+        while time.perf_counter() < stop:
+            with conn() as con:
+                con.execute(sql, args(rnd.randrange(users))).fetchall()
+            n += 1
+        done[k] = n
+
+    ts = [threading.Thread(target=worker, args=(k,)) for k in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(done) / secs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--docs", type=int, default=10, help="documentos por usuario")
+    ap.add_argument("--secs", type=float, default=2.0, help="segundos por medida")
+    args = ap.parse_args(argv)
+
+    os.environ["DB_PATH"] = str(Path(tempfile.mkdtemp(prefix="palabria-bench-")) / "bench.db")
+    import backend.db as db
+    db.init_db()
+    seed(db, args.users, args.docs)
+
+    print(f"{'consulta':<10} {'hilos':>5} {'por llamada':>13} {'pool':>13} {'x':>6}")
+    for name, (sql, params) in QUERIES.items():
+        for threads in (1, 4):
+            before = run(per_call(db.DB_PATH), sql, params, args.users, threads, args.secs)
+            after  = run(db.db, sql, params, args.users, threads, args.secs)
+            print(f"{name:<10} {threads:>5} {before:>10,.0f}/s {after:>10,.0f}/s {after / before:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
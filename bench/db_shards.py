@@ -0,0 +1,94 @@
+# bench/db_shards.py
+"""
+Throughput de escritura con y sin sharding, según usuarios concurrentes.
+
+Cada usuario es un hilo que crea documentos (create_document con métricas,
+evento de uso y textos, esperando el commit como una petición real). Cada
+configuración corre en un proceso aparte porque DB_SHARDING se lee al
+importar backend.db:
+
+- off:  una sola base (un escritor, commits agrupados por lote),
+- user: un fichero y un hilo escritor por usuario.
+
+    python bench/db_shards.py [--users 1,4,16,64] [--secs 3] [--synchronous NORMAL|FULL]
+
+Con --synchronous FULL cada commit hace fsync, que es donde los escritores
+en paralelo de los shards tienen más que ganar.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def child(users: int, secs: float, synchronous: str):
+    import backend.db as db
+    db.CONNECTION_PRAGMAS = tuple(
+        f"PRAGMA synchronous = {synchronous};" if p.startswith("PRAGMA synchronous") else p
+        for p in db.CONNECTION_PRAGMAS
+    )
+    db.init_db()
+    uids = [db.create_user(f"user{i}") for i in range(users)]
+    text = "Cuando tú escribes un texto académico, tú debes cuidar el registro. " * 20
+    metrics = {"total_frases": 20, "frases_con_tu_impersonal": 2,
+               "cambios_propuestos_modelo": 4, "cambios_realizados_usuario": 4}
+    done = [0] * users
+    stop = time.perf_counter() + secs
+
+    def worker(k: int):
+        n = 0
+        while time.perf_counter() < stop:
+            db.create_document(uids[k], f"doc{n}.txt", f"{k}-{n}", metrics=metrics,
+                               event="text_uploaded", texts={"original": text, "corrected": text})
+            n += 1
+        done[k] = n
+
+    ts = [threading.Thread(target=worker, args=(k,)) for k in range(users)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    db.flush_writes()
+    print(json.dumps({"docs_per_sec": sum(done) / secs}))
+
+
+def run(mode: str, users: int, secs: float, synchronous: str) -> float:
+    tmp = Path(tempfile.mkdtemp(prefix="palabria-bench-"))
+    env = dict(os.environ, DB_PATH=str(tmp / "bench.db"), DB_SHARDING=mode, DB_SHARD_DIR=str(tmp / "shards"))
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", str(users), "--secs", str(secs), "--synchronous", synchronous],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])["docs_per_sec"]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", default="1,4,16,64")
+    ap.add_argument("--secs", type=float, default=3.0)
+    ap.add_argument("--synchronous", default="NORMAL", choices=("NORMAL", "FULL"))
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.secs, args.synchronous)
+        return
+
+    print(f"synchronous={args.synchronous}, {os.cpu_count()} CPU")
+    print(f"{'usuarios':>8} {'una base':>12} {'shards':>12} {'x':>6}")
+    for users in (int(u) for u in args.users.split(",")):
+        single  = run("off", users, args.secs, args.synchronous)
+        sharded = run("user", users, args.secs, args.synchronous)
+        print(f"{users:>8} {single:>8,.0f}/s {sharded:>8,.0f}/s {sharded / single:>5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench/sessions.py
+"""
+Benchmark sintético de login y heartbeat frente al tamaño del histórico.
+
+Siembra usage_stats por tramos (hasta ~1M de filas, más las sesiones
+cerradas correspondientes) y en cada tramo mide lo que hacen
+/users/login (record_usage + flush de presencia + close_idle_sessions +
+record_login_ts) y el volcado de latidos de presencia (touch_sessions en
+lote). Desde la tabla sessions ninguna de las dos operaciones recorre
+usage_stats, así que la latencia debe quedar plana.
+
+    python bench/sessions.py [--rows 1000000] [--users 5000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+EVENTS = (("heartbeat", 0.80), ("login", 0.05), ("upload", 0.10), ("logout", 0.05))
+
+
+def seed(db, start: int, stop: int, users: int):
+    rnd = random.Random(start)
+    names = [e for e, _ in EVENTS]
+    weights = [w for _, w in EVENTS]
+    now = time.time()
+
+    def usage():
+        for _ in range(start, stop):
+            ts = now - rnd.uniform(0, 180 * 86400)
+            yield (rnd.randrange(users) + 1, rnd.choices(names, weights)[0],
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts)))
+
+    def sessions():
+        for _ in range(start, stop, 20):
+            started = now - rnd.uniform(86400, 180 * 86400)
+            dur = rnd.uniform(60, 3600)
+            yield (rnd.randrange(users) + 1, started, started + dur, started + dur, dur)
+
+    with db.db() as con:
+        con.executemany("INSERT INTO usage_stats(user_id, event, created_at) VALUES(?,?,?)", usage())
+        con.executemany(
+            "INSERT INTO sessions(user_id, started_at, last_seen, ended_at, duration) VALUES(?,?,?,?,?)",
+            sessions(),
+        )
+
+
+def login(db, presence, uid: int):
+    # Lo mismo que /users/login tras resolver el user_id
+    db.record_usage(uid, "login", None)
+    presence.flush()
+    db.close_idle_sessions(idle_secs=3600)
+    db.record_login_ts(uid, time.time())
+
+
+def measure(fn, n: int) -> tuple:
+    ms = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        ms.append((time.perf_counter() - t0) * 1000)
+    ms.sort()
+    return statistics.median(ms), ms[int(len(ms) * 0.95) - 1]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000, help="filas finales de usage_stats")
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--n", type=int, default=200, help="repeticiones por medida")
+    args = ap.parse_args(argv)
+
+    os.environ["DB_PATH"] = str(Path(tempfile.mkdtemp(prefix="palabria-bench-")) / "bench.db")
+    import backend.db as db
+    import backend.presence as presence
+    db.init_db()
+    with db.db() as con:
+        con.executemany("INSERT INTO users(username) VALUES(?)", [(f"user{i}",) for i in range(args.users)])
+
+    steps = sorted({0, args.rows // 100, args.rows // 10, args.rows})
+    print(f"{'usage_stats':>12} {'login p50':>10} {'login p95':>10} {'latidos p50':>12} {'latidos p95':>12}")
+    seeded = 0
+    for rows in steps:
+        seed(db, seeded, rows, args.users)
+        seeded = rows
+        db.flush_writes()
+        db.wal_checkpoint()     # como hace maintenance cada hora
+
+        login_p50, login_p95 = measure(lambda i: login(db, presence, i % args.users + 1), args.n)
+
+        def heartbeats(i):
+            for uid in range(1, 201):          # un volcado con 200 usuarios conectados
+                presence.touch(uid)
+            presence.flush()
+        hb_p50, hb_p95 = measure(heartbeats, args.n)
+
+        print(f"{rows:>12,} {login_p50:>8.2f}ms {login_p95:>8.2f}ms {hb_p50:>10.2f}ms {hb_p95:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,9 @@ import requests
 from fpdf import FPDF
 import os
 import time
+import json
 import hashlib
+from urllib.parse import quote
 from rapidfuzz.distance import Levenshtein as L
 from streamlit.components.v1 import html as st_html
 import altair as alt
@@ -19,6 +21,15 @@ PRETTY = {
 }
 SHOW_KEYS = list(PRETTY.keys())
 
+ACTIVITY_RANGES = {        # etiqueta → días hacia atrás (incluido hoy)
+    "Últimos 30 días": 30,
+    "Este semestre (6 meses)": 183,
+    "Último año": 365,
+}
+ACTIVITY_BUCKETS = {"Día": "day", "Semana": "week", "Mes": "month"}
+
+STATUS_WAIT_SECS = 4.0      # espera máxima de eventos de carga del modelo por ejecución
+
 # ── DESIGN SYSTEM ──────────────────────────────────────────────────────────────
 st.markdown("""
 <style>
@@ -569,6 +580,53 @@ def fetch_status(backend_url, timeout=5):
         return {"modelo_listo": False, "progress": 0, "message": f"No conectado: {e}"}
     return {"modelo_listo": False, "progress": 0, "message": "Desconocido"}
 
+def get_json_revalidated(url, params=None, timeout=10):
+    """
+    GET con If-None-Match: guarda en sesión el último JSON de cada URL con su
+    ETag y, si el backend contesta 304, lo reutiliza sin volver a descargarlo.
+    Devuelve None si la respuesta no es correcta.
+    """
+    cache = st.session_state.setdefault("__etag_cache", {})
+    key = (url, tuple(sorted((params or {}).items())))
+    hit = cache.get(key)
+    headers = {"If-None-Match": hit[0]} if hit else {}
+    r = requests.get(url, params=params, headers=headers, timeout=timeout)
+    if r.status_code == 304 and hit:
+        return hit[1]
+    if not r.ok:
+        return None
+    data = r.json()
+    if r.headers.get("ETag"):
+        cache[key] = (r.headers["ETag"], data)
+    return data
+
+def wait_for_events(backend_url, username, watch, until, on_event=None, timeout=120.0):
+    """
+    Abre el WebSocket del backend solo para recibir eventos, pide vigilar
+    `watch` ({"doc_id": N} o {"job_id": "..."}) y devuelve el primer evento
+    para el que until(evento) es cierto, pasando cada uno por on_event.
+    None si se agota el tiempo; excepción si no hay WebSocket (el llamador
+    vuelve entonces al polling).
+    """
+    from websockets.sync.client import connect
+
+    ws_url = backend_url.replace("http", "ws", 1) + f"/ws?username={quote(username)}&watch_only=1"
+    deadline = time.time() + timeout
+    with connect(ws_url, open_timeout=5) as ws:
+        ws.send(json.dumps({"type": "watch", **watch}))
+        while True:
+            left = deadline - time.time()
+            if left <= 0:
+                return None
+            try:
+                event = json.loads(ws.recv(timeout=left))
+            except TimeoutError:
+                return None
+            if on_event is not None:
+                on_event(event)
+            if until(event):
+                return event
+
 def _normalize_for_diff(text: str) -> str:
     if not text:
         return ""
@@ -623,7 +681,7 @@ def inject_session_js(backend_url: str, username: str):
       const backend = {repr(backend_url)};
       const username = {repr(username)};
       const hbUrl = backend + "/users/heartbeat";
-      const loUrl = backend + "/users/logout";
+      const wsUrl = backend.replace(/^http/, "ws") + "/ws?username=" + encodeURIComponent(username);
 
       function postForm(url, dataObj) {{
         const formData = new URLSearchParams();
@@ -636,24 +694,30 @@ def inject_session_js(backend_url: str, username: str):
         }}).catch(()=>{{}});
       }}
 
-      const sendHeartbeat = () => postForm(hbUrl, {{username}});
-      sendHeartbeat();
-      const hbTimer = setInterval(sendHeartbeat, 20000);
-
-      function beaconLogout() {{
+      // La presencia va por el WebSocket: mientras está abierto cuenta como
+      // sesión activa y el backend cierra la sesión poco después de que se
+      // cierre. Si no se puede abrir (proxy sin WebSocket), heartbeat por POST.
+      let ws = null;
+      let retry = 1000;
+      function openSocket() {{
         try {{
-          if (!navigator.sendBeacon) {{
-            postForm(loUrl, {{username}});
-            return;
-          }}
-          const data = new URLSearchParams();
-          data.append("username", username);
-          const blob = new Blob([data.toString()], {{type: "application/x-www-form-urlencoded"}});
-          navigator.sendBeacon(loUrl, blob);
-        }} catch (e) {{}}
+          ws = new WebSocket(wsUrl);
+        }} catch (e) {{
+          ws = null;
+          return;
+        }}
+        ws.onopen = () => {{ retry = 1000; }};
+        ws.onclose = () => {{
+          ws = null;
+          setTimeout(openSocket, retry);
+          retry = Math.min(retry * 2, 30000);
+        }};
       }}
+      if (window.WebSocket) openSocket();
 
-      window.addEventListener("beforeunload", beaconLogout);
+      setInterval(() => {{
+        if (!ws || ws.readyState !== WebSocket.OPEN) postForm(hbUrl, {{username}});
+      }}, 20000);
     }})();
     </script>
     """
@@ -694,18 +758,140 @@ def _fetch_and_cache_doc_metrics(backend_url, doc_id: int):
     except Exception:
         pass
 
-def _post_user_changes(backend_url, doc_id: int, changes: int):
+def _post_user_changes(backend_url, doc_id: int, changes: int, text: str = None):
     try:
+        data = {"changes": changes}
+        if text is not None:
+            data["text"] = text
         requests.post(
             f"{backend_url}/documents/{doc_id}/user_changes",
-            data={"changes": changes},
+            data=data,
             timeout=10
         )
         st.session_state[f"__last_saved_changes_{doc_id}"] = int(changes)
+        if text is not None:
+            st.session_state[f"__last_saved_text_{doc_id}"] = text
         _fetch_and_cache_doc_metrics(backend_url, doc_id)
     except Exception:
         pass
 
+def reopen_document(backend_url, doc: dict) -> bool:
+    """
+    Carga un documento ya procesado como análisis actual a partir de los
+    textos guardados en el backend (sin volver a pasar por el modelo).
+    """
+    r = requests.get(f"{backend_url}/documents/{doc['id']}/texts", timeout=15)
+    if not r.ok:
+        return False
+    texts = r.json()
+    if texts.get("original_text") is None:
+        return False
+
+    metrics_list = st.session_state.get(f"__cache_doc_{doc['id']}") or []
+    metricas = {row["metric_name"]: row["metric_value"] for row in metrics_list}
+
+    feedback = ""
+    try:
+        fb = requests.get(f"{backend_url}/feedback_status/{doc['id']}", timeout=5).json()
+        if fb.get("status") == "done":
+            feedback = fb.get("result", "")
+        if fb.get("status") != "pending":
+            # Terminado o ya no está en memoria: no hace falta seguir consultando
+            st.session_state[f"__feedback_done_{doc['id']}"] = True
+    except Exception:
+        pass
+
+    corrected = texts.get("corrected_text") or ""
+    st.session_state["last_input_digest"] = None
+    st.session_state["last_pdf_name"] = doc.get("filename")
+    st.session_state["last_doc_id"] = doc["id"]
+    st.session_state["last_analysis"] = {
+        "original_text": texts.get("original_text", ""),
+        "metricas": metricas,
+        "corrected_text": corrected,
+        "feedback": feedback,
+    }
+    st.session_state["edited_text_area"] = texts.get("final_text") or corrected
+    st.session_state["__edited_for_doc"] = doc["id"]
+    return True
+
+JOB_STAGE_LABELS = {
+    "queued":     "⏳ En cola…",
+    "extracting": "Extrayendo el texto del PDF…",
+    "detecting":  "Detectando posibles usos del 'tú' impersonal…",
+    "correcting": "Corrigiendo el texto…",
+    "metrics":    "Calculando métricas…",
+    "waiting_gpu": "⏳ Esperando a que terminen las correcciones en curso…",
+    "generating": "Generando la valoración…",
+}
+
+def run_processing_job(backend_url, data, files=None, timeout=600):
+    """
+    Envía el documento a /jobs y sigue su progreso por WebSocket (o consultando
+    /jobs/{id} si no hay WebSocket) hasta que termina, mostrando la posición
+    en la cola mientras espera.
+    Devuelve (resultado, error).
+    """
+    try:
+        r = requests.post(f"{backend_url}/jobs", data=data, files=files, timeout=30)
+    except Exception as e:
+        return None, f"Error conectando con backend: {e}"
+
+    if r.status_code == 429:
+        retry = r.headers.get("Retry-After", "unos")
+        try:
+            msg = r.json().get("detail", "")
+        except Exception:
+            msg = ""
+        return None, f"⏳ {msg} Vuelve a intentarlo en {retry} s."
+    if not r.ok:
+        return None, f"código {r.status_code}: {r.text}"
+
+    job_id = r.json().get("job_id")
+    placeholder = st.empty()
+    deadline = time.time() + timeout
+
+    def show(event):
+        if event.get("type") != "job" or event.get("job_id") != job_id:
+            return
+        pos = int(event.get("queue_position") or 0)
+        if pos > 0:
+            placeholder.info(f"⏳ En cola: posición {pos}")
+        else:
+            placeholder.info(JOB_STAGE_LABELS.get(event.get("stage"), "Procesando…"))
+
+    try:
+        try:
+            wait_for_events(
+                backend_url, data["username"], {"job_id": job_id},
+                until=lambda e: e.get("type") == "job" and e.get("job_id") == job_id
+                                and e.get("status") in ("done", "error"),
+                on_event=show, timeout=timeout,
+            )
+        except Exception:
+            pass    # sin WebSocket: se sigue consultando /jobs/{id}
+        # El resultado se lee siempre de /jobs/{id} (el evento no lo lleva)
+        while time.time() < deadline:
+            try:
+                job = requests.get(f"{backend_url}/jobs/{job_id}", timeout=10).json()
+            except Exception:
+                time.sleep(1.0)
+                continue
+            status = job.get("status")
+            if status == "done":
+                return job.get("result") or {}, None
+            if status == "error":
+                return None, job.get("error") or "error desconocido"
+            pos = int(job.get("queue_position") or 0)
+            if pos > 0:
+                placeholder.info(f"⏳ En cola: posición {pos}")
+            else:
+                placeholder.info(JOB_STAGE_LABELS.get(job.get("stage"), "Procesando…"))
+            time.sleep(1.0)
+    finally:
+        placeholder.empty()
+    return None, "tiempo de espera agotado"
+
 def login():
     st.markdown("""
 <style>
@@ -796,8 +982,8 @@ div[data-testid="stForm"] {
 
 
 def cargar_metricas(username, backend_url):
-    ov = requests.get(f"{backend_url}/users/{username}/overview", timeout=20).json()
-    docs = requests.get(f"{backend_url}/users/{username}/documents", timeout=20).json().get("documents", [])
+    ov = get_json_revalidated(f"{backend_url}/users/{username}/overview", timeout=20) or {}
+    docs = (get_json_revalidated(f"{backend_url}/users/{username}/documents", timeout=20) or {}).get("documents", [])
     st.session_state["__cache_overview"] = ov
     st.session_state["__cache_documents"] = docs
 
@@ -852,9 +1038,9 @@ def ver_mis_metricas(username, backend_url):
         rule()
         section("◈", "Actividad semanal")
         try:
-            resp = requests.get(f"{backend_url}/users/{username}/weekly_activity", timeout=10)
-            if resp.ok:
-                data = resp.json().get("activity", [])
+            weekly = get_json_revalidated(f"{backend_url}/users/{username}/weekly_activity", timeout=10)
+            if weekly is not None:
+                data = weekly.get("activity", [])
                 if data:
                     import pandas as pd
                     df = pd.DataFrame(data)
@@ -898,6 +1084,100 @@ def ver_mis_metricas(username, backend_url):
         except Exception as e:
             st.warning(f"Error al obtener la actividad: {e}")
 
+        rule()
+        section("◈", "Actividad por periodo")
+        ca, cb = st.columns(2, gap="medium")
+        rango = ca.selectbox(
+            "Rango", list(ACTIVITY_RANGES.keys()), index=1, key="sel_activity_range"
+        )
+        agrupar = cb.radio(
+            "Agrupar por", list(ACTIVITY_BUCKETS.keys()), index=1,
+            horizontal=True, key="sel_activity_bucket"
+        )
+        try:
+            import datetime as _dt
+            hoy = _dt.date.today()
+            activity = get_json_revalidated(
+                f"{backend_url}/users/{username}/activity",
+                params={
+                    "start":  (hoy - _dt.timedelta(days=ACTIVITY_RANGES[rango] - 1)).isoformat(),
+                    "end":    hoy.isoformat(),
+                    "bucket": ACTIVITY_BUCKETS[agrupar],
+                },
+                timeout=10,
+            )
+            if activity is not None:
+                series = activity.get("series", [])
+                if any(p["seconds"] or p["logins"] or p["docs"] for p in series):
+                    import pandas as pd
+                    df = pd.DataFrame(series)
+                    df["minutos"] = df["seconds"] / 60.0
+                    df["period"] = pd.to_datetime(df["period"])
+                    chart = (
+                        alt.Chart(df)
+                        .mark_bar(color="#3b82f6", cornerRadiusTopLeft=3, cornerRadiusTopRight=3)
+                        .encode(
+                            x=alt.X("period:T", title=agrupar),
+                            y=alt.Y("minutos:Q", title="Minutos totales"),
+                            tooltip=[
+                                alt.Tooltip("period:T", title="Desde"),
+                                alt.Tooltip("minutos:Q", title="Minutos", format=".1f"),
+                                alt.Tooltip("logins:Q", title="Inicios de sesión"),
+                                alt.Tooltip("docs:Q", title="Documentos"),
+                                alt.Tooltip("active_days:Q", title="Días activos"),
+                            ],
+                        )
+                        .properties(height=260, width="container")
+                    )
+                    st.altair_chart(chart, use_container_width=True)
+                else:
+                    st.info("Sin actividad en este periodo.")
+            else:
+                st.warning("No se pudo obtener la actividad del periodo.")
+        except Exception as e:
+            st.warning(f"Error al obtener la actividad: {e}")
+
+        rule()
+        section("▸", "Evolución del 'tú' impersonal")
+        try:
+            trend = get_json_revalidated(f"{backend_url}/users/{username}/trend", timeout=10)
+            if trend is not None:
+                if trend.get("docs", 0) >= 2:
+                    import pandas as pd
+                    df = pd.DataFrame(trend["series"])
+                    df["con_tu"] = df["has_tu"].map({True: "Con 'tú'", False: "Sin 'tú'"})
+                    base = alt.Chart(df).encode(x=alt.X("seq:Q", title="Documento nº", axis=alt.Axis(tickMinStep=1)))
+                    line = base.mark_line(color="#3b82f6", strokeWidth=2.5).encode(
+                        y=alt.Y("rolling_rate:Q", title=f"% con 'tú' (últimos {trend['window']} docs)",
+                                scale=alt.Scale(domain=[0, 100])),
+                        tooltip=[
+                            alt.Tooltip("seq:Q", title="Documento"),
+                            alt.Tooltip("day:N", title="Día"),
+                            alt.Tooltip("rolling_rate:Q", title="% móvil", format=".0f"),
+                        ],
+                    )
+                    points = base.mark_circle(size=55).encode(
+                        y=alt.Y("rolling_rate:Q"),
+                        color=alt.Color(
+                            "con_tu:N", title=None,
+                            scale=alt.Scale(domain=["Con 'tú'", "Sin 'tú'"], range=["#dc2626", "#16a34a"]),
+                        ),
+                    )
+                    st.altair_chart(
+                        (line + points).properties(height=240, width="container"),
+                        use_container_width=True,
+                    )
+                    st.caption(
+                        f"Últimos {trend['window']} documentos: {trend['recent_rate']:.0f}% con 'tú' · "
+                        f"total: {trend['rate']:.0f}% · cambio estimado: {trend['change_pp']:+.0f} puntos"
+                    )
+                else:
+                    st.info("Sube al menos dos documentos para ver tu evolución.")
+            else:
+                st.warning("No se pudo obtener la evolución.")
+        except Exception as e:
+            st.warning(f"Error al obtener la evolución: {e}")
+
         # ── Valoración global IA ───────────────────────────────────────────
         rule()
         section("◉", "Valoración global")
@@ -910,34 +1190,72 @@ def ver_mis_metricas(username, backend_url):
         else:
             cache_key_gf      = f"__cache_global_feedback_{username}"
             cache_key_gf_pend = f"__cache_global_feedback_pending_{username}"
+            cache_key_gf_job  = f"__cache_global_feedback_job_{username}"
 
             if st.button("✦ Generar valoración global", key="btn_global_feedback",
                          use_container_width=True):
                 st.session_state.pop(cache_key_gf, None)
+                st.session_state.pop(cache_key_gf_job, None)
                 st.session_state[cache_key_gf_pend] = True
                 st.rerun()
 
+            # Si la valoración está en caché llega al momento; si no, el backend
+            # devuelve un job_id y se consulta /jobs/{id} en cada rerun.
             if st.session_state.get(cache_key_gf_pend) and cache_key_gf not in st.session_state:
-                st.markdown(
-                    "<div style='text-align:center; padding:1.2rem 0; "
-                    "font-family:Nunito,sans-serif; font-weight:600; font-size:0.95rem; "
-                    "color:var(--blue);'>⏳ Generando valoración…</div>",
-                    unsafe_allow_html=True
-                )
+                rerun = False
                 try:
-                    r = requests.get(
-                        f"{backend_url}/users/{username}/global_feedback",
-                        timeout=600,
-                    )
-                    if r.ok:
-                        st.session_state[cache_key_gf] = r.json()
+                    job_id = st.session_state.get(cache_key_gf_job)
+                    if job_id is None:
+                        r = requests.get(f"{backend_url}/users/{username}/global_feedback", timeout=30)
+                        if r.status_code == 429:
+                            retry = r.headers.get("Retry-After", "unos")
+                            st.warning(f"⏳ {r.json().get('detail', '')} Vuelve a intentarlo en {retry} s.")
+                            st.session_state.pop(cache_key_gf_pend, None)
+                        elif not r.ok:
+                            st.warning("No se pudo obtener la valoración global.")
+                            st.session_state.pop(cache_key_gf_pend, None)
+                        elif r.json().get("status") == "done":
+                            st.session_state[cache_key_gf] = r.json()
+                            st.session_state.pop(cache_key_gf_pend, None)
+                            rerun = True
+                        else:
+                            st.session_state[cache_key_gf_job] = r.json().get("job_id")
+                            rerun = True
                     else:
-                        st.warning("No se pudo obtener la valoración global.")
+                        job = requests.get(f"{backend_url}/jobs/{job_id}", timeout=10).json()
+                        if job.get("status") == "done":
+                            st.session_state[cache_key_gf] = job.get("result") or {}
+                            st.session_state.pop(cache_key_gf_pend, None)
+                            st.session_state.pop(cache_key_gf_job, None)
+                            rerun = True
+                        elif job.get("status") in ("queued", "running"):
+                            label = JOB_STAGE_LABELS.get(job.get("stage"), "⏳ Generando valoración…")
+                            st.markdown(
+                                "<div style='text-align:center; padding:1.2rem 0; "
+                                "font-family:Nunito,sans-serif; font-weight:600; font-size:0.95rem; "
+                                f"color:var(--blue);'>{label}</div>",
+                                unsafe_allow_html=True
+                            )
+                            try:
+                                wait_for_events(
+                                    backend_url, username, {"job_id": job_id},
+                                    until=lambda e: e.get("type") == "job" and e.get("job_id") == job_id
+                                                    and e.get("status") in ("done", "error"),
+                                    timeout=60,
+                                )
+                            except Exception:
+                                time.sleep(2)
+                            rerun = True
+                        else:
+                            st.warning(f"No se pudo generar la valoración: {job.get('error') or job.get('detail', '')}")
+                            st.session_state.pop(cache_key_gf_pend, None)
+                            st.session_state.pop(cache_key_gf_job, None)
                 except Exception as e:
                     st.warning(f"Error al obtener la valoración: {e}")
-                finally:
                     st.session_state.pop(cache_key_gf_pend, None)
-                st.rerun()
+                    st.session_state.pop(cache_key_gf_job, None)
+                if rerun:
+                    st.rerun()
 
             if cache_key_gf in st.session_state:
                 data_gf      = st.session_state[cache_key_gf]
@@ -1003,6 +1321,16 @@ def ver_mis_metricas(username, backend_url):
                         if k in latest_by_name:
                             (cA if i % 2 == 0 else cB).metric(PRETTY[k], pretty_int(latest_by_name[k]))
 
+                if d.get("has_texts"):
+                    if st.button("📂 Reabrir", key=f"reopen_{d['id']}", use_container_width=True):
+                        try:
+                            if reopen_document(backend_url, d):
+                                st.rerun()
+                            else:
+                                st.warning("Este documento no tiene textos guardados.")
+                        except Exception as e:
+                            st.error(f"Error reabriendo: {e}")
+
                 del_flag_key = f"__confirm_del_{d['id']}"
                 if st.button("❌ Eliminar", key=f"del_{d['id']}", use_container_width=True):
                     st.session_state[del_flag_key] = True
@@ -1038,7 +1366,7 @@ def render_status(backend_url):
     if "status_message" not in st.session_state:
         st.session_state["status_message"] = "⚡ Preparando…"
 
-    st.progress(st.session_state["status_progress"])
+    bar = st.progress(st.session_state["status_progress"])
 
     if st.session_state["modelo_listo"]:
         st.success("✅ Modelo cargado y listo para subir PDFs")
@@ -1048,7 +1376,8 @@ def render_status(backend_url):
     st.session_state["modelo_listo"]  = bool(estado.get("modelo_listo"))
     st.session_state["status_progress"] = int(estado.get("progress", 0))
     st.session_state["status_message"]  = estado.get("message", "")
-    st.info(st.session_state["status_message"] or "⚡ Cargando…")
+    info = st.empty()
+    info.info(st.session_state["status_message"] or "⚡ Cargando…")
 
     if st.button("🔄 Actualizar estado", key="btn_status_refresh_main", use_container_width=True):
         estado = fetch_status(backend_url, timeout=5)
@@ -1056,6 +1385,29 @@ def render_status(backend_url):
         st.session_state["status_progress"] = int(estado.get("progress", 0))
         st.session_state["status_message"]  = estado.get("message", "")
 
+    # El progreso de carga llega por WebSocket: se va mostrando y al terminar
+    # se recarga la página sin tener que pulsar "Actualizar estado". La espera
+    # es corta (STATUS_WAIT_SECS) y después se vuelve a ejecutar el script
+    # igualmente, para no bloquear la sesión de Streamlit durante toda la carga
+    def show(event):
+        if event.get("type") == "model":
+            st.session_state["modelo_listo"]    = bool(event.get("modelo_listo"))
+            st.session_state["status_progress"] = int(event.get("progress", 0))
+            st.session_state["status_message"]  = event.get("message", "")
+            bar.progress(st.session_state["status_progress"])
+            info.info(st.session_state["status_message"] or "⚡ Cargando…")
+
+    if st.session_state.get("usuario"):
+        try:
+            wait_for_events(
+                backend_url, st.session_state["usuario"], {},
+                until=lambda e: e.get("type") == "model" and e.get("modelo_listo"),
+                on_event=show, timeout=STATUS_WAIT_SECS,
+            )
+        except Exception:
+            time.sleep(STATUS_WAIT_SECS)    # sin WebSocket: polling de /status/ en cada rerun
+        st.rerun()
+
     st.stop()
 
 
@@ -1201,10 +1553,9 @@ def main_app():
             with st.spinner("Analizando el PDF..."):
                 files = {'file': (uploaded_file.name, file_bytes, "application/pdf")}
                 data = {'username': st.session_state["usuario"]}
-                response = requests.post(f"{backend_url}/process/", files=files, data=data, timeout=600)
+                data, error = run_processing_job(backend_url, data, files=files)
 
-            if response.status_code == 200:
-                data = response.json()
+            if error is None:
                 st.session_state["last_input_digest"] = digest
                 st.session_state["last_pdf_name"] = uploaded_file.name
                 st.session_state["last_doc_id"] = data.get("doc_id")
@@ -1217,11 +1568,7 @@ def main_app():
                 st.session_state["edited_text_area"] = st.session_state["last_analysis"]["corrected_text"]
                 st.session_state["__edited_for_doc"] = st.session_state["last_doc_id"]
             else:
-                st.error(f"❌ Error al procesar el PDF (código {response.status_code})")
-                try:
-                    st.code(response.text, language="json")
-                except Exception:
-                    st.write(response.text)
+                st.error(f"❌ Error al procesar el PDF: {error}")
                 st.stop()
 
     else:
@@ -1247,10 +1594,9 @@ def main_app():
                             'text': texto_plano,
                             'filename': nombre_doc_norm,
                         }
-                        response = requests.post(f"{backend_url}/process_text/", data=data, timeout=600)
+                        resp, error = run_processing_job(backend_url, data)
 
-                    if response.status_code == 200:
-                        resp = response.json()
+                    if error is None:
                         st.session_state["last_input_digest"] = digest
                         st.session_state["last_pdf_name"] = nombre_doc_norm
                         st.session_state["last_doc_id"] = resp.get("doc_id")
@@ -1263,11 +1609,7 @@ def main_app():
                         st.session_state["edited_text_area"] = st.session_state["last_analysis"]["corrected_text"]
                         st.session_state["__edited_for_doc"] = st.session_state["last_doc_id"]
                     else:
-                        st.error(f"❌ Error al procesar el texto (código {response.status_code})")
-                        try:
-                            st.code(response.text, language="json")
-                        except Exception:
-                            st.write(response.text)
+                        st.error(f"❌ Error al procesar el texto: {error}")
                         st.stop()
 
     tabs = st.tabs(["📄 Análisis actual", "📊 Métricas globales"])
@@ -1342,9 +1684,16 @@ def main_app():
                                 feedback_text = "No se pudo generar el feedback. Inténtalo de nuevo."
                                 st.session_state[fb_cache_key] = True
                             else:
-                                # Aún pending → mostrar spinner y rerun en 4s
+                                # Aún pending → esperar el aviso por WebSocket (4 s si no hay) y rerun
                                 with st.spinner("Generando feedback pedagógico…"):
-                                    time.sleep(4)
+                                    try:
+                                        wait_for_events(
+                                            backend_url, st.session_state["usuario"], {"doc_id": _doc_v},
+                                            until=lambda e: e.get("type") == "feedback" and e.get("doc_id") == _doc_v,
+                                            timeout=60,
+                                        )
+                                    except Exception:
+                                        time.sleep(4)
                                 st.rerun()
                     except Exception:
                         pass  # si el backend no responde, simplemente no mostrar nada aún
@@ -1365,8 +1714,9 @@ def main_app():
                 edited_now = st.session_state.get("edited_text_area", "")
                 changes_now = word_levenshtein_count(original_joined or "", edited_now or "")
                 last_saved = st.session_state.get(f"__last_saved_changes_{st.session_state.get('last_doc_id')}")
-                if last_saved is None or int(last_saved) != int(changes_now):
-                    _post_user_changes(backend_url, st.session_state["last_doc_id"], int(changes_now))
+                last_text = st.session_state.get(f"__last_saved_text_{st.session_state.get('last_doc_id')}")
+                if last_saved is None or int(last_saved) != int(changes_now) or last_text != edited_now:
+                    _post_user_changes(backend_url, st.session_state["last_doc_id"], int(changes_now), edited_now)
 
             edited_text = st.text_area(
                 "Tu versión final",
@@ -0,0 +1,102 @@
+# tests/conftest.py
+import importlib
+import os
+import sys
+import tempfile
+import types
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+
+# ── Entorno de pruebas ─────────────────────────────────────────────────────────
+# La DB va a un directorio temporal y el mantenimiento periódico no arranca.
+# Se fija antes de importar backend.*, que lee el entorno al importarse.
+
+os.environ.setdefault("DB_PATH", str(Path(tempfile.mkdtemp(prefix="palabria-tests-")) / "palabria.db"))
+os.environ.setdefault("PALABRIA_MAINTENANCE_SECS", "0")
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+# Las pruebas no cargan el modelo ni spaCy (los sustituyen por funciones
+# falsas). Si torch, transformers, spaCy, pdfplumber o rapidfuzz no están
+# instalados se registran módulos mínimos para que backend.* se pueda importar.
+
+def _fallback(name: str, **attrs):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+_fallback(
+    "torch",
+    inference_mode=lambda: (lambda fn: fn),
+    cuda=types.SimpleNamespace(is_available=lambda: False, empty_cache=lambda: None),
+    bfloat16="bfloat16",
+    set_num_threads=lambda n: None,
+    set_num_interop_threads=lambda n: None,
+)
+_fallback("transformers", AutoTokenizer=object, AutoModelForCausalLM=object, BitsAndBytesConfig=object)
+_fallback("pdfplumber")
+_fallback("rapidfuzz")
+_fallback("rapidfuzz.distance", Levenshtein=types.SimpleNamespace(distance=lambda a, b: 0))
+try:
+    import spacy
+    spacy.util.get_package_path("es_core_news_lg")
+except (ImportError, ModuleNotFoundError):
+    sys.modules["spacy"] = types.ModuleType("spacy")
+    sys.modules["spacy"].load = lambda *a, **k: None
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """La DB por defecto; en el servidor la crea el lifespan de backend.main."""
+    import backend.db as db
+    db.init_db()
+    yield
+    db.flush_writes()
+
+
+@pytest.fixture
+def isolated_db(monkeypatch, tmp_path):
+    """
+    Base propia de la prueba en tmp_path (con su directorio de shards).
+    Devuelve init(mode) que fija DB_SHARDING y ejecuta init_db; llamarla
+    otra vez con "bucket" o "user" reparte en shards lo ya escrito.
+    """
+    import backend.db as db
+
+    db.flush_writes()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "palabria.db"))
+    monkeypatch.setattr(db, "DB_SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(db, "DB_SHARDS", 4)
+    monkeypatch.setattr(db, "_default", None)
+    monkeypatch.setattr(db, "_shards", OrderedDict())
+    monkeypatch.setattr(db, "_initialized", set())
+    monkeypatch.setattr(db, "_block_keys", {})
+    monkeypatch.setattr(db, "_shard_stats", {"opened": 0, "evicted": 0})
+    monkeypatch.setattr(db, "_uid_cache", {})
+
+    def init(mode: str = "off"):
+        db.flush_writes()
+        monkeypatch.setattr(db, "DB_SHARDING", mode)
+        db.init_db()
+        return db
+
+    yield init
+    db.flush_writes()
+    for sh in [db._default, *db._shards.values()]:
+        if sh is not None:
+            sh.close()
@@ -0,0 +1,80 @@
+# tests/test_activity_api.py
+import httpx
+import pytest
+
+import backend.main as main
+
+
+# Un día por potencia de dos: cada suma de docs identifica qué días entraron
+DAYS = {
+    "2024-01-28": 1,      # domingo
+    "2024-01-29": 2,      # lunes
+    "2024-01-31": 4,
+    "2024-02-01": 8,
+    "2024-02-04": 16,     # domingo
+    "2024-02-05": 32,     # lunes
+    "2024-12-31": 64,
+    "2025-01-01": 128,
+}
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+@pytest.fixture
+def activity(isolated_db):
+    db = isolated_db("off")
+    uid = db.create_user("ana")
+    for day, docs in DAYS.items():
+        db.write(db._bump_daily, uid, day, 60.0, 1, docs)
+    return db
+
+
+async def _series(client, **params) -> list:
+    r = await client.get("/users/ana/activity", params=params)
+    assert r.status_code == 200, r.text
+    return [(p["period"], p["docs"], p["active_days"]) for p in r.json()["series"]]
+
+
+# ── Límites de los buckets ─────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_bucket_boundaries(activity):
+    async with _client() as client:
+        assert await _series(client, start="2024-01-28", end="2024-01-30", bucket="day") == [
+            ("2024-01-28", 1, 1), ("2024-01-29", 2, 1), ("2024-01-30", 0, 0),
+        ]
+        # Las semanas empiezan en lunes; la primera arranca antes de start
+        assert await _series(client, start="2024-01-28", end="2024-02-05", bucket="week") == [
+            ("2024-01-22", 1, 1), ("2024-01-29", 30, 4), ("2024-02-05", 32, 1),
+        ]
+        # ...pero solo suma los días dentro del rango
+        assert await _series(client, start="2024-01-31", end="2024-02-04", bucket="week") == [
+            ("2024-01-29", 28, 3),
+        ]
+        assert await _series(client, start="2024-01-28", end="2024-02-05", bucket="month") == [
+            ("2024-01-01", 7, 3), ("2024-02-01", 56, 3),
+        ]
+        # Cambio de año
+        assert await _series(client, start="2024-12-15", end="2025-01-15", bucket="month") == [
+            ("2024-12-01", 64, 1), ("2025-01-01", 128, 1),
+        ]
+        assert await _series(client, start="2024-12-29", end="2025-01-01", bucket="week") == [
+            ("2024-12-23", 0, 0), ("2024-12-30", 192, 2),
+        ]
+        r = await client.get("/users/ana/activity", params={"start": "2024-01-28", "end": "2024-02-05", "bucket": "week"})
+    assert r.json()["totals"] == {"seconds": 360.0, "logins": 6, "docs": 63, "active_days": 6}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("params", [
+    {"bucket": "year"},
+    {"start": "2024-02-05", "end": "2024-01-28"},
+    {"start": "2020-01-01", "end": "2024-01-01"},
+    {"start": "2024-13-01"},
+])
+async def test_bad_ranges_are_400(activity, params):
+    async with _client() as client:
+        r = await client.get("/users/ana/activity", params=params)
+    assert r.status_code == 400, r.text
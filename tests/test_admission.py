@@ -0,0 +1,77 @@
+# tests/test_admission.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import backend.admission as admission
+
+
+# ── Token buckets por usuario ──────────────────────────────────────────────────
+
+def test_full_idle_buckets_are_pruned(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(admission, "_user_buckets", {})
+    monkeypatch.setattr(admission, "_last_prune", 0.0)
+    horizon = admission.USER_BURST / (admission.USER_RATE_PER_MIN / 60.0)
+
+    assert admission._take_token("ana") == 0
+    for _ in range(int(admission.USER_BURST)):
+        admission._take_token("beto")       # beto agota su ráfaga
+    assert admission._take_token("beto") > 0
+
+    clock[0] += horizon - 1
+    assert admission._take_token("carla") == 0
+    assert set(admission._user_buckets) == {"ana", "beto", "carla"}     # aún no toca barrer
+
+    # Pasado el horizonte: ana y beto ya estarían llenos, carla no
+    clock[0] += 2
+    assert admission._take_token("dani") == 0
+    assert set(admission._user_buckets) == {"carla", "dani"}
+
+    # Volver tras el borrado da la misma ráfaga que si el bucket siguiera ahí
+    for _ in range(int(admission.USER_BURST)):
+        assert admission._take_token("beto") == 0
+    assert admission._take_token("beto") > 0
+
+
+# ── Espera de baja prioridad ───────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_wait_idle_returns_once_the_class_drains():
+    ticket = admission.reserve("correction", "idle-a")
+    waiter = asyncio.ensure_future(admission.wait_idle("correction", max_wait=5))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    ticket.release()
+    assert await asyncio.wait_for(waiter, 1) is True
+    assert admission.CLASSES["correction"].idle_waiters == []
+
+
+@pytest.mark.anyio
+async def test_wait_idle_is_not_starved_by_a_steady_stream():
+    stop = asyncio.Event()
+
+    async def stream(current):
+        # Cada corrección nueva entra antes de que acabe la anterior
+        i = 0
+        while not stop.is_set():
+            await asyncio.sleep(0.02)
+            i += 1
+            nxt = admission.reserve("correction", f"stream-{i}")
+            current.release()
+            current = nxt
+        current.release()
+
+    feeder = asyncio.ensure_future(stream(admission.reserve("correction", "stream-0")))
+    try:
+        started = time.monotonic()
+        assert await admission.wait_idle("correction", max_wait=0.2) is False
+        assert 0.2 <= time.monotonic() - started < 1.0
+        assert admission.CLASSES["correction"].idle_waiters == []
+    finally:
+        stop.set()
+        await feeder
+    assert admission.CLASSES["correction"].idle()
@@ -0,0 +1,34 @@
+# tests/test_app.py
+import threading
+
+import pytest
+
+import backend.main as main
+import backend.maintenance as maintenance
+import backend.presence as presence
+
+
+def _threads() -> set:
+    return {t.name for t in threading.enumerate() if t.name.startswith("palabria-")}
+
+
+# ── Arranque y parada ──────────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_lifespan_starts_and_stops_background_work(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    monkeypatch.setattr(maintenance, "INTERVAL", 3600.0)
+    assert not _threads() & {"palabria-presence", "palabria-maintenance"}     # importar no arranca nada
+
+    async with main.app.router.lifespan_context(main.app):
+        assert {"palabria-presence", "palabria-maintenance"} <= _threads()
+        uid = db.create_user("ana")
+        db.record_login_ts(uid, 1000.0)
+        presence.touch(uid, 1500.0)
+
+    for t in (presence._thread, maintenance._thread):
+        t.join(2)
+        assert not t.is_alive()
+    # La parada vuelca los latidos pendientes
+    with db.user_db(uid) as con:
+        assert con.execute("SELECT last_seen FROM sessions WHERE user_id=?", (uid,)).fetchone()[0] == 1500.0
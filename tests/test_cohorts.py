@@ -0,0 +1,69 @@
+# tests/test_cohorts.py
+import sqlite3
+import uuid
+
+import httpx
+import pytest
+
+import backend.cohorts as cohorts
+import backend.db as db
+import backend.main as main
+import backend.shared as shared
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+@pytest.fixture
+def cohort():
+    name = "clase-" + uuid.uuid4().hex[:8]
+    users = ["c" + uuid.uuid4().hex[:10] for _ in range(2)]
+    for u in users:
+        db.create_user(u)
+        db.create_document(db.get_user_id(u), "a.txt", uuid.uuid4().hex)
+    cohorts.set_members(name, users)
+    return name, users
+
+
+# ── Panel de cohortes ──────────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_dashboard_requires_admin_token(monkeypatch, cohort):
+    name, _users = cohort
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secreto")
+    async with _client() as client:
+        assert (await client.get(f"/cohorts/{name}/dashboard")).status_code == 403
+        r = await client.get(f"/cohorts/{name}/dashboard", headers={"X-Admin-Token": "otro"})
+        assert r.status_code == 403
+        r = await client.get(f"/cohorts/{name}/dashboard", headers={"X-Admin-Token": "secreto"})
+    assert r.status_code == 200
+    assert r.json()["total_docs"] == 2
+
+
+def test_write_in_another_worker_invalidates_the_cache(cohort):
+    name, users = cohort
+    assert cohorts.get_dashboard(name)["total_docs"] == 2
+    hits = cohorts.get_stats()["hits"]
+    assert cohorts.get_dashboard(name)["total_docs"] == 2
+    assert cohorts.get_stats()["hits"] == hits + 1
+
+    # Otro worker escribe: la fila cambia en la DB y sube la versión compartida,
+    # pero el hook de este proceso no se entera
+    uid = db.get_user_id(users[0])
+    con = sqlite3.connect(db.DB_PATH)
+    with con:
+        con.execute("UPDATE user_stats SET docs = docs + 3 WHERE user_id=?", (uid,))
+    con.close()
+    shared._on_write({uid})
+
+    assert cohorts.get_dashboard(name)["total_docs"] == 5
+
+
+def test_membership_change_elsewhere_invalidates_the_cache(cohort):
+    name, users = cohort
+    assert cohorts.get_dashboard(name)["students"] == 2
+    db.remove_cohort_member(name, users[1])     # sin pasar por cohorts.remove_member
+    dash = cohorts.get_dashboard(name)
+    assert dash["students"] == 1
+    assert [s["username"] for s in dash["per_student"]] == [users[0]]
@@ -0,0 +1,85 @@
+# tests/test_db_blobs.py
+import sqlite3
+import zlib
+
+import pytest
+
+
+def _blobs(path: str) -> dict:
+    con = sqlite3.connect(path)
+    try:
+        return dict(con.execute("SELECT hash, refs FROM blobs").fetchall())
+    finally:
+        con.close()
+
+
+def _doc(db, uid: int, name: str, original: str, corrected: str) -> int:
+    return db.create_document(
+        uid, name, f"hash-{name}",
+        texts={"original": original, "corrected": corrected},
+    )
+
+
+@pytest.mark.parametrize("mode", ["off", "bucket"])
+def test_same_text_shares_one_blob_until_the_last_document_goes(isolated_db, mode):
+    db = isolated_db(mode)
+    uid = db.create_user("ana")
+    texto, corregido = "Si tú lees, aprendes.", "Si uno lee, aprende."
+    h_texto, h_corregido = db.pack_text(texto)[0], db.pack_text(corregido)[0]
+    path = db._shard_path(db.shard_key(uid)) if mode == "bucket" else db.DB_PATH
+
+    a = _doc(db, uid, "a.txt", texto, corregido)
+    b = _doc(db, uid, "b.txt", texto, corregido)
+    assert _blobs(path) == {h_texto: 2, h_corregido: 2}
+    assert db.get_document_texts(a)["original_text"] == db.get_document_texts(b)["original_text"] == texto
+
+    # Una versión final distinta suma su blob; repetirla no cambia nada
+    db.set_final_text(a, "Si uno lee mucho, aprende.")
+    db.set_final_text(a, "Si uno lee mucho, aprende.")
+    h_final = db.pack_text("Si uno lee mucho, aprende.")[0]
+    assert _blobs(path) == {h_texto: 2, h_corregido: 2, h_final: 1}
+
+    # Reemplazarla suelta la anterior
+    db.set_final_text(a, corregido)
+    assert _blobs(path) == {h_texto: 2, h_corregido: 3}
+
+    assert db.delete_document(a)
+    assert _blobs(path) == {h_texto: 1, h_corregido: 1}
+    assert db.get_document_texts(b)["corrected_text"] == corregido
+
+    assert db.delete_document(b)
+    assert _blobs(path) == {}
+
+
+def test_delete_user_collects_its_blobs(isolated_db):
+    db = isolated_db("off")
+    ana, beto = db.create_user("ana"), db.create_user("beto")
+    compartido = "Si tú lees, aprendes."
+    _doc(db, ana, "a.txt", compartido, "Solo de Ana.")
+    b = _doc(db, beto, "b.txt", compartido, "Solo de Beto.")
+
+    assert db.delete_user("ana")
+    assert _blobs(db.DB_PATH) == {
+        db.pack_text(compartido)[0]: 1,
+        db.pack_text("Solo de Beto.")[0]: 1,
+    }
+    assert db.get_document_texts(b)["original_text"] == compartido
+
+
+def test_blobs_keep_their_codec(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    uid = db.create_user("ana")
+    texto = "Si tú lees, aprendes. " * 50
+
+    digest, codec, raw_size, data = db.pack_text(texto)
+    assert raw_size == len(texto.encode("utf-8")) and len(data) < raw_size
+    assert db._unpack(codec, data) == texto
+
+    # Un blob zlib se sigue leyendo aunque el proceso tenga zstandard
+    with monkeypatch.context() as m:
+        m.setattr(db, "zstandard", None)
+        assert db.pack_text(texto)[1] == "zlib"
+        assert zlib.decompress(db.pack_text(texto)[3]).decode("utf-8") == texto
+        doc_id = _doc(db, uid, "a.txt", texto, texto.upper())
+    assert db.get_document_texts(doc_id)["original_text"] == texto
+    assert db.get_blob_stats()["blobs"] == 2
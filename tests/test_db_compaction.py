@@ -0,0 +1,60 @@
+# tests/test_db_compaction.py
+import time
+
+
+def _old_event(con, user_id: int, event: str, value, days_ago: float):
+    con.execute(
+        "INSERT INTO usage_stats(user_id, event, value, created_at) VALUES(?,?,?, datetime('now', ?))",
+        (user_id, event, value, f"-{days_ago} days"),
+    )
+
+
+def _snapshot(db, uid: int) -> dict:
+    ov = db.get_user_overview(uid)
+    return {
+        "login_days":          ov["login_days"],
+        "avg_session_seconds": ov["avg_session_seconds"],
+        "usage":               ov["usage"],
+        "weekly_activity":     db.get_user_weekly_activity(uid),
+    }
+
+
+# ── Compactación de eventos de uso ─────────────────────────────────────────────
+
+def test_compaction_keeps_login_days_sessions_and_weekly_activity(isolated_db):
+    db = isolated_db("off")
+    uid = db.create_user("alumno")
+    other = db.create_user("otro")
+
+    def seed(con):
+        for days_ago in (200, 200, 150, 121, 120):
+            _old_event(con, uid, "login", None, days_ago)
+        for days_ago, value in ((199, 3.0), (130, None), (100, 5.0)):
+            _old_event(con, uid, "pdf_download", value, days_ago)
+        _old_event(con, other, "login", None, 110)
+        for days_ago in (10, 1):
+            _old_event(con, uid, "login", None, days_ago)
+        db.rebuild_user_stats(con)      # filas escritas a mano: rollups desde las tablas crudas
+        db.rebuild_daily_activity(con)
+
+    db.write(seed)
+    now = time.time()
+    db.record_login_ts(uid, now - 300)
+    db.close_open_session(uid, now - 100)
+    db.flush_writes()
+    before = _snapshot(db, uid)
+    assert before["login_days"] == 6
+
+    removed = db.compact_usage(retention_days=90, batch_size=3)
+    assert removed == 9
+    with db.db() as con:
+        assert con.execute("SELECT COUNT(*) FROM usage_stats").fetchone()[0] == 2
+        assert con.execute("SELECT COUNT(*) FROM usage_daily").fetchone()[0] > 0
+
+    assert _snapshot(db, uid) == before
+    # Los rollups recalculados desde usage_stats + usage_daily dan lo mismo
+    db.write(db.rebuild_user_stats)
+    db.write(db.rebuild_daily_activity)
+    assert _snapshot(db, uid) == before
+    assert db.check_user_stats(repair=False)["mismatched"] == []
+    assert db.compact_usage(retention_days=90) == 0
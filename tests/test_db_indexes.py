@@ -0,0 +1,65 @@
+# tests/test_db_indexes.py
+import pytest
+
+import backend.db as db
+
+
+# ── Índices de las consultas calientes (migración 1) ───────────────────────────
+
+@pytest.fixture(scope="module")
+def con():
+    db.init_db()
+    with db.db() as con:
+        yield con
+
+
+def _plan(con, sql: str, params: tuple) -> list:
+    return [row["detail"] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def _assert_uses(plan: list, table: str, index: str):
+    assert any(index in step for step in plan), plan
+    assert not any(step.startswith(f"SCAN {table}") for step in plan), plan
+
+
+def test_usage_by_user_and_event_uses_index(con):
+    plan = _plan(con, "SELECT COUNT(*) FROM usage_stats WHERE user_id=? AND event=?", (1, "login"))
+    _assert_uses(plan, "usage_stats", "idx_usage_user_event")
+
+    plan = _plan(con, db._USAGE_EVENTS_SELECT.format(where="WHERE user_id = ?"), (1, 1))
+    _assert_uses(plan, "usage_stats", "idx_usage_user_event")
+
+
+def test_metrics_by_document_uses_index(con):
+    # Métricas extra de un documento (get_document_metrics) e historial completo
+    plan = _plan(con, f"""
+        SELECT metric_name, metric_value, created_at
+        FROM metrics
+        WHERE document_id=?
+          AND metric_name NOT IN ({",".join("?" * len(db.DOCUMENT_METRIC_COLUMNS))})
+        ORDER BY id
+    """, (1, *db.DOCUMENT_METRIC_COLUMNS))
+    _assert_uses(plan, "metrics", "idx_metrics_doc_name")
+
+    plan = _plan(con, "SELECT metric_name, metric_value FROM metrics WHERE document_id=? ORDER BY id", (1,))
+    _assert_uses(plan, "metrics", "idx_metrics_doc_name")
+
+
+def test_metrics_by_document_and_name_uses_index(con):
+    # Con las dos columnas fijadas, idx_metrics_doc_name e idx_metrics_name_doc
+    # sirven igual (mismas columnas, mismo orden por id): vale cualquiera
+    plan = _plan(con, """
+        SELECT metric_name, metric_value, created_at
+        FROM metrics WHERE document_id=? AND metric_name=? ORDER BY id
+    """, (1, "cambios_realizados_usuario"))
+    assert any("idx_metrics_doc_name" in step or "idx_metrics_name_doc" in step for step in plan), plan
+    assert not any(step.startswith("SCAN metrics") or "TEMP B-TREE" in step for step in plan), plan
+
+
+def test_documents_by_user_uses_index(con):
+    plan = _plan(con, """
+        SELECT id, filename, uploaded_at FROM documents
+        WHERE user_id=? ORDER BY id DESC
+    """, (1,))
+    _assert_uses(plan, "documents", "idx_documents_user")
+    assert not any("TEMP B-TREE" in step for step in plan), plan
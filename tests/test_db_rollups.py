@@ -0,0 +1,108 @@
+# tests/test_db_rollups.py
+import pytest
+
+
+# ── Métricas en la vista general ───────────────────────────────────────────────
+
+def test_overview_keeps_metrics_without_a_column(isolated_db):
+    db = isolated_db("off")
+    uid = db.create_user("alumno")
+    d1 = db.create_document(uid, "a.txt", "h1", metrics={"total_frases": 4, "custom": 2.0})
+    db.create_document(uid, "b.txt", "h2", metrics={"total_frases": 2, "custom": 6.0})
+    db.create_document(uid, "c.txt", "h3", metrics={"total_frases": 3})
+    db.insert_metric(d1, "custom", 4.0)          # cuenta el último valor del documento
+    db.insert_metric(d1, "otra", 1.5)
+
+    avg = db.get_user_overview(uid)["avg_metrics"]
+    assert avg["custom"] == pytest.approx(5.0)
+    assert avg["otra"] == pytest.approx(1.5)
+    assert avg["total_frases"] == pytest.approx(3.0)
+    assert list(avg) == sorted(avg)
+
+
+# ── Rollups frente a las tablas crudas ─────────────────────────────────────────
+
+def _baseline_overview(docs: dict, events: list, sessions: list) -> dict:
+    """
+    Lo que calculaba la consulta original sobre las tablas crudas, a partir de
+    lo que la prueba escribió: docs = doc_id → métricas vigentes, events =
+    [(evento, valor)], sessions = [duración].
+    """
+    n = len(docs)
+    names = sorted({k for m in docs.values() for k in m})
+    avg = {k: sum(m[k] for m in docs.values() if k in m) / sum(1 for m in docs.values() if k in m) for k in names}
+    with_tu = sum(1 for m in docs.values() if m.get("frases_con_tu_impersonal", 0) > 0)
+    no_changes = sum(1 for m in docs.values() if m.get("cambios_realizados_usuario", 0) == 0)
+    usage = {}
+    for event in sorted({e for e, _ in events}):
+        values = [v for e, v in events if e == event and v is not None]
+        usage[event] = {
+            "count": sum(1 for e, _ in events if e == event),
+            "avg":   sum(values) / len(values) if values else None,
+        }
+    usage["session_duration"] = {
+        "count": len(sessions),
+        "avg":   sum(sessions) / len(sessions) if sessions else None,
+    }
+    return {
+        "docs": n,
+        "avg_metrics": avg,
+        "usage": usage,
+        "login_days": 1 if any(e == "login" for e, _ in events) else 0,
+        "docs_with_tu_percent": round(with_tu * 100.0 / n, 1) if n else 0.0,
+        "docs_no_changes_percent": round(no_changes * 100.0 / n, 1) if n else 0.0,
+        "avg_session_seconds": sum(sessions) / len(sessions) if sessions else 0.0,
+    }
+
+
+def test_rollups_match_raw_tables_after_edits_and_deletes(isolated_db):
+    db = isolated_db("off")
+    uid = db.create_user("alumno")
+    other = db.create_user("otro")
+
+    docs, events, sessions = {}, [], []
+    for i, m in enumerate((
+        {"total_frases": 5, "frases_con_tu_impersonal": 2, "cambios_realizados_usuario": 1, "custom": 1.0},
+        {"total_frases": 3, "frases_con_tu_impersonal": 0, "cambios_realizados_usuario": 0},
+        {"total_frases": 4, "frases_con_tu_impersonal": 1, "cambios_realizados_usuario": 2},
+        {"total_frases": 6, "frases_con_tu_impersonal": 3},
+    )):
+        doc_id = db.create_document(uid, f"d{i}.txt", f"h{i}", metrics=m, event="process_text")
+        docs[doc_id] = dict(m)
+        events.append(("process_text", None))
+    d1, d2, d3, d4 = docs
+    db.create_document(other, "o.txt", "ho", metrics={"total_frases": 9, "frases_con_tu_impersonal": 9})
+
+    # Ediciones: el usuario cambia su versión, métricas que se sobrescriben
+    db.set_document_metrics(d2, {"cambios_realizados_usuario": 3})
+    db.insert_metric(d1, "frases_con_tu_impersonal", 0)
+    db.insert_metric(d4, "custom", 5.0)
+    docs[d2]["cambios_realizados_usuario"] = 3
+    docs[d1]["frases_con_tu_impersonal"] = 0
+    docs[d4]["custom"] = 5.0
+
+    assert db.delete_document(d3)
+    del docs[d3]
+
+    for event, value in (("login", None), ("login", None), ("pdf_download", 2.0), ("pdf_download", 4.0)):
+        db.record_usage(uid, event, value)
+        events.append((event, value))
+    for start, length in ((1_000.0, 120.0), (2_000.0, 60.0)):
+        db.record_login_ts(uid, start)
+        db.touch_session(uid, start + length / 2)
+        db.close_open_session(uid, start + length)
+        sessions.append(length)
+    db.record_login_ts(other, 5_000.0)
+    db.record_usage(other, "login")
+
+    db.flush_writes()
+    assert db.check_user_stats(repair=False)["mismatched"] == []
+    assert db.delete_user("otro")
+    db.flush_writes()
+
+    check = db.check_user_stats(repair=False)
+    assert check == {"users": 1, "mismatched": [], "repaired": False}
+    overview = db.get_user_overview(uid)
+    expected = _baseline_overview(docs, events, sessions)
+    assert overview.pop("avg_metrics") == pytest.approx(expected.pop("avg_metrics"))
+    assert overview == expected
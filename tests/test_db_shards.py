@@ -0,0 +1,148 @@
+# tests/test_db_shards.py
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+
+def _count(path: str, sql: str, params: tuple = ()) -> int:
+    con = sqlite3.connect(path)
+    try:
+        return con.execute(sql, params).fetchone()[0]
+    finally:
+        con.close()
+
+
+def _user_with_doc(db, username: str, text: str = "Si tú lees, aprendes.") -> tuple:
+    uid = db.create_user(username)
+    doc_id = db.create_document(
+        uid, f"{username}.txt", f"hash-{username}",
+        metrics={"total_frases": 2, "frases_con_tu_impersonal": 1, "custom": 4.0},
+        event="process_text",
+        texts={"original": text, "corrected": text.replace("tú", "uno")},
+    )
+    return uid, doc_id
+
+
+# ── Reparto inicial ────────────────────────────────────────────────────────────
+
+def test_split_moves_rows_out_of_the_directory(isolated_db):
+    db = isolated_db("off")
+    before = {}
+    for i in range(4):
+        uid, doc_id = _user_with_doc(db, f"alumno{i}", f"Texto {i}: si tú lees, aprendes.")
+        before[uid] = (doc_id, db.get_user_documents(uid), db.get_document_texts(doc_id), db.get_document_metrics(doc_id))
+    db.flush_writes()
+
+    db = isolated_db("bucket")
+
+    for uid, (doc_id, docs, texts, metrics) in before.items():
+        assert db.get_user_documents(uid) == docs
+        assert db.get_document_texts(doc_id) == texts
+        assert db.get_document_metrics(doc_id) == metrics
+        shard = db._shard_path(db.shard_key(uid))
+        assert _count(shard, "SELECT COUNT(*) FROM documents WHERE user_id=?", (uid,)) == 1
+
+    for table in db.SHARD_TABLES_BY_USER + db.SHARD_TABLES_BY_DOC + ("blobs",):
+        assert _count(db.DB_PATH, f"SELECT COUNT(*) FROM {table}") == 0, table
+    assert _count(db.DB_PATH, "SELECT COUNT(*) FROM doc_directory") == 4
+    assert _count(db.DB_PATH, "SELECT COUNT(*) FROM users") == 4
+
+    db.init_db()        # ya repartida: no vuelve a copiar ni borra nada
+    assert all(db.get_user_documents(uid) == docs for uid, (_, docs, _, _) in before.items())
+
+
+def test_split_refuses_a_different_layout(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    _user_with_doc(db, "alumno")
+    db = isolated_db("bucket")
+    monkeypatch.setattr(db, "DB_SHARDS", 8)
+    with pytest.raises(RuntimeError, match="re-sharding"):
+        db.init_db()
+
+
+# ── Enrutado de documentos ─────────────────────────────────────────────────────
+
+def test_document_lookup_in_another_shard(isolated_db):
+    db = isolated_db("bucket")
+    uid_a, doc_a = _user_with_doc(db, "ana", "Ana: si tú lees, aprendes.")
+    uid_b, doc_b = _user_with_doc(db, "beto", "Beto: si tú corres, llegas.")
+    assert db.shard_key(uid_a) != db.shard_key(uid_b)
+
+    db._block_keys.clear()      # como otro proceso: bloque → shard se lee del directorio
+    assert db.get_document_texts(doc_b)["original_text"] == "Beto: si tú corres, llegas."
+    assert db.get_document_texts(doc_a)["original_text"] == "Ana: si tú lees, aprendes."
+    assert db._shard_for_doc(doc_b).path == db._shard_path(db.shard_key(uid_b))
+    assert db.get_document_texts(doc_b + 10 * db.DOC_ID_BLOCK) is None
+
+
+def test_doc_id_blocks(isolated_db):
+    db = isolated_db("off")
+    _, legacy = _user_with_doc(db, "antiguo")
+    db = isolated_db("bucket")
+    assert db.get_document_texts(legacy) is not None        # por doc_directory
+
+    uid_a, doc_a = _user_with_doc(db, "ana")
+    uid_b, doc_b = _user_with_doc(db, "beto")
+    assert doc_a // db.DOC_ID_BLOCK > legacy // db.DOC_ID_BLOCK
+    assert doc_a // db.DOC_ID_BLOCK != doc_b // db.DOC_ID_BLOCK
+
+    # Agotar el bloque de un shard: reserva otro, también suyo
+    sh = db._shard_for_user(uid_a)
+    sh._next_id = sh._end_id - 1
+    last = db.create_document(uid_a, "x.txt", "h1")
+    nxt = db.create_document(uid_a, "y.txt", "h2")
+    assert nxt // db.DOC_ID_BLOCK != last // db.DOC_ID_BLOCK
+    with db.db() as con:
+        blocks = dict(con.execute("SELECT block, shard_key FROM doc_blocks").fetchall())
+    for doc_id, uid in ((doc_a, uid_a), (doc_b, uid_b), (last, uid_a), (nxt, uid_a)):
+        assert blocks[doc_id // db.DOC_ID_BLOCK] == db.shard_key(uid)
+    assert legacy // db.DOC_ID_BLOCK not in blocks             # los anteriores al reparto no tienen bloque
+    assert len({doc_a, doc_b, last, nxt, legacy}) == 5
+
+
+# ── LRU de shards abiertos ─────────────────────────────────────────────────────
+
+def test_evicting_a_shard_still_in_use(isolated_db, monkeypatch):
+    db = isolated_db("bucket")
+    monkeypatch.setattr(db, "SHARD_MAX_OPEN", 1)
+    uid_a, doc_a = _user_with_doc(db, "ana")
+    uid_b, _ = _user_with_doc(db, "beto")
+
+    with db.user_db(uid_a) as con:
+        old = db._shards[db.shard_key(uid_a)]
+        with db.user_db(uid_b):
+            pass                                    # abre el de beto y echa el de ana
+        assert db.shard_key(uid_a) not in db._shards
+        assert db._shard_stats["evicted"] >= 1
+        # La conexión prestada sigue sirviendo hasta que se devuelve
+        assert con.execute("SELECT COUNT(*) FROM documents WHERE user_id=?", (uid_a,)).fetchone()[0] == 1
+    assert old.pool._opened == 0                    # al devolverla se cerró
+
+    assert [d["id"] for d in db.get_user_documents(uid_a)] == [doc_a]
+
+
+# ── Borrado de usuarios ────────────────────────────────────────────────────────
+
+def test_delete_user_across_shards(isolated_db):
+    db = isolated_db("off")
+    uid_old, _ = _user_with_doc(db, "antiguo")
+    db = isolated_db("bucket")
+    uid_a, doc_a = _user_with_doc(db, "ana")
+    uid_b, doc_b = _user_with_doc(db, "beto")
+    db.add_cohort_members("clase", ["antiguo", "ana", "beto"])
+
+    for username, uid in (("antiguo", uid_old), ("ana", uid_a)):
+        assert db.delete_user(username)
+        shard = db._shard_path(db.shard_key(uid))
+        for table in ("documents", "user_stats", "usage_stats", "users"):
+            where = "id" if table == "users" else "user_id"
+            assert _count(shard, f"SELECT COUNT(*) FROM {table} WHERE {where}=?", (uid,)) == 0, table
+        for table, where in (("users", "id"), ("cohort_members", "user_id"), ("doc_directory", "user_id")):
+            assert _count(db.DB_PATH, f"SELECT COUNT(*) FROM {table} WHERE {where}=?", (uid,)) == 0, table
+        assert db.get_user_id(username) is None
+
+    assert db.get_document_texts(doc_a) is None
+    assert db.get_document_texts(doc_b) is not None
+    assert list(db.get_cohort_members("clase").values()) == ["beto"]
+    assert Path(db._shard_path(db.shard_key(uid_b))).exists()
@@ -0,0 +1,107 @@
+# tests/test_db_writer.py
+import sqlite3
+import threading
+
+import pytest
+
+import backend.db as db
+
+
+@pytest.fixture
+def writer(monkeypatch, tmp_path):
+    path = str(tmp_path / "writer.db")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE t(user_id INTEGER, label TEXT)")
+    con.execute("CREATE TABLE parent(id INTEGER PRIMARY KEY)")
+    con.execute("CREATE TABLE child(parent_id INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)")
+    con.commit()
+    con.close()
+    monkeypatch.setattr(db, "_write_hooks", [])
+    pool = db.ConnectionPool(path, 2)
+    wb = db.WriteBehind(pool)
+    yield wb, path
+    wb.flush(10.0)
+    pool.close()
+
+
+def _rows(path: str) -> list:
+    con = sqlite3.connect(path)
+    try:
+        return [r[0] for r in con.execute("SELECT label FROM t ORDER BY rowid")]
+    finally:
+        con.close()
+
+
+def _insert(con, user_id: int, label: str):
+    con.execute("INSERT INTO t(user_id, label) VALUES(?,?)", (user_id, label))
+    db._mark_dirty(user_id)
+    return label
+
+
+def _insert_then_fail(con, user_id: int, label: str):
+    _insert(con, user_id, label)
+    raise ValueError("tarea rota")
+
+
+def _queue_one_batch(wb, tasks: list) -> list:
+    """Encola `tasks` mientras el escritor está ocupado: salen en un solo lote."""
+    busy, release = threading.Event(), threading.Event()
+
+    def block(con):
+        busy.set()
+        release.wait(5)
+
+    first = wb.submit(block)
+    busy.wait(5)
+    futures = [wb.submit(fn, *args) for fn, *args in tasks]
+    release.set()
+    first.result(5)
+    return futures
+
+
+# ── Escritor por lotes ─────────────────────────────────────────────────────────
+
+def test_failing_task_rolls_back_only_its_savepoint(writer):
+    wb, path = writer
+    ok1, bad, ok2 = _queue_one_batch(wb, [
+        (_insert, 1, "uno"),
+        (_insert_then_fail, 2, "roto"),
+        (_insert, 3, "tres"),
+    ])
+    assert ok1.result(5) == "uno"
+    assert ok2.result(5) == "tres"
+    with pytest.raises(ValueError, match="tarea rota"):
+        bad.result(5)
+
+    assert _rows(path) == ["uno", "tres"]
+    stats = wb.stats()
+    assert stats["batches"] == 2 and stats["max_batch"] == 3
+    assert stats["errors"] == 1 and "tarea rota" in stats["last_error"]
+
+
+def test_write_hooks_fire_after_commit_and_before_waking_callers(writer):
+    wb, path = writer
+    seen = []
+
+    def hook(user_ids):
+        # Lo escrito ya es visible desde otra conexión: el lote está confirmado
+        seen.append((set(user_ids), _rows(path)))
+
+    db.add_write_hook(hook)
+    futures = _queue_one_batch(wb, [(_insert, 1, "uno"), (_insert, 2, "dos")])
+    for f in futures:
+        f.result(5)
+        assert seen, "quien espera la escritura despierta después de los hooks"
+
+    assert seen == [({1, 2}, ["uno", "dos"])]
+
+    # Un lote cuyo commit falla (FK diferida) no avisa a nadie
+    def orphan(con):
+        _insert(con, 9, "nueve")
+        con.execute("INSERT INTO child(parent_id) VALUES(42)")
+
+    seen.clear()
+    with pytest.raises(sqlite3.IntegrityError):
+        wb.submit(orphan).result(5)
+    assert seen == []
+    assert _rows(path) == ["uno", "dos"]
@@ -0,0 +1,151 @@
+# tests/test_export.py
+import sqlite3
+from datetime import date, datetime
+
+import pytest
+
+import backend.export as export
+
+pa = pytest.importorskip("pyarrow")
+ipc = pytest.importorskip("pyarrow.ipc")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _set_uploaded_at(con, doc_id: int, ts: str):
+    con.execute("UPDATE documents SET uploaded_at=? WHERE id=?", (ts, doc_id))
+
+
+def _expected_schema(columns: list, fmt: str):
+    schema = export._schema(columns)
+    if fmt == "parquet":
+        # Parquet no tiene timestamps en segundos: se guardan y leen en ms
+        schema = pa.schema([
+            (f.name, pa.timestamp("ms") if f.type == pa.timestamp("s") else f.type) for f in schema
+        ])
+    return schema
+
+
+@pytest.fixture
+def seeded(isolated_db):
+    def seed(mode: str):
+        db = isolated_db(mode)
+        months = ["2024-01-15 10:00:00", "2024-01-31 23:59:59", "2024-02-01 00:00:00"]
+        for name in ("ana", "beto"):
+            uid = db.create_user(name)
+            for i, ts in enumerate(months):
+                doc_id = db.create_document(
+                    uid, f"{name}-{i}.txt", f"h-{name}-{i}",
+                    metrics={"total_frases": 4, "frases_con_tu_impersonal": i, "custom": 1.5},
+                    event="process_text",
+                    texts={"original": f"Texto {name} {i}: si tú lees, aprendes."},
+                )
+                db.write_for_user(uid, _set_uploaded_at, doc_id, ts)
+            db.record_usage(uid, "login")
+        db.flush_writes()
+        return db
+    return seed
+
+
+def _raw(db, sql: str) -> list:
+    rows = []
+    for path in db.data_paths():
+        con = sqlite3.connect(path)
+        try:
+            rows += con.execute(sql).fetchall()
+        finally:
+            con.close()
+    return rows
+
+
+def _read(folder, fmt: str):
+    files = sorted(folder.rglob(f"*{export.FORMATS[fmt]}"))
+    assert files, folder
+    if fmt == "parquet":
+        parts = [pq.read_table(f) for f in files]
+    else:
+        parts = [ipc.open_file(pa.memory_map(str(f))).read_all() for f in files]
+    return pa.concat_tables(parts), files
+
+
+# ── Esquema y round-trip ───────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("mode", ["off", "bucket"])
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_round_trip_keeps_schema_and_rows(seeded, tmp_path, mode, fmt):
+    db = seeded(mode)
+    out = tmp_path / "export"
+    result = export.export(str(out), fmt, "none", chunk_rows=2)
+    assert not (tmp_path / "export.partial").exists()
+
+    tables = {}
+    for name, (_sql, columns, _time) in export.TABLES.items():
+        table, files = _read(out / name, fmt)
+        assert table.schema.equals(_expected_schema(columns, fmt)), name
+        assert result["tables"][name] == {"rows": table.num_rows, "files": len(files)}
+        tables[name] = table.sort_by(table.column_names[0]).to_pylist()
+    assert len(files) == len(db.data_paths())
+
+    docs = tables["documents"]
+    raw = sorted(_raw(db, "SELECT id, user_id, filename, uploaded_at FROM documents"))
+    assert [(d["document_id"], d["user_id"], d["filename"], d["uploaded_at"]) for d in docs] == [
+        (i, u, f, datetime.strptime(t, export._TS)) for i, u, f, t in raw
+    ]
+    assert {d["username"] for d in docs} == {"ana", "beto"}
+
+    assert sorted((m["document_id"], m["metric_name"], m["metric_value"]) for m in tables["metrics"]) == sorted(
+        _raw(db, "SELECT document_id, metric_name, metric_value FROM metrics")
+    )
+    assert sorted(e["event"] for e in tables["usage_stats"]) == sorted(
+        e for (e,) in _raw(db, "SELECT event FROM usage_stats")
+    )
+
+    features = {f["document_id"]: f for f in tables["document_features"]}
+    for d in docs:
+        f = features[d["document_id"]]
+        i = int(d["filename"].rsplit("-", 1)[1].split(".")[0])
+        assert f["doc_seq"] == i + 1
+        assert f["frases_con_tu_impersonal"] == i
+        assert f["tasa_tu_impersonal"] == i / 4
+        assert f["original_chars"] == len(f"Texto {d['username']} {i}: si tú lees, aprendes.".encode("utf-8"))
+        assert f["corrected_chars"] is None and f["has_final"] == 0
+
+
+def test_month_partitions_split_on_the_calendar_month(seeded, tmp_path):
+    db = seeded("off")
+    out = tmp_path / "export"
+    export.export(str(out), "parquet", "month", tables=["documents", "usage_daily"], chunk_rows=1)
+
+    months = sorted(p.name for p in (out / "documents").iterdir())
+    assert months == ["month=2024-01", "month=2024-02"]
+    jan = pq.read_table(out / "documents" / "month=2024-01")
+    feb = pq.read_table(out / "documents" / "month=2024-02")
+    assert jan.num_rows == 4 and feb.num_rows == 2
+    assert {t.month for t in jan.column("uploaded_at").to_pylist()} == {1}
+
+    # Con partición hive se lee de vuelta como un solo dataset
+    table = pq.read_table(out / "documents", partitioning="hive")
+    assert table.num_rows == 6
+    assert sorted(set(table.column("month").to_pylist())) == ["2024-01", "2024-02"]
+    assert not (out / "usage_daily").exists()      # sin filas no hay mes al que asignarlo
+
+
+def test_usage_daily_dates_round_trip(seeded, tmp_path):
+    db = seeded("off")
+    db.write(lambda con: con.execute(
+        "INSERT INTO usage_daily(user_id, day, event, n, n_value, sum_value) VALUES(1, '2024-03-09', 'login', 3, 0, 0)"
+    ))
+    out = tmp_path / "export"
+    export.export(str(out), "arrow", "none", tables=["usage_daily"])
+    table, _ = _read(out / "usage_daily", "arrow")
+    assert table.schema.field("day").type == pa.date32()
+    assert table.to_pylist() == [
+        {"user_id": 1, "day": date(2024, 3, 9), "event": "login", "n": 3, "n_value": 0, "sum_value": 0.0},
+    ]
+
+
+def test_refuses_an_existing_destination(seeded, tmp_path):
+    seeded("off")
+    with pytest.raises(ValueError, match="ya existe"):
+        export.export(str(tmp_path), "parquet")
+    with pytest.raises(ValueError, match="Tablas desconocidas"):
+        export.export(str(tmp_path / "x"), "parquet", tables=["nope"])
@@ -0,0 +1,83 @@
+# tests/test_global_feedback.py
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import backend.jobs as jobs
+import backend.main as main
+
+
+class GatedModel:
+    """Sustituto del modelo: la valoración espera a `gate` y se cuenta."""
+
+    MODEL_ID     = "stub-model"
+    MODEL_LOADED = True
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.calls = 0
+
+    def generate_global_feedback(self, **key) -> str:
+        self.calls += 1
+        self.gate.wait(5)
+        return f"Valoración de {key['total_docs']} documentos."
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+async def _wait_job(job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get_job(job_id)
+        if job["status"] in ("done", "error"):
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} sin terminar")
+
+
+# ── Caché y deduplicación ──────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_concurrent_requests_share_one_job_and_fill_the_cache(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    uid = db.create_user("ana")
+    for i in range(2):
+        db.create_document(uid, f"{i}.txt", f"h{i}", metrics={"frases_con_tu_impersonal": i})
+    fake = GatedModel()
+    monkeypatch.setattr(main, "model", fake)
+
+    async with _client() as client:
+        # Dos peticiones idénticas a la vez: un solo job
+        first, second = await asyncio.gather(
+            client.get("/users/ana/global_feedback"),
+            client.get("/users/ana/global_feedback"),
+        )
+        assert first.status_code == second.status_code == 200
+        assert first.json()["status"] in ("queued", "running")
+        assert first.json()["job_id"] == second.json()["job_id"]
+
+        fake.gate.set()
+        job = await _wait_job(first.json()["job_id"])
+        assert job["status"] == "done", job
+        assert job["result"]["feedback"] == "Valoración de 2 documentos."
+        assert fake.calls == 1
+
+        # El job dejó la valoración en la caché: la siguiente responde al momento
+        key = main._global_feedback_key(db.get_user_overview(uid))
+        assert db.get_cached_global_feedback(fake.MODEL_ID, key) == "Valoración de 2 documentos."
+        hit = (await client.get("/users/ana/global_feedback")).json()
+        assert hit["status"] == "done" and "job_id" not in hit
+        assert hit["feedback"] == "Valoración de 2 documentos."
+        assert hit["stats"] == job["result"]["stats"]
+
+        # Otro modelo no comparte la entrada; con la suya guardada también acierta
+        monkeypatch.setattr(fake, "MODEL_ID", "otro-modelo")
+        db.put_cached_global_feedback("otro-modelo", key, "Del otro modelo.")
+        hit = (await client.get("/users/ana/global_feedback")).json()
+        assert hit["status"] == "done" and hit["feedback"] == "Del otro modelo."
+    assert fake.calls == 1
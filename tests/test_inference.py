@@ -0,0 +1,83 @@
+# tests/test_inference.py
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import backend.inference as inference
+
+
+# ── Clave del servidor de inferencia ───────────────────────────────────────────
+
+@pytest.fixture
+def key_file(monkeypatch, tmp_path):
+    path = tmp_path / "palabria" / "inference.key"
+    monkeypatch.delenv("INFERENCE_AUTHKEY", raising=False)
+    monkeypatch.setattr(inference, "INFERENCE_AUTHKEY_FILE", str(path))
+    return path
+
+
+def test_env_key_wins(monkeypatch, key_file):
+    monkeypatch.setenv("INFERENCE_AUTHKEY", "clave-de-entorno")
+    assert inference.load_authkey(create=True) == b"clave-de-entorno"
+    assert not key_file.exists()
+
+
+def test_server_creates_private_key_file_and_client_reads_it(key_file):
+    server_key = inference.load_authkey(create=True)
+    assert len(server_key) == 64
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert inference.load_authkey() == server_key
+    assert inference.load_authkey(create=True) == server_key      # no se regenera
+    assert os.listdir(key_file.parent) == ["inference.key"]
+
+
+def test_client_refuses_to_start_without_key(key_file):
+    with pytest.raises(RuntimeError, match="INFERENCE_AUTHKEY"):
+        inference.load_authkey()
+    with pytest.raises(RuntimeError, match="INFERENCE_AUTHKEY"):
+        inference.RemoteModel("127.0.0.1:6001")
+
+
+def test_key_file_readable_by_others_is_refused(key_file):
+    inference.load_authkey(create=True)
+    os.chmod(key_file, 0o644)
+    with pytest.raises(RuntimeError, match="chmod 600"):
+        inference.load_authkey()
+
+
+# ── Estado del modelo sin bloquear al que pregunta ─────────────────────────────
+
+def _until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "no llegó el estado esperado"
+        time.sleep(0.02)
+
+
+def test_status_properties_do_not_block_on_a_stalled_server(monkeypatch):
+    monkeypatch.setenv("INFERENCE_AUTHKEY", "clave")
+    with socket.create_server(("127.0.0.1", 0)) as stalled:     # acepta TCP y nunca responde al handshake
+        remote = inference.RemoteModel(f"127.0.0.1:{stalled.getsockname()[1]}")
+        started = time.monotonic()
+        assert remote.MODEL_LOADED is False
+        assert remote.LOAD_PROGRESS == 0
+        assert remote.MODEL_ID is None
+        assert "Conectando" in remote.LOAD_MESSAGE
+        assert time.monotonic() - started < 0.1
+
+
+def test_status_arrives_from_the_server_in_the_background(monkeypatch, tmp_path):
+    monkeypatch.setenv("INFERENCE_AUTHKEY", "clave")
+    address = str(tmp_path / "inference.sock")
+    server = inference.Server(address)
+    threading.Thread(target=server.serve_forever, kwargs={"load": False}, daemon=True).start()
+    _until(lambda: os.path.exists(address))
+
+    remote = inference.RemoteModel(address)
+    _until(lambda: remote.MODEL_ID is not None)
+    assert remote.MODEL_ID == server.model.MODEL_ID
+    assert remote.MODEL_LOADED is False
@@ -0,0 +1,111 @@
+# tests/test_pipeline.py
+import asyncio
+import threading
+import time
+import uuid
+
+import httpx
+import pytest
+
+import backend.main as main
+import backend.pipeline as pipeline
+from backend.db import create_user
+
+
+class SlowModel:
+    """Sustituto del modelo: cada corrección tarda `delay` segundos y se cuenta."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def correct_full_text(self, text: str) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return text.replace("tú", "se")
+
+    def schedule_feedback(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def slow_model(monkeypatch):
+    fake = SlowModel(delay=1.0)
+    monkeypatch.setattr(pipeline, "model", fake)
+    monkeypatch.setattr(pipeline, "_detect", lambda text: ([], 1))
+    monkeypatch.setattr(pipeline, "word_levenshtein_count", lambda a, b: 0)
+    return fake
+
+
+@pytest.fixture
+def username():
+    name = "u" + uuid.uuid4().hex[:10]
+    create_user(name)
+    return name
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+# ── Event loop libre durante una corrección ────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_status_and_heartbeat_respond_during_correction(slow_model, username):
+    async with _client() as client:
+        processing = asyncio.create_task(
+            client.post("/process_text/", data={"username": username, "text": "Si tú lees, aprendes."})
+        )
+        await asyncio.sleep(0.2)    # la corrección ya está en el hilo de GPU
+
+        for _ in range(5):
+            t0 = time.perf_counter()
+            r = await client.get("/status/")
+            assert r.status_code == 200
+            assert time.perf_counter() - t0 < 0.25
+
+            t0 = time.perf_counter()
+            r = await client.post("/users/heartbeat", data={"username": username})
+            assert r.status_code == 200
+            assert time.perf_counter() - t0 < 0.25
+
+        assert not processing.done()
+        r = await processing
+    assert r.status_code == 200
+    assert r.json()["corrected"] == "Si se lees, aprendes."
+
+
+# ── Single-flight por delante de la admisión ───────────────────────────────────
+
+@pytest.mark.anyio
+async def test_identical_concurrent_submissions_run_one_generation(slow_model, username):
+    text = f"Cuando tú escribes {uuid.uuid4().hex}, tú piensas."
+    async with _client() as client:
+        first, second = await asyncio.gather(
+            client.post("/process_text/", data={"username": username, "text": text}),
+            client.post("/process_text/", data={"username": username, "text": text}),
+        )
+    assert first.status_code == second.status_code == 200
+    assert first.json()["doc_id"] != second.json()["doc_id"]
+    assert slow_model.calls == 1
+    assert main.admission.get_stats()["correction"]["running"] == 0
+
+
+@pytest.mark.anyio
+async def test_identical_jobs_run_one_generation(slow_model, username):
+    text = f"Si tú lees {uuid.uuid4().hex}, aprendes."
+    async with _client() as client:
+        ids = [
+            (await client.post("/jobs", data={"username": username, "text": text})).json()["job_id"]
+            for _ in range(2)
+        ]
+        for _ in range(50):
+            states = [(await client.get(f"/jobs/{job_id}")).json()["status"] for job_id in ids]
+            if all(s in ("done", "error") for s in states):
+                break
+            await asyncio.sleep(0.1)
+    assert states == ["done", "done"]
+    assert slow_model.calls == 1
+    assert main.admission.get_stats()["correction"]["running"] == 0
@@ -0,0 +1,116 @@
+# tests/test_prefork.py
+import gc
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+import backend.prefork as prefork
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _in_child(fn, timeout: float = 30.0) -> tuple:
+    """Ejecuta fn() en un proceso hijo (fork); devuelve (código de salida, salida)."""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        code = 1
+        try:
+            os.write(w, str(fn()).encode())
+            code = 0
+        finally:
+            os._exit(code)
+    os.close(w)
+    deadline = time.monotonic() + timeout
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() > deadline:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            pytest.fail("el hijo no terminó la inferencia (¿pool de hilos heredado del padre?)")
+        time.sleep(0.05)
+    with os.fdopen(r, "rb") as f:
+        out = f.read().decode()
+    return os.waitstatus_to_exitcode(status), out
+
+
+# ── Precarga del modelo antes del fork ─────────────────────────────────────────
+
+@pytest.fixture
+def preload_sandbox(monkeypatch):
+    """
+    Entorno sin OMP_NUM_THREADS ni PALABRIA_MODEL_DEVICE y backend.model sin
+    importar; al terminar se restauran el entorno, el módulo que hubiera y el gc.
+    """
+    import backend
+    for name in ("OMP_NUM_THREADS", "PALABRIA_MODEL_DEVICE"):
+        monkeypatch.setenv(name, "-")       # setenv guarda el valor original (o su ausencia)
+        monkeypatch.delenv(name)
+    saved = sys.modules.pop("backend.model", None)
+    backend.__dict__.pop("model", None)
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+        gc.enable()
+        sys.modules.pop("backend.model", None)
+        backend.__dict__.pop("model", None)
+        if saved is not None:
+            sys.modules["backend.model"] = saved
+            backend.model = saved
+
+
+def test_preload_pins_torch_threads_before_loading_model(monkeypatch, preload_sandbox):
+    import torch
+    import backend.model as model       # importación nueva: lee el entorno vacío
+
+    calls = []
+    monkeypatch.setattr(torch, "set_num_threads", lambda n: calls.append(("threads", n)))
+    monkeypatch.setattr(torch, "set_num_interop_threads", lambda n: calls.append(("interop", n)))
+    monkeypatch.setattr(model, "ensure_model_loaded", lambda async_load=True: calls.append(("load", async_load)))
+    monkeypatch.setattr(model, "MODEL_LOADED", True)
+    monkeypatch.setattr(model, "correct_full_text", lambda text: text.replace("tú", "se"))
+    prefork.preload(load_model=True)
+
+    assert calls == [("threads", 1), ("interop", 1), ("load", False)]
+    assert os.environ["OMP_NUM_THREADS"] == "1"
+    assert os.environ["PALABRIA_MODEL_DEVICE"] == "cpu"
+    assert gc.get_freeze_count() > 0 and gc.isenabled()
+    assert _in_child(lambda: model.correct_full_text("Si tú lees, aprendes.")) == (0, "Si se lees, aprendes.")
+
+
+def test_forked_worker_runs_inference_with_real_torch():
+    torch = pytest.importorskip("torch")
+    if not hasattr(torch, "nn"):
+        pytest.skip("torch no está instalado (sustituto mínimo de conftest)")
+    script = textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {ROOT!r})
+        from backend.prefork import _pin_torch_threads
+        _pin_torch_threads()
+        import torch
+
+        layer = torch.nn.Linear(512, 512)
+        x = torch.randn(64, 512)
+        with torch.inference_mode():
+            layer(x)                    # el padre ya ha usado el modelo antes del fork
+
+        pid = os.fork()
+        if pid == 0:
+            torch.set_num_threads(2)    # lo que hace prefork._worker
+            with torch.inference_mode():
+                y = layer(x)
+            os._exit(0 if tuple(y.shape) == (64, 512) else 1)
+        _, status = os.waitpid(pid, 0)
+        sys.exit(os.waitstatus_to_exitcode(status))
+    """)
+    env = {k: v for k, v in os.environ.items() if k != "OMP_NUM_THREADS"}
+    proc = subprocess.run([sys.executable, "-c", script], env=env, timeout=120, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
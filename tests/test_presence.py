@@ -0,0 +1,86 @@
+# tests/test_presence.py
+import pytest
+
+import backend.presence as presence
+
+
+@pytest.fixture
+def fresh_presence(monkeypatch):
+    monkeypatch.setattr(presence, "_last_seen", {})
+    monkeypatch.setattr(presence, "_stats", {"heartbeats": 0, "flushes": 0, "rows_flushed": 0, "last_flush": None})
+
+
+def _sessions(db, uid: int) -> list:
+    db.flush_writes()
+    with db.user_db(uid) as con:
+        return [
+            tuple(r) for r in con.execute(
+                "SELECT started_at, last_seen, ended_at FROM sessions WHERE user_id=? ORDER BY id", (uid,)
+            ).fetchall()
+        ]
+
+
+# ── Volcado de latidos ─────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("mode", ["off", "bucket"])
+def test_flush_writes_the_latest_heartbeat_of_each_open_session(isolated_db, fresh_presence, mode):
+    db = isolated_db(mode)
+    ana, beto, carla = (db.create_user(u) for u in ("ana", "beto", "carla"))
+    db.record_login_ts(ana, 1000.0)
+    db.record_login_ts(beto, 1000.0)
+    db.record_login_ts(carla, 1000.0)
+    db.close_open_session(carla, 1100.0)            # carla ya cerró
+
+    presence.touch(ana, 1200.0)
+    presence.touch(ana, 1150.0)                     # llega tarde: no retrocede
+    presence.touch(beto, 1300.0)
+    presence.touch(carla, 1400.0)
+    assert _sessions(db, ana)[0][1] == 1000.0       # nada en la DB hasta el volcado
+    assert presence.get_stats()["pending"] == 3
+
+    assert presence.flush() == 3
+    assert _sessions(db, ana) == [(1000.0, 1200.0, None)]
+    assert _sessions(db, beto) == [(1000.0, 1300.0, None)]
+    assert _sessions(db, carla) == [(1000.0, 1000.0, 1100.0)]
+    stats = presence.get_stats()
+    assert (stats["heartbeats"], stats["flushes"], stats["rows_flushed"], stats["pending"]) == (4, 1, 3, 0)
+    assert presence.flush() == 0
+
+    # La sesión abandonada termina en el último latido volcado
+    db.close_open_session(ana, 1200.0 + 3600, idle_grace=1800)
+    assert _sessions(db, ana) == [(1000.0, 1200.0, 1200.0)]
+
+
+def test_flush_of_one_user_leaves_the_rest_pending(isolated_db, fresh_presence):
+    db = isolated_db("off")
+    ana, beto = db.create_user("ana"), db.create_user("beto")
+    db.record_login_ts(ana, 1000.0)
+    db.record_login_ts(beto, 1000.0)
+    presence.touch(ana, 1100.0)
+    presence.touch(beto, 1100.0)
+
+    assert presence.flush(ana) == 1
+    assert presence.flush(ana) == 0
+    assert _sessions(db, ana)[0][1] == 1100.0
+    assert _sessions(db, beto)[0][1] == 1000.0
+    assert presence.get_stats()["pending"] == 1
+
+
+def test_failed_flush_keeps_the_heartbeats(isolated_db, fresh_presence, monkeypatch):
+    db = isolated_db("off")
+    ana = db.create_user("ana")
+    db.record_login_ts(ana, 1000.0)
+    presence.touch(ana, 1100.0)
+
+    def broken(items):
+        presence.touch(ana, 1050.0)     # latido que entra durante el volcado fallido
+        raise RuntimeError("disco lleno")
+
+    monkeypatch.setattr(presence, "touch_sessions", broken)
+    with pytest.raises(RuntimeError):
+        presence.flush()
+    assert presence._last_seen == {ana: 1100.0}
+
+    monkeypatch.setattr(presence, "touch_sessions", db.touch_sessions)
+    assert presence.flush() == 1
+    assert _sessions(db, ana)[0][1] == 1100.0
@@ -0,0 +1,71 @@
+# tests/test_respcache.py
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import backend.main as main
+import backend.respcache as respcache
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+class _Tomorrow(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz) + timedelta(days=1)
+
+
+# ── Revalidación con ETag ──────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/users/ana/overview", "/users/ana/documents", "/users/ana/weekly_activity"])
+async def test_etag_revalidation(isolated_db, monkeypatch, path):
+    db = isolated_db("off")
+    uid = db.create_user("ana")
+    db.create_document(uid, "a.txt", "h1", metrics={"total_frases": 3}, event="process_text")
+
+    async with _client() as client:
+        first = await client.get(path)
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "no-cache"
+
+        again = await client.get(path, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.headers["ETag"] == etag and again.content == b""
+        r = await client.get(path, headers={"If-None-Match": f'W/{etag}, "otro"'})
+        assert r.status_code == 304
+
+        # Una escritura del usuario cambia la etiqueta
+        db.create_document(uid, "b.txt", "h2", metrics={"total_frases": 5}, event="process_text")
+        after_write = await client.get(path, headers={"If-None-Match": etag})
+        assert after_write.status_code == 200
+        assert after_write.headers["ETag"] != etag
+        if path.endswith("/documents"):
+            assert len(after_write.json()["documents"]) == 2
+        etag = after_write.headers["ETag"]
+
+        # Y el cambio de día también, aunque no haya escrituras
+        assert (await client.get(path, headers={"If-None-Match": etag})).status_code == 304
+        monkeypatch.setattr(respcache, "datetime", _Tomorrow)
+        next_day = await client.get(path, headers={"If-None-Match": etag})
+        assert next_day.status_code == 200
+        assert next_day.headers["ETag"] != etag
+
+
+@pytest.mark.anyio
+async def test_other_users_writes_keep_the_etag(isolated_db):
+    db = isolated_db("off")
+    ana, beto = db.create_user("ana"), db.create_user("beto")
+    db.create_document(ana, "a.txt", "h1")
+
+    async with _client() as client:
+        etag = (await client.get("/users/ana/overview")).headers["ETag"]
+        hits = respcache.get_stats()["not_modified"]
+        db.create_document(beto, "b.txt", "h2")
+        r = await client.get("/users/ana/overview", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert respcache.get_stats()["not_modified"] == hits + 1
@@ -0,0 +1,23 @@
+# tests/test_shared.py
+import pytest
+
+import backend.shared as shared
+
+
+# ── Despliegue con varios workers ──────────────────────────────────────────────
+
+@pytest.mark.parametrize("argv, env, expected", [
+    (["/usr/bin/uvicorn", "backend.main:app"], None, 1),
+    (["/usr/bin/uvicorn", "backend.main:app", "--workers", "4"], None, 4),
+    (["/usr/bin/uvicorn", "backend.main:app", "--workers=2"], None, 2),
+    (["/usr/lib/python3/site-packages/uvicorn/__main__.py", "backend.main:app"], "3", 3),
+    (["/srv/palabria/backend/prefork.py", "--workers", "8"], None, 1),
+    (["/usr/bin/pytest", "-q"], "4", 1),
+])
+def test_uvicorn_workers(monkeypatch, argv, env, expected):
+    monkeypatch.setattr(shared.sys, "argv", argv)
+    if env is None:
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    else:
+        monkeypatch.setenv("WEB_CONCURRENCY", env)
+    assert shared.uvicorn_workers() == expected
@@ -0,0 +1,88 @@
+# tests/test_trends.py
+import pytest
+
+import backend.trends as trends
+
+
+def _docs(db, username: str, has_tu: list) -> int:
+    """Un documento por valor (en orden); None = documento sin métricas."""
+    uid = db.create_user(username)
+    for i, tu in enumerate(has_tu):
+        metrics = None if tu is None else {"total_frases": 4, "frases_con_tu_impersonal": 2 * tu}
+        db.create_document(uid, f"{i}.txt", f"{username}-{i}", metrics=metrics)
+    return uid
+
+
+# ── Pendiente ──────────────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("ys, slope", [
+    ([], 0.0),
+    ([1], 0.0),
+    ([1, 1, 1, 1], 0.0),
+    ([0, 1], 1.0),
+    ([0, 0, 1], 0.5),
+    ([1, 1, 0, 0], -0.4),
+    ([1, 0, 1, 0, 1, 0], -3 / 35),
+])
+def test_slope(ys, slope):
+    assert trends._slope(ys) == pytest.approx(slope)
+
+
+# ── Umbrales de evolución ──────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("n, change_pp, expected", [
+    (2, -100.0, "insuficiente"),
+    (3, -100.0, "mejora"),
+    (3, -15.0, "mejora"),
+    (3, -14.9, "estable"),
+    (3, 0.0, "estable"),
+    (3, 14.9, "estable"),
+    (3, 15.0, "empeora"),
+])
+def test_evolucion_thresholds(monkeypatch, n, change_pp, expected):
+    monkeypatch.setattr(trends, "MIN_DOCS", 3)
+    monkeypatch.setattr(trends, "CHANGE_PP", 15.0)
+    assert trends._evolucion(n, change_pp) == expected
+
+
+def test_compute_from_the_document_sequence(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    monkeypatch.setattr(trends, "WINDOW", 2)
+    uid = _docs(db, "ana", [1, 1, 0, None])     # sin métricas cuenta como sin 'tú'
+
+    t = trends.compute(uid)
+    assert (t["docs"], t["rate"], t["recent_rate"]) == (4, 50.0, 0.0)
+    assert t["slope_per_doc"] == -40.0
+    assert t["change_pp"] == -120.0             # la recta a lo largo de los 4 documentos
+    assert t["evolucion"] == "mejora"
+    assert [s["rolling_rate"] for s in t["series"]] == [100.0, 100.0, 50.0, 0.0]
+    assert [s["has_tu"] for s in t["series"]] == [True, True, False, False]
+
+
+@pytest.mark.parametrize("change_pp, expected", [(100.0, "empeora"), (100.1, "estable")])
+def test_compute_threshold_is_inclusive(isolated_db, monkeypatch, change_pp, expected):
+    db = isolated_db("off")
+    uid = _docs(db, "ana", [0, 0, 1])           # pendiente 0.5 → +100 pp en 3 documentos
+    monkeypatch.setattr(trends, "CHANGE_PP", change_pp)
+    t = trends.compute(uid)
+    assert t["change_pp"] == 100.0
+    assert t["evolucion"] == expected
+
+
+def test_too_few_documents(isolated_db):
+    db = isolated_db("off")
+    uid = _docs(db, "ana", [1, 0])
+    t = trends.compute(uid)
+    assert t["change_pp"] == -100.0 and t["evolucion"] == "insuficiente"
+    empty = trends.compute(db.create_user("beto"))
+    assert (empty["docs"], empty["rate"], empty["change_pp"], empty["evolucion"]) == (0, 0.0, 0.0, "insuficiente")
+
+
+def test_get_trend_follows_new_documents(isolated_db):
+    db = isolated_db("off")
+    uid = _docs(db, "ana", [0, 0, 0])
+    assert trends.get_trend(uid)["evolucion"] == "estable"
+    assert trends.get_trend(uid) is trends.get_trend(uid)
+    db.create_document(uid, "3.txt", "ana-3", metrics={"total_frases": 4, "frases_con_tu_impersonal": 1})
+    t = trends.get_trend(uid)
+    assert t["docs"] == 4 and t["change_pp"] == 90.0 and t["evolucion"] == "empeora"
@@ -0,0 +1,34 @@
+# tests/test_users_api.py
+import httpx
+import pytest
+
+import backend.main as main
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+# ── Nombres de usuario no válidos en la ruta ───────────────────────────────────
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", [
+    "/users/{}/overview",
+    "/users/{}/documents",
+    "/users/{}/weekly_activity",
+    "/users/{}/activity",
+    "/users/{}/trend",
+    "/users/{}/global_feedback",
+])
+async def test_invalid_username_is_400(path):
+    async with _client() as client:
+        r = await client.get(path.format("mal%20nombre!"))
+    assert r.status_code == 400, r.text
+    assert "username inválido" in r.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_unknown_username_is_404():
+    async with _client() as client:
+        r = await client.get("/users/no_existe_nunca/overview")
+    assert r.status_code == 404
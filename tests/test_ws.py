@@ -0,0 +1,182 @@
+# tests/test_ws.py
+import asyncio
+import json
+
+import pytest
+
+import backend.events as events
+import backend.jobs as jobs
+import backend.main as main
+
+
+class FakeModel:
+    """Sustituto del modelo con feedback ya terminado para los doc_id de `done`."""
+
+    MODEL_LOADED = True
+    LOAD_PROGRESS = 100
+    LOAD_MESSAGE = "listo"
+
+    def __init__(self, done: dict):
+        self.done = done
+
+    def get_feedback_status(self, doc_id: int) -> dict:
+        if doc_id in self.done:
+            return {"status": "done", "result": self.done[doc_id]}
+        return {"status": "running", "result": ""}
+
+
+class WS:
+    """Cliente WebSocket mínimo que habla ASGI con la app en este mismo event loop."""
+
+    def __init__(self, query: str):
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws",
+            "path": "/ws", "raw_path": b"/ws", "root_path": "", "query_string": query.encode(),
+            "headers": [], "server": ("test", 80), "client": ("test", 1), "subprotocols": [],
+        }
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(main.app(self._scope, self._inbox.get, self._outbox.put))
+        await self._inbox.put({"type": "websocket.connect"})
+        msg = await asyncio.wait_for(self._outbox.get(), 2)
+        assert msg["type"] == "websocket.accept", msg
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, 2)
+
+    async def send_json(self, data: dict):
+        await self._inbox.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive_json(self) -> dict:
+        msg = await asyncio.wait_for(self._outbox.get(), 2)
+        assert msg["type"] == "websocket.send", msg
+        return json.loads(msg["text"])
+
+
+@pytest.fixture
+def ws_app(isolated_db, monkeypatch):
+    db = isolated_db("off")
+    monkeypatch.setattr(main, "model", FakeModel({7: "Muy bien."}))
+    return db
+
+
+async def _deferred_logouts():
+    if main._ws_tasks:
+        await asyncio.wait_for(asyncio.gather(*list(main._ws_tasks)), 2)
+
+
+def _open_sessions(db, uid: int) -> int:
+    db.flush_writes()
+    with db.user_db(uid) as con:
+        return con.execute("SELECT COUNT(*) FROM sessions WHERE user_id=? AND ended_at IS NULL", (uid,)).fetchone()[0]
+
+
+# ── Eventos ────────────────────────────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_unknown_user_is_refused(ws_app):
+    ws = WS("username=nadie")
+    ws._task = asyncio.ensure_future(main.app(ws._scope, ws._inbox.get, ws._outbox.put))
+    await ws._inbox.put({"type": "websocket.connect"})
+    assert (await asyncio.wait_for(ws._outbox.get(), 2))["type"] == "websocket.close"
+    await ws._task
+
+
+@pytest.mark.anyio
+async def test_watch_doc_sends_current_and_later_feedback(ws_app):
+    ws_app.create_user("ana")
+    async with WS("username=ana&watch_only=true") as ws:
+        assert await ws.receive_json() == {"type": "model", "modelo_listo": True, "progress": 100, "message": "listo"}
+
+        await ws.send_json({"type": "watch", "doc_id": 7})      # ya terminado: llega al momento
+        assert await ws.receive_json() == {"type": "feedback", "doc_id": 7, "status": "done", "result": "Muy bien."}
+
+        await ws.send_json({"type": "watch", "doc_id": 8})      # en curso: nada hasta que se publique
+        await ws.send_json({"type": "watch", "doc_id": 7})      # ida y vuelta: el watch del 8 ya entró
+        assert (await ws.receive_json())["doc_id"] == 7
+        events.publish_doc(9, {"type": "feedback", "doc_id": 9, "status": "done"})
+        events.publish_doc(8, {"type": "feedback", "doc_id": 8, "status": "done", "result": "Bien."})
+        assert await ws.receive_json() == {"type": "feedback", "doc_id": 8, "status": "done", "result": "Bien."}
+
+
+@pytest.mark.anyio
+async def test_watch_job_follows_its_progress(ws_app):
+    ws_app.create_user("ana")
+    gate = asyncio.Event()
+
+    async def work(on_stage):
+        await gate.wait()
+        on_stage("generating")
+        return "ok"
+
+    theirs = jobs.submit(work, kind="test", username="beto")
+    mine = jobs.submit(work, kind="test", username="ana")
+    async with WS("username=ana&watch_only=true") as ws:
+        assert (await ws.receive_json())["type"] == "model"
+
+        # El job de otro usuario no se envía; el feedback vigilado después sí
+        await ws.send_json({"type": "watch", "job_id": theirs})
+        await ws.send_json({"type": "watch", "doc_id": 7})
+        assert (await ws.receive_json())["type"] == "feedback"
+
+        await ws.send_json({"type": "watch", "job_id": mine})
+        current = await ws.receive_json()
+        assert current["type"] == "job" and current["job_id"] == mine
+        assert current["status"] in ("queued", "running") and current["error"] is None
+
+        gate.set()
+        seen = []
+        while not seen or seen[-1][0] != "done":
+            e = await ws.receive_json()
+            assert e["type"] == "job" and e["job_id"] == mine and e["kind"] == "test"
+            seen.append((e["status"], e["stage"]))
+    assert ("running", "generating") in seen
+    assert seen[-1] == ("done", "done")
+
+
+# ── Presencia y cierre de sesión ───────────────────────────────────────────────
+
+@pytest.mark.anyio
+async def test_disconnect_closes_the_session_after_the_grace(ws_app, monkeypatch):
+    db = ws_app
+    monkeypatch.setattr(events, "LOGOUT_GRACE", 0)
+    uid = db.create_user("ana")
+    db.record_login_ts(uid, 1000.0)
+
+    async with WS("username=ana&watch_only=true"):
+        pass
+    await _deferred_logouts()
+    assert _open_sessions(db, uid) == 1          # watch_only no es presencia
+
+    async with WS("username=ana") as ws:
+        assert (await ws.receive_json())["type"] == "model"
+        assert events.is_connected("ana")
+    await _deferred_logouts()
+    assert not events.is_connected("ana")
+    assert _open_sessions(db, uid) == 0
+    with db.user_db(uid) as con:
+        ended, last_seen = con.execute("SELECT ended_at, last_seen FROM sessions WHERE user_id=?", (uid,)).fetchone()
+    assert ended is not None and last_seen > 1000.0     # el latido de la conexión se volcó antes de cerrar
+
+
+@pytest.mark.anyio
+async def test_reconnect_within_the_grace_keeps_the_session(ws_app, monkeypatch):
+    db = ws_app
+    monkeypatch.setattr(events, "LOGOUT_GRACE", 0.2)
+    uid = db.create_user("ana")
+    db.record_login_ts(uid, 1000.0)
+
+    async with WS("username=ana"):
+        pass
+    async with WS("username=ana") as ws:         # recarga de la pestaña
+        await ws.receive_json()
+        await asyncio.sleep(0.3)
+        await _deferred_logouts()
+        assert _open_sessions(db, uid) == 1
+    await _deferred_logouts()
+    assert _open_sessions(db, uid) == 0